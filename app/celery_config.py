@@ -7,7 +7,7 @@ from celery.schedules import crontab
 from app.config import settings
 import redis
 
-WS_MESSAGE_CHANNEL = settings.WS_MESSAGE_CHANNEL
+WS_EVENT_STREAM = settings.WS_EVENT_STREAM
 
 try:
     redis_client_for_celery_config = redis.Redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
@@ -25,6 +25,7 @@ celery_app = Celery(
     include=[
         'app.tasks.portion_tasks',
         'app.tasks.report_tasks',
+        'app.tasks.dispatch',
     ]
 )
 
@@ -47,8 +48,13 @@ celery_app.conf.beat_schedule = {
         'options': {'queue': 'reports_queue'}
     },
     'recalculate-possible-portions-schedule': {
-        'task': 'app.tasks.portion_tasks.task_update_all_possible_meal_portions_celery',
-        'schedule': crontab(minute='*/30'),
+        'task': 'kindergarten.portions.update_all_possible',
+        'schedule': crontab(minute=15, hour='*/3'), # Xavfsizlik tarmog'i: asosiy yangilanishlar o'zgarishga bog'liq (incremental)
+        'options': {'queue': 'portions_queue'}
+    },
+    'reconcile-product-stock-schedule': {
+        'task': 'kindergarten.stock.reconcile',
+        'schedule': crontab(hour=2, minute=30), # Har kuni 02:30 da balanslarni jurnal bilan solishtirish
         'options': {'queue': 'portions_queue'}
     },
 }
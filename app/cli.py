@@ -0,0 +1,157 @@
+# app/cli.py
+"""
+Bir martalik boshqaruv buyruqlari. Deploy paytida web va Celery workerlardan oldin bir marta ishga tushiriladi
+(workerlar faqat sxema versiyasini tekshiradi):
+
+    python -m app.cli setup            # migrate + seed + portions + stock-rebuild (yangi yoki yangilangan muhit)
+    python -m app.cli migrate          # Alembic migratsiyalari (eski create_all bazasi avval stamp qilinadi)
+    python -m app.cli seed             # Rollar, admin, birliklar, bildirishnoma turlari (idempotent)
+    python -m app.cli portions         # PossibleMeals bo'sh bo'lsa hisoblaydi (--force - har doim)
+    python -m app.cli stock-rebuild    # product_stock balanslarini kirim/sarf jurnallari bilan solishtirib tuzatadi
+    python -m app.cli check            # Baza sxemasi kod bilan bir xil revisionda ekanini tekshiradi
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from sqlalchemy import inspect
+
+from app import crud, models
+from app.database import (
+    engine, SessionLocal, MIGRATIONS_DIR, ALEMBIC_VERSION_TABLE,
+    get_current_revision, get_head_revision, verify_schema_version
+)
+from app.utils import create_initial_data
+
+ALEMBIC_INI_PATH = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+# Migratsiya tarixi yo'q (create_all yaratgan) bazalar uchun: qaysi jadvallar bo'lsa, qaysi revisionga teng.
+# Yangisidan eskisiga qarab tekshiriladi.
+LEGACY_TABLES = {
+    "roles", "users", "units", "products", "product_deliveries", "meals", "meal_ingredients", "meal_servings",
+    "serving_details", "notification_types", "notifications", "monthly_reports", "report_meal_performance",
+    "report_ingredient_details", "possible_meals", "product_monthly_balances", "audit_logs",
+}
+LEGACY_REVISIONS = [
+    ("0002", LEGACY_TABLES | {"product_stock"}),
+    ("0001", LEGACY_TABLES),
+]
+
+
+def _alembic_config():
+    from alembic.config import Config  # Faqat migratsiya buyruqlari uchun (web worker alembic import qilmaydi)
+
+    config = Config(str(ALEMBIC_INI_PATH)) if ALEMBIC_INI_PATH.exists() else Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    return config
+
+
+def _verify_migration_numbering(config) -> None:
+    """Workerlar head ni fayl nomlaridan aniqlaydi - bu Alembicning haqiqiy head revisioni bilan mos bo'lishi shart."""
+    from alembic.script import ScriptDirectory
+
+    script_heads = ScriptDirectory.from_config(config).get_heads()
+    if script_heads != [get_head_revision()]:
+        raise RuntimeError(f"Migration heads {script_heads} do not match the numbered head {get_head_revision()}; "
+                           f"revisions must form a single sequentially numbered chain.")
+
+
+def migrate(revision: str = "head") -> None:
+    from alembic import command
+
+    config = _alembic_config()
+    _verify_migration_numbering(config)
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        existing_tables = set(inspect(connection).get_table_names())
+        if ALEMBIC_VERSION_TABLE not in existing_tables and existing_tables & LEGACY_TABLES:
+            legacy_revision = next((rev for rev, tables in LEGACY_REVISIONS if tables <= existing_tables), None)
+            if legacy_revision is None:
+                raise RuntimeError(f"Existing database without migration history is missing tables "
+                                   f"{sorted(LEGACY_TABLES - existing_tables)}; it cannot be stamped.")
+            # Keyingi revisionlar (masalan, indekslar) eski bazada qisman mavjud bo'lsa ham qayta yaratilmaydi
+            print(f"INFO:     Existing database without migration history, stamping revision {legacy_revision}.")
+            command.stamp(config, legacy_revision)
+        command.upgrade(config, revision)
+    print(f"INFO:     Database schema is at revision {get_current_revision(engine)}.")
+
+
+def seed() -> None:
+    db = SessionLocal()
+    try:
+        create_initial_data(db)
+    finally:
+        db.close()
+
+
+def calculate_portions(force: bool = False) -> None:
+    db = SessionLocal()
+    try:
+        if not force:
+            if db.query(models.Meal).count() == 0:
+                print("INFO:     No meals defined, skipping possible portions calculation.")
+                return
+            if db.query(models.PossibleMeals).count() > 0:
+                print("INFO:     Possible portions already calculated, skipping (use --force to recalculate).")
+                return
+        meal_ids = crud.update_all_possible_meal_portions(db)
+        print(f"INFO:     Possible portions calculated for {len(meal_ids)} meal(s).")
+    finally:
+        db.close()
+
+
+def rebuild_stock() -> None:
+    db = SessionLocal()
+    try:
+        drift_entries = crud.rebuild_product_stock(db, fix=True)
+    finally:
+        db.close()
+    for entry in drift_entries:
+        print(f"WARN:     Product {entry['product_id']} stock balance rebuilt: "
+              f"{entry['stored_quantity']} -> {entry['ledger_quantity']}")
+    print(f"INFO:     Product stock balances checked, {len(drift_entries)} rebuilt.")
+
+
+def check() -> None:
+    _verify_migration_numbering(_alembic_config())
+    print(f"INFO:     Database schema revision {verify_schema_version(engine)} matches the code.")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("setup", help="migrate + seed + portions + stock-rebuild")
+    migrate_parser = subparsers.add_parser("migrate", help="Alembic migratsiyalarini bajarish")
+    migrate_parser.add_argument("--revision", default="head")
+    subparsers.add_parser("seed", help="Boshlang'ich ma'lumotlarni yaratish")
+    portions_parser = subparsers.add_parser("portions", help="PossibleMeals ni hisoblash")
+    portions_parser.add_argument("--force", action="store_true", help="Jadval to'la bo'lsa ham qayta hisoblash")
+    subparsers.add_parser("stock-rebuild", help="product_stock balanslarini qayta qurish")
+    subparsers.add_parser("check", help="Sxema versiyasini tekshirish")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "setup":
+            migrate()
+            seed()
+            calculate_portions()
+            rebuild_stock()
+        elif args.command == "migrate":
+            migrate(args.revision)
+        elif args.command == "seed":
+            seed()
+        elif args.command == "portions":
+            calculate_portions(args.force)
+        elif args.command == "stock-rebuild":
+            rebuild_stock()
+        elif args.command == "check":
+            check()
+    except Exception as e:
+        print(f"ERROR:    '{args.command}' failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 # app/config.py
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -9,6 +11,25 @@ class Settings(BaseSettings):
 
     # Ma'lumotlar bazasi
     DATABASE_URL: str
+    # Asinxron endpointlar uchun URL (bo'sh bo'lsa DATABASE_URL dan: sqlite+aiosqlite / postgresql+asyncpg)
+    ASYNC_DATABASE_URL: Optional[str] = None
+    # Ulanishlar pooli (PostgreSQL va fayldagi SQLite); pre_ping/recycle faqat PostgreSQL uchun
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE_SECONDS: int = 1800  # Server/proxy jim ulanishlarni uzishidan oldin yangilash
+    # SQLite PRAGMA profili (har bir ulanishda qo'llanadi; bo'sh qiymat - PRAGMA o'rnatilmaydi)
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 65536  # 64 MiB sahifa keshi (har bir ulanish uchun)
+    SQLITE_MMAP_SIZE: int = 268435456  # 256 MiB
+    SQLITE_TEMP_STORE: str = "MEMORY"
+    # Sinxron (def) endpointlar va DB ishlari bajariladigan threadpool hajmi (AnyIO limiter).
+    # DB_POOL_SIZE + DB_MAX_OVERFLOW dan oshmasligi kerak: aks holda threadlar bo'sh DB ulanishini
+    # kutib, ulanishni band qilgan so'rovlar esa bo'sh threadni kutib qolishi mumkin
+    THREADPOOL_MAX_WORKERS: int = 15
 
     # JWT sozlamalari
     SECRET_KEY: str
@@ -26,12 +47,30 @@ class Settings(BaseSettings):
     # Ilova muhiti
     APP_ENV: str = "development"  # "development" yoki "production"
 
+    # get_current_user uchun foydalanuvchi nusxasi keshi (0 - o'chirilgan)
+    AUTH_CACHE_TTL_SECONDS: int = 30
+    AUTH_CACHE_MAX_SIZE: int = 1024
+
+    # Parol xeshlash (bcrypt). Raundlar o'zgarsa, eski xeshlar keyingi muvaffaqiyatli loginda qayta xeshlanadi
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2  # Bir vaqtda bajariladigan bcrypt hisoblashlari soni (alohida thread pool)
+
     # Celery sozlamalari
     CELERY_BROKER_URL: str
     CELERY_RESULT_BACKEND: str
+    # Porsiya qayta hisoblash/qoldiq tekshiruvi triggerlari shu oyna (soniya) ichida bitta taskka birlashtiriladi
+    PORTION_RECALC_DEBOUNCE_SECONDS: int = 5
 
-    # WebSocket xabarlari uchun Redis kanali
-    WS_MESSAGE_CHANNEL: str = "ws_messages_kindergarten"
+    # WebSocket xabarlari uchun Redis Stream (XADD/XREADGROUP); qayta ulangan klient `since` bilan yetishib oladi
+    WS_EVENT_STREAM: str = "ws_events_kindergarten"
+    WS_EVENT_STREAM_MAXLEN: int = 10000  # Streamda saqlanadigan taxminiy xabarlar soni
+    WS_REPLAY_MAX_EVENTS: int = 500  # Bitta qayta ulanishda yuboriladigan eng ko'p o'tkazib yuborilgan xabarlar
+    # Har bir WebSocket ulanishining chiquvchi navbati; to'lsa klient sekin deb uziladi
+    WS_SEND_QUEUE_MAXSIZE: int = 100
+    WS_SEND_TIMEOUT_SECONDS: float = 5.0
+    WS_MAX_CONNECTIONS_PER_USER: int = 5  # Bitta foydalanuvchi uchun bir vaqtdagi ulanishlar (tablar) soni
+    # Ko'p workerli rejimda worker IDsi prefiksi (bo'sh bo'lsa hostname); oxiriga process id qo'shiladi
+    WS_WORKER_ID: Optional[str] = None
 
     # Vaqt mintaqasi
     TIMEZONE: str = "Asia/Tashkent"
@@ -1,11 +1,11 @@
 # app/crud.py
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract, and_, or_
+from sqlalchemy import func, extract, and_, or_, insert, update
 from datetime import datetime, timedelta, date
-from typing import List, Optional, Tuple, Dict, Any, Type
+from typing import List, Optional, Tuple, Dict, Any, Type, Iterable
 import math
 
-from app import models, schemas
+from app import models, schemas, portion_matrix, unit_conversion
 from app.config import settings
 from app.models import MonthlyReport, Notification
 
@@ -45,10 +45,17 @@ def get_units(db: Session, skip: int = 0, limit: int = 100) -> list[Type[models.
 
 
 def create_unit(db: Session, unit: schemas.UnitCreate) -> models.Unit:
-    db_unit = models.Unit(name=unit.name, short_name=unit.short_name)
+    dimension, base_factor = unit.dimension, unit.base_factor
+    if dimension is None or base_factor is None:  # Ma'lum birliklar (gr, kg, l, qoshiq, ...) uchun avtomatik
+        known_dimension, known_factor = unit_conversion.infer_unit_dimension(unit.name, unit.short_name)
+        if base_factor is None and dimension in (None, known_dimension):
+            base_factor = known_factor
+        dimension = dimension or known_dimension
+    db_unit = models.Unit(name=unit.name, short_name=unit.short_name, dimension=dimension, base_factor=base_factor)
     db.add(db_unit)
     db.commit()
     db.refresh(db_unit)
+    unit_conversion.invalidate_cache()
     return db_unit
 
 
@@ -94,7 +101,7 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate) -> O
     db_user = get_user(db, user_id)
     if not db_user:
         return None
-    from app.security import get_password_hash  # Import
+    from app.security import get_password_hash, invalidate_user_auth_cache  # Import
 
     update_data = user_update.model_dump(exclude_unset=True)
     if "password" in update_data and update_data["password"]:  # Parol None yoki bo'sh emasligini tekshirish
@@ -109,16 +116,19 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate) -> O
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    invalidate_user_auth_cache(db_user.id)  # Rol, is_active, username o'zgargan bo'lishi mumkin
     return db_user
 
 
 def soft_delete_user(db: Session, user_id: int) -> Optional[models.User]:
+    from app.security import invalidate_user_auth_cache
     db_user = get_user(db, user_id)
     if db_user:
         db_user.deleted_at = datetime.now()
         db_user.is_active = False
         db.commit()
         db.refresh(db_user)
+        invalidate_user_auth_cache(db_user.id)
     return db_user
 
 
@@ -141,6 +151,7 @@ def get_product_by_name(db: Session, name: str) -> Optional[models.Product]:
 
 def create_product(db: Session, product: schemas.ProductCreate, user_id: int) -> models.Product:
     db_product = models.Product(**product.model_dump(), created_by=user_id)
+    db_product.stock = models.ProductStock(quantity=0.0)  # Yangi mahsulot uchun bo'sh balans
     db.add(db_product)
     # db.commit()
     db.flush()
@@ -156,6 +167,8 @@ def update_product(db: Session, product_id: int, product_update: schemas.Product
     for key, value in update_data.items():
         setattr(db_product, key, value)
     db_product.updated_at = datetime.now()
+    if "unit_id" in update_data or "density" in update_data:
+        recompute_ingredient_base_quantities(db, product_id)
     # db.commit()
     db.refresh(db_product)
     return db_product
@@ -171,7 +184,7 @@ def soft_delete_product(db: Session, product_id: int) -> Optional[models.Product
 
 
 # app/crud.py ichida
-from sqlalchemy.orm import selectinload # Import
+from sqlalchemy.orm import selectinload, joinedload # Import
 
 # --- ProductDelivery CRUD ---
 def get_product_delivery(db: Session, delivery_id: int) -> Optional[models.ProductDelivery]:
@@ -189,6 +202,7 @@ def get_product_deliveries(db: Session, product_id: Optional[int] = None, skip:
 def create_product_delivery(db: Session, delivery: schemas.ProductDeliveryCreate,
                             user_id: int) -> models.ProductDelivery:
 
+    _adjust_product_stock(db, delivery.product_id, delivery.quantity)  # Balans kirim bilan bir tranzaksiyada
     db_delivery = models.ProductDelivery(
         product_id=delivery.product_id,
         quantity=delivery.quantity,
@@ -201,10 +215,27 @@ def create_product_delivery(db: Session, delivery: schemas.ProductDeliveryCreate
     db.add(db_delivery)
     db.flush()
     db.refresh(db_delivery)
+    _unfinalize_reports_from(db, db_delivery.delivery_date)
     return db_delivery
 
+
+def _unfinalize_reports_from(db: Session, changed_at: datetime) -> None:
+    """O'tgan sanaga kiritilgan kirim shu oy va keyingi oylar final hisobotlarini eskirgan qiladi."""
+    changed_month = changed_at.date().replace(day=1)
+    if changed_month < date.today().replace(day=1):
+        db.query(models.MonthlyReport).filter(
+            models.MonthlyReport.report_month >= changed_month,
+            models.MonthlyReport.is_final == True
+        ).update({"is_final": False}, synchronize_session=False)
+
 # --- Ombordagi mahsulot miqdorini hisoblash ---
-def get_product_current_quantity(db: Session, product_id: int) -> float:
+# Joriy qoldiq `product_stock` jadvalida saqlanadi va kirim (create_product_delivery) hamda
+# sarf (create_meal_serving) bilan bir tranzaksiyada yangilanadi. O'qish - PK bo'yicha bitta qidiruv.
+STOCK_DRIFT_TOLERANCE = 1e-6
+
+
+def _get_product_quantity_from_ledger(db: Session, product_id: int) -> float:
+    """Kirim va sarf jurnallaridan (product_deliveries, serving_details) qoldiqni to'liq qayta hisoblaydi."""
     total_delivered = db.query(func.sum(models.ProductDelivery.quantity)).filter(
         models.ProductDelivery.product_id == product_id
     ).scalar() or 0.0
@@ -214,6 +245,115 @@ def get_product_current_quantity(db: Session, product_id: int) -> float:
     return total_delivered - total_used
 
 
+def _get_or_create_product_stock(db: Session, product_id: int) -> models.ProductStock:
+    db_stock = db.get(models.ProductStock, product_id)
+    if db_stock is None:
+        # Eski ma'lumotlar uchun balans hali yo'q - jurnaldan tiklaymiz (yangi yozuvlar qo'shilishidan oldin)
+        db_stock = models.ProductStock(product_id=product_id,
+                                       quantity=_get_product_quantity_from_ledger(db, product_id))
+        db.add(db_stock)
+        db.flush()
+    return db_stock
+
+
+def _adjust_product_stock(db: Session, product_id: int, delta: float) -> None:
+    """
+    Balansni `delta` ga o'zgartiradi (kirim uchun musbat, sarf uchun manfiy).
+    UPDATE ... SET quantity = quantity + :delta ko'rinishida bajariladi, shuning uchun
+    parallel yozuvlar bir-birining natijasini yo'qotmaydi. Commit chaqiruvchida.
+    """
+    db_stock = _get_or_create_product_stock(db, product_id)
+    db_stock.quantity = models.ProductStock.quantity + delta
+    db_stock.updated_at = datetime.now()
+    db.flush()
+
+
+def _reserve_product_stock(db: Session, consumption: Dict[int, float]) -> Optional[int]:
+    """
+    Sarfni qoldiqdan shartli ayiradi:
+    UPDATE product_stock SET quantity = quantity - :q WHERE product_id = :p AND quantity >= :q.
+    Tekshiruv va ayirish bitta operatorda bajariladi, shuning uchun bir vaqtdagi ikki ovqat berish
+    qoldiqni minusga tushira olmaydi (PostgreSQL qatorni qulflaydi, SQLite yozuvlarni ketma-ket bajaradi).
+    Mahsulotlar ID bo'yicha tartibda yangilanadi (deadlock bo'lmasligi uchun).
+    Yetarli bo'lmagan birinchi mahsulot IDsini qaytaradi (bu holda chaqiruvchi rollback qilishi shart), aks holda None.
+    """
+    now = datetime.now()
+    for product_id in sorted(consumption):
+        quantity_to_consume = consumption[product_id]
+        _get_or_create_product_stock(db, product_id)  # Eski ma'lumotlar uchun balans qatori bo'lishi kerak
+        result = db.execute(
+            update(models.ProductStock)
+            .where(models.ProductStock.product_id == product_id,
+                   models.ProductStock.quantity >= quantity_to_consume - STOCK_DRIFT_TOLERANCE)
+            .values(quantity=models.ProductStock.quantity - quantity_to_consume, updated_at=now)
+        )
+        if result.rowcount == 0:
+            return product_id
+    return None
+
+
+def get_product_current_quantity(db: Session, product_id: int) -> float:
+    db_stock = db.get(models.ProductStock, product_id)
+    if db_stock is None:  # Balans yaratilmagan (masalan, rebuild_product_stock hali ishlamagan)
+        return _get_product_quantity_from_ledger(db, product_id)
+    return db_stock.quantity
+
+
+def _begin_sqlite_write_lock(db: Session) -> None:
+    """
+    SQLite: yozuv qulfini o'qishlardan oldin oladi (BEGIN IMMEDIATE). pysqlite tranzaksiyani birinchi yozuvgacha
+    boshlamaydi, `with_for_update()` esa SQLite da hech narsa qilmaydi - qulfsiz o'qilgan qiymatlar eskirishi mumkin.
+    Boshqa bazalarda hech narsa qilmaydi.
+    """
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        return
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def rebuild_product_stock(db: Session, fix: bool = True) -> List[Dict[str, Any]]:
+    """
+    `product_stock` balanslarini kirim/sarf jurnallari bilan solishtiradi (reconciliation).
+    Farq (drift) topilgan yoki balansi yo'q mahsulotlar ro'yxatini qaytaradi.
+    `fix=True` bo'lsa, balanslarni jurnal bo'yicha tuzatadi va commit qiladi: o'qishlar yozuv qulfi ostida
+    (PostgreSQL - balans qatorlari, SQLite - butun baza), tuzatish esa nisbiy (quantity + farq) yoziladi,
+    shuning uchun parallel kirim/sarf yo'qolmaydi.
+    """
+    if fix:
+        _begin_sqlite_write_lock(db)
+    # Avval balans qatorlarini qulflaymiz (PostgreSQL), shunda parallel kirim/sarf tuzatish paytida yo'qolmaydi
+    balances = {s.product_id: s for s in db.query(models.ProductStock).with_for_update().all()}
+    delivered_map = dict(db.query(
+        models.ProductDelivery.product_id, func.sum(models.ProductDelivery.quantity)
+    ).group_by(models.ProductDelivery.product_id).all())
+    used_map = dict(db.query(
+        models.ServingDetail.product_id, func.sum(models.ServingDetail.quantity_used)
+    ).group_by(models.ServingDetail.product_id).all())
+
+    drift_entries = []
+    for (product_id,) in db.query(models.Product.id).order_by(models.Product.id).all():
+        expected_quantity = (delivered_map.get(product_id) or 0.0) - (used_map.get(product_id) or 0.0)
+        db_stock = balances.get(product_id)
+        stored_quantity = db_stock.quantity if db_stock else None
+        if stored_quantity is not None and abs(stored_quantity - expected_quantity) <= STOCK_DRIFT_TOLERANCE:
+            continue
+        drift_entries.append({
+            "product_id": product_id,
+            "stored_quantity": stored_quantity,
+            "ledger_quantity": expected_quantity,
+        })
+        if fix:
+            if db_stock is None:
+                db.add(models.ProductStock(product_id=product_id, quantity=expected_quantity))
+            else:
+                db_stock.quantity = models.ProductStock.quantity + (expected_quantity - stored_quantity)
+                db_stock.updated_at = datetime.now()
+    if fix:
+        db.commit()
+    return drift_entries
+
+
 def get_all_products_with_current_quantity(
         db: Session,
         skip: int = 0,
@@ -221,45 +361,28 @@ def get_all_products_with_current_quantity(
         name_filter: Optional[str] = None,
         low_stock_only: Optional[bool] = False
 ) -> List[schemas.ProductWithQuantity]:
-    products_orm = get_products(db, name_filter=name_filter,
-                                limit=10000)
-
-    products_with_quantity_list = []
-    for p_orm in products_orm:
-        current_quantity = get_product_current_quantity(db, p_orm.id)
+    # Bitta so'rov: mahsulot + birlik + yaratuvchi + balans (LEFT JOIN), filtr, tartib va sahifalash SQL da
+    current_quantity_col = func.coalesce(models.ProductStock.quantity, 0.0).label("current_quantity")
+    query = db.query(models.Product, current_quantity_col) \
+        .outerjoin(models.ProductStock, models.ProductStock.product_id == models.Product.id) \
+        .options(
+            joinedload(models.Product.unit),
+            joinedload(models.Product.created_by_user)
+        ).filter(models.Product.deleted_at == None)
 
-        if low_stock_only and current_quantity >= p_orm.min_quantity:
-            continue
-
-        try:
-            product_schema = schemas.Product.model_validate(p_orm)
-        except Exception as e:
-            print(f"DEBUG: Error validating product ORM to schema for product ID {p_orm.id}: {e}")
-            # Agar unit yuklanmagan bo'lsa, uni alohida yuklashga harakat qilish
-            if not hasattr(p_orm, 'unit') or p_orm.unit is None:
-                # Bu holatda p_orm.unit ni alohida yuklash kerak, lekin bu N+1 muammosiga olib keladi.
-                # Eng yaxshisi get_products da selectinload ishlatish.
-                # Hozircha, xatolik bo'lsa, unit=None qilib o'tkazib yuboramiz (noto'g'ri, lekin vaqtinchalik)
-                print(f"WARN: Unit not loaded for product {p_orm.name}. Consider using selectinload in get_products.")
-                # Vaqtincha, agar unit yuklanmagan bo'lsa, sxemani unitsiz yaratamiz (bu ham xato)
-                # To'g'ri yechim: get_products() da options(selectinload(models.Product.unit))
-                # Hozirgi kodda get_products da selectinload yo'q.
-                # Keling, get_products ni o'zgartiramiz.
-            pass  # Xatolikni o'tkazib yuborish (yaxshi emas)
-            # Yoki sxemani yaratishda xatolik bo'lsa, bu productni o'tkazib yuboramiz
-            # continue
-
-        products_with_quantity_list.append(
-            schemas.ProductWithQuantity(
-                **product_schema.model_dump(),  # Bu `unit` ni ham o'z ichiga oladi
-                current_quantity=current_quantity
-                # Bu qatorni olib tashlaymiz:
-                # unit=schemas.Unit.model_validate(p_orm.unit) if p_orm.unit else None
-            )
+    if name_filter:
+        query = query.filter(models.Product.name.ilike(f"%{name_filter}%"))
+    if low_stock_only:
+        query = query.filter(func.coalesce(models.ProductStock.quantity, 0.0) < models.Product.min_quantity)
+
+    rows = query.order_by(models.Product.name, models.Product.id).offset(skip).limit(limit).all()
+    return [
+        schemas.ProductWithQuantity(
+            **schemas.Product.model_validate(p_orm).model_dump(),
+            current_quantity=current_quantity
         )
-
-    # Skip va limitni filterlangan ro'yxatga qo'llash
-    return products_with_quantity_list[skip: skip + limit]
+        for p_orm, current_quantity in rows
+    ]
 
 
 # `get_products` funksiyasiga `selectinload` qo'shish:
@@ -287,6 +410,15 @@ def get_meal(db: Session, meal_id: int) -> Optional[models.Meal]:
 
 
 
+def get_meals_by_ids(db: Session, meal_ids: Iterable[int]) -> List[models.Meal]:
+    # get_meal bilan bir xil yuklash, lekin bir nechta ovqat uchun bitta so'rov
+    return db.query(models.Meal).options(
+        selectinload(models.Meal.ingredients).selectinload(models.MealIngredient.product).selectinload(
+            models.Product.unit),
+        selectinload(models.Meal.ingredients).selectinload(models.MealIngredient.unit)
+    ).filter(models.Meal.id.in_(list(meal_ids)), models.Meal.deleted_at == None).all()
+
+
 def get_meal_by_name(db: Session, name: str) -> Optional[models.Meal]:
     return db.query(models.Meal).filter(models.Meal.name == name, models.Meal.deleted_at == None).first()
 
@@ -306,6 +438,76 @@ def get_meals(
     return query.order_by(models.Meal.name).offset(skip).limit(limit).all()
 
 
+def get_ingredient_base_quantity(db: Session, ingredient_data: schemas.MealIngredientCreate) -> Optional[float]:
+    """
+    Ingredientning 1 porsiya miqdori mahsulotning asosiy birligida. Mahsulot topilmasa yoki birliklarni
+    konvertatsiya qilib bo'lmasa None (routerlar bunday retseptni saqlashdan oldin rad etadi).
+    """
+    product = db.get(models.Product, ingredient_data.product_id)
+    if product is None:
+        return None
+    return convert_to_product_unit(db, ingredient_data.quantity_per_portion, ingredient_data.unit_id, product)
+
+
+def _build_meal_ingredient(db: Session, meal_id: int,
+                           ingredient_data: schemas.MealIngredientCreate) -> models.MealIngredient:
+    return models.MealIngredient(
+        meal_id=meal_id,
+        product_id=ingredient_data.product_id,
+        quantity_per_portion=ingredient_data.quantity_per_portion,
+        unit_id=ingredient_data.unit_id,
+        quantity_per_portion_base=get_ingredient_base_quantity(db, ingredient_data)
+    )
+
+
+def recompute_ingredient_base_quantities(db: Session, product_id: int) -> List[str]:
+    """
+    Mahsulot birligi yoki zichligi o'zgarganda uning retseptlardagi asosiy birlik miqdorlarini qayta hisoblaydi
+    (commit qilmaydi). Konvertatsiya qilib bo'lmay qolgan ovqatlar nomlarini qaytaradi.
+    """
+    product = db.get(models.Product, product_id)
+    ingredients = db.query(models.MealIngredient).options(joinedload(models.MealIngredient.meal)).filter(
+        models.MealIngredient.product_id == product_id
+    ).all()
+    unconvertible_meal_names = []
+    changed_meals: Dict[int, models.Meal] = {}
+    for mi in ingredients:
+        base_quantity = convert_to_product_unit(db, mi.quantity_per_portion, mi.unit_id, product)
+        if base_quantity != mi.quantity_per_portion_base:
+            mi.quantity_per_portion_base = base_quantity
+            changed_meals[mi.meal_id] = mi.meal
+        if mi.quantity_per_portion_base is None and mi.meal.deleted_at is None:
+            unconvertible_meal_names.append(mi.meal.name)
+    for db_meal in changed_meals.values():  # Talab vektori o'zgardi - yangi retsept versiyasi
+        if db_meal.deleted_at is None:
+            _create_recipe_version(db, db_meal)
+    return sorted(set(unconvertible_meal_names))
+
+
+def _create_recipe_version(db: Session, db_meal: models.Meal,
+                           user_id: Optional[int] = None) -> models.MealRecipeVersion:
+    """
+    Ovqatning joriy retseptidan o'zgarmas versiya yaratadi va uni amaldagi qiladi (commit qilmaydi).
+    Versiya talab vektorini saqlaydi: mahsulot bo'yicha 1 porsiya miqdori asosiy birlikda (takrorlar qo'shiladi).
+    """
+    requirements: Dict[int, float] = {}
+    for mi in db_meal.ingredients:
+        if mi.quantity_per_portion_base is not None and mi.quantity_per_portion_base > 0:
+            requirements[mi.product_id] = requirements.get(mi.product_id, 0.0) + mi.quantity_per_portion_base
+    last_version = db.query(func.max(models.MealRecipeVersion.version)).filter(
+        models.MealRecipeVersion.meal_id == db_meal.id).scalar() or 0
+    db_version = models.MealRecipeVersion(
+        meal_id=db_meal.id, version=last_version + 1, created_by=user_id,
+        items=[models.MealRecipeVersionItem(product_id=product_id, quantity_per_portion_base=quantity)
+               for product_id, quantity in sorted(requirements.items())]
+    )
+    db.add(db_version)
+    db.flush()
+    db_meal.current_recipe_version_id = db_version.id
+    db.flush()
+    return db_version
+
+
 def create_meal(db: Session, meal_data: schemas.MealCreate, user_id: int) -> models.Meal:
     db_meal = models.Meal(
         name=meal_data.name,
@@ -316,44 +518,70 @@ def create_meal(db: Session, meal_data: schemas.MealCreate, user_id: int) -> mod
     db.add(db_meal)
     db.flush()
     for ingredient_data in meal_data.ingredients:
-        db_ingredient = models.MealIngredient(
-            meal_id=db_meal.id,
-            product_id=ingredient_data.product_id,
-            quantity_per_portion=ingredient_data.quantity_per_portion,
-            unit_id=ingredient_data.unit_id
-        )
-        db.add(db_ingredient)
+        db_meal.ingredients.append(_build_meal_ingredient(db, db_meal.id, ingredient_data))
+    _create_recipe_version(db, db_meal, user_id)
     # db.commit()
     db.refresh(db_meal)
     return db_meal
 
 
-def update_meal(db: Session, meal_id: int, meal_update_data: schemas.MealUpdate, user_id: int) -> Optional[models.Meal]:
-    db_meal = get_meal(db, meal_id)
+def _sync_meal_ingredients(db: Session, db_meal: models.Meal,
+                           ingredients_data: List[schemas.MealIngredientCreate]) -> List[int]:
+    """
+    Retseptni yangi ro'yxat bilan diff orqali moslashtiradi: o'zgarmagan ingredientlarga tegilmaydi, o'zgarganlari
+    yangilanadi, yangilari qo'shiladi, ro'yxatda yo'qlari o'chiriladi. Mavjud qatorlar product_id bo'yicha
+    (bir mahsulot bir necha marta bo'lsa, avval shu birlikdagisi) juftlanadi.
+    Tarkibi o'zgargan mahsulotlar IDlarini qaytaradi.
+    """
+    existing_by_product: Dict[int, List[models.MealIngredient]] = {}
+    for mi in db_meal.ingredients:
+        existing_by_product.setdefault(mi.product_id, []).append(mi)
+
+    changed_product_ids = set()
+    for ingredient_data in ingredients_data:
+        candidates = existing_by_product.get(ingredient_data.product_id)
+        if not candidates:
+            db_meal.ingredients.append(_build_meal_ingredient(db, db_meal.id, ingredient_data))
+            changed_product_ids.add(ingredient_data.product_id)
+            continue
+        db_ingredient = next((mi for mi in candidates if mi.unit_id == ingredient_data.unit_id), candidates[0])
+        candidates.remove(db_ingredient)
+        if (db_ingredient.unit_id, db_ingredient.quantity_per_portion) != \
+                (ingredient_data.unit_id, ingredient_data.quantity_per_portion):
+            db_ingredient.unit_id = ingredient_data.unit_id
+            db_ingredient.quantity_per_portion = ingredient_data.quantity_per_portion
+            db_ingredient.quantity_per_portion_base = get_ingredient_base_quantity(db, ingredient_data)
+            changed_product_ids.add(ingredient_data.product_id)
+
+    for leftover in existing_by_product.values():
+        for mi in leftover:
+            db_meal.ingredients.remove(mi)  # delete-orphan - qator o'chiriladi
+            changed_product_ids.add(mi.product_id)
+    return sorted(changed_product_ids)
+
+
+def update_meal(db: Session, meal_id: int, meal_update_data: schemas.MealUpdate, user_id: int,
+                db_meal: Optional[models.Meal] = None) -> Tuple[Optional[models.Meal], List[int]]:
+    """
+    Ovqatni yangilaydi (commit qilmaydi). `db_meal` - router allaqachon yuklagan ovqat (get_meal), qayta
+    yuklanmaydi. Qaytaradi: (ovqat, retseptda o'zgargan mahsulotlar IDlari).
+    """
+    if db_meal is None:
+        db_meal = get_meal(db, meal_id)
     if not db_meal:
-        return None
+        return None, []
     update_data = meal_update_data.model_dump(exclude_unset=True, exclude={"ingredients"})
     for key, value in update_data.items():
         setattr(db_meal, key, value)
     db_meal.updated_at = datetime.now()
 
+    changed_product_ids: List[int] = []
     if meal_update_data.ingredients is not None:  # Agar ingredientlar yuborilgan bo'lsa (bo'sh ro'yxat ham bo'lishi mumkin)
-        # Eskilarini o'chirish
-        db.query(models.MealIngredient).filter(models.MealIngredient.meal_id == meal_id).delete(
-            synchronize_session=False)
-        # Yangilarini qo'shish
-        for ingredient_data in meal_update_data.ingredients:
-            db_ingredient = models.MealIngredient(
-                meal_id=db_meal.id,
-                product_id=ingredient_data.product_id,
-                quantity_per_portion=ingredient_data.quantity_per_portion,
-                unit_id=ingredient_data.unit_id
-            )
-            db.add(db_ingredient)
-    # db.commit()
-    db.refresh(db_meal)
-
-    return get_meal(db, meal_id)  # Yangilangan mealni qaytarish (ingredientlar bilan)
+        changed_product_ids = _sync_meal_ingredients(db, db_meal, meal_update_data.ingredients)
+    if changed_product_ids or db_meal.current_recipe_version_id is None:
+        _create_recipe_version(db, db_meal, user_id)  # Eski ovqat berishlar avvalgi versiyaga bog'liq qoladi
+    db.flush()
+    return db_meal, changed_product_ids
 
 
 def soft_delete_meal(db: Session, meal_id: int) -> Optional[models.Meal]:
@@ -366,15 +594,16 @@ def soft_delete_meal(db: Session, meal_id: int) -> Optional[models.Meal]:
     return db_meal
 
 
-def create_meal_serving(db: Session, serving_data: schemas.MealServingCreate, user_id: int) -> Tuple[
-    Optional[models.MealServing], Optional[str]]:
-    db_meal = get_meal(db, serving_data.meal_id)  # Bu ingredientlarni va ularning unit/product.unitlarini yuklaydi
-    if not db_meal:
-        return None, "Ovqat topilmadi."
+def _calculate_serving_consumption(db_meal: models.Meal, portions_served: int) -> Tuple[
+    Dict[int, float], Optional[str]]:
+    """
+    Ovqat berish uchun har bir mahsulotdan (ombordagi asosiy birlikda) qancha sarflanishini hisoblaydi.
+    `db_meal` ingredientlari yuklangan bo'lishi kerak. Qaytaradi: ({product_id: miqdor}, xatolik xabari).
+    """
     if not db_meal.is_active:
-        return None, f"'{db_meal.name}' ovqati hozirda faol emas."
+        return {}, f"'{db_meal.name}' ovqati hozirda faol emas."
     if not db_meal.ingredients:
-        return None, f"'{db_meal.name}' ovqati uchun ingredientlar retseptda belgilanmagan."
+        return {}, f"'{db_meal.name}' ovqati uchun ingredientlar retseptda belgilanmagan."
 
     # Bu dictionaryda mahsulot ID sini kalit, ombordan olinadigan jami miqdorni
     # (mahsulotning ombordagi ASOSIY BIRLIGIDA) qiymat sifatida saqlaymiz.
@@ -387,7 +616,7 @@ def create_meal_serving(db: Session, serving_data: schemas.MealServingCreate, us
         if not (product_in_db and product_in_db.unit and ingredient_unit_in_recipe):
             # Bu holat get_meal to'g'ri selectinload qilgan bo'lsa, yuzaga kelmasligi kerak
             product_name_debug = product_in_db.name if product_in_db else f"(Product ID: {ingredient_in_recipe.product_id})"
-            return None, f"'{db_meal.name}' ovqatining ('{product_name_debug}') ingredienti uchun mahsulot yoki birlik ma'lumotlari to'liq emas. Iltimos, retseptni tekshiring."
+            return {}, f"'{db_meal.name}' ovqatining ('{product_name_debug}') ingredienti uchun mahsulot yoki birlik ma'lumotlari to'liq emas. Iltimos, retseptni tekshiring."
 
         quantity_per_portion_recipe = ingredient_in_recipe.quantity_per_portion
         unit_short_recipe = ingredient_unit_in_recipe.short_name
@@ -398,66 +627,98 @@ def create_meal_serving(db: Session, serving_data: schemas.MealServingCreate, us
                 f"INFO: CRUD_SERVING - Ingredient '{product_in_db.name}' in meal '{db_meal.name}' has non-positive quantity per portion. Skipping.")
             continue  # Bu ingredientni hisobga olmaymiz
 
-        total_quantity_needed_recipe_unit = quantity_per_portion_recipe * serving_data.portions_served
-
-        # Kerakli miqdorni mahsulotning ombordagi asosiy birligiga konvertatsiya qilish
-        total_quantity_needed_product_base_unit = _convert_units_for_comparison(
-            total_quantity_needed_recipe_unit,
-            unit_short_recipe,
-            unit_short_product_base
-        )
+        total_quantity_needed_recipe_unit = quantity_per_portion_recipe * portions_served
 
-        if total_quantity_needed_product_base_unit is None:
-            # Konvertatsiya qilinmadi (birliklar mos kelmadi)
-            return None, (f"'{product_in_db.name}' uchun birliklar mos kelmaydi: "
-                          f"Retseptda '{ingredient_unit_in_recipe.name}' ishlatilgan, lekin omborda asosiy birlik "
-                          f"'{product_in_db.unit.name}'. Bu birliklar o'rtasida avtomatik konvertatsiya yo'q.")
-
-        current_stock_in_product_base_unit = get_product_current_quantity(db,
-                                                                          product_in_db.id)  # Ombordagi miqdor (asosiy birlikda)
+        # Asosiy birlikdagi miqdor retsept saqlanganda hisoblangan (None - birliklar mos kelmaydi)
+        if ingredient_in_recipe.quantity_per_portion_base is None:
+            return {}, (f"'{product_in_db.name}' uchun birliklar mos kelmaydi: "
+                        f"Retseptda '{ingredient_unit_in_recipe.name}' ishlatilgan, lekin omborda asosiy birlik "
+                        f"'{product_in_db.unit.name}'. Bu birliklar o'rtasida avtomatik konvertatsiya yo'q.")
+        total_quantity_needed_product_base_unit = ingredient_in_recipe.quantity_per_portion_base * portions_served
 
         print(f"SERVING_DEBUG: Product: {product_in_db.name} (ID: {product_in_db.id})")
         print(f"SERVING_DEBUG:   Recipe demands: {total_quantity_needed_recipe_unit:.3f} {unit_short_recipe}")
         print(
             f"SERVING_DEBUG:   Converted demand (in base unit): {total_quantity_needed_product_base_unit:.3f} {unit_short_product_base}")
-        print(
-            f"SERVING_DEBUG:   Stock has (in base unit): {current_stock_in_product_base_unit:.3f} {unit_short_product_base}")
-
-        if current_stock_in_product_base_unit < total_quantity_needed_product_base_unit:
-            return None, (f"'{product_in_db.name}' mahsuloti yetarli emas. "
-                          f"Kerak: {total_quantity_needed_product_base_unit:.3f} {unit_short_product_base}, "
-                          f"Mavjud: {current_stock_in_product_base_unit:.3f} {unit_short_product_base}")
 
         # Agar shu mahsulot bir necha marta (turli birliklarda) retseptda uchrasa, ularni yig'ish kerak
         product_consumption_in_base_units[product_in_db.id] = \
             product_consumption_in_base_units.get(product_in_db.id, 0.0) + total_quantity_needed_product_base_unit
 
-    # Tranzaksiyani boshlash va DBga yozish
-    if not product_consumption_in_base_units and db_meal.ingredients:
+    if not product_consumption_in_base_units:
         # Bu holat agar barcha ingredientlar quantity_per_portion <= 0 bo'lsa yuzaga kelishi mumkin
         print(f"WARN: CRUD_SERVING - No ingredients to consume for meal '{db_meal.name}'. Check recipe quantities.")
-        # Yoki xatolik qaytarish mumkin, agar ovqatda ingredient bo'lishi shart bo'lsa.
         # Hozircha, ovqat berildi deb hisoblaymiz (agar ingredientlar 0 sarf bilan belgilangan bo'lsa).
+    return product_consumption_in_base_units, None
+
+
+def _check_stock_for_consumption(db: Session, consumption: Dict[int, float],
+                                 products_by_id: Dict[int, models.Product]) -> Optional[str]:
+    """Oldindan tekshiruv (tushunarli xatolik xabari uchun). Yakuniy tekshiruv _reserve_product_stock da."""
+    stock_map = _get_stock_map(db, consumption.keys())
+    for product_id_key, quantity_to_consume in consumption.items():
+        current_stock_in_product_base_unit = stock_map.get(product_id_key, 0.0)
+        if current_stock_in_product_base_unit < quantity_to_consume - STOCK_DRIFT_TOLERANCE:
+            product_in_db = products_by_id[product_id_key]
+            return (f"'{product_in_db.name}' mahsuloti yetarli emas. "
+                    f"Kerak: {quantity_to_consume:.3f} {product_in_db.unit.short_name}, "
+                    f"Mavjud: {current_stock_in_product_base_unit:.3f} {product_in_db.unit.short_name}")
+    return None
 
-    try:
-        db_serving = models.MealServing(
-            meal_id=serving_data.meal_id,
-            portions_served=serving_data.portions_served,
-            served_by=user_id,
-            notes=serving_data.notes,
-            served_at=datetime.now()
-        )
-        db.add(db_serving)
-        db.flush()
 
-        for product_id_key, quantity_to_consume in product_consumption_in_base_units.items():
-            db_serving_detail = models.ServingDetail(
-                serving_id=db_serving.id,
-                product_id=product_id_key,
-                quantity_used=quantity_to_consume
-            )
-            db.add(db_serving_detail)
+def _add_meal_serving(db: Session, serving_data: schemas.MealServingCreate, user_id: int,
+                      consumption: Dict[int, float], served_at: datetime,
+                      recipe_version_id: Optional[int] = None) -> models.MealServing:
+    db_serving = models.MealServing(
+        meal_id=serving_data.meal_id,
+        portions_served=serving_data.portions_served,
+        served_by=user_id,
+        notes=serving_data.notes,
+        served_at=served_at,
+        recipe_version_id=recipe_version_id
+    )
+    for product_id_key, quantity_to_consume in consumption.items():
+        db_serving.serving_details.append(models.ServingDetail(
+            product_id=product_id_key,
+            quantity_used=quantity_to_consume
+        ))
+    db.add(db_serving)
+    return db_serving
 
+
+def create_meal_serving(db: Session, serving_data: schemas.MealServingCreate, user_id: int,
+                        db_meal: Optional[models.Meal] = None) -> Tuple[
+    Optional[models.MealServing], Optional[str]]:
+    """
+    Bitta ovqat berishni qayd etadi (commit qilmaydi). Router ovqatni allaqachon yuklagan bo'lsa,
+    uni `db_meal` orqali berish mumkin (get_meal qayta chaqirilmaydi).
+    """
+    if db_meal is None:
+        db_meal = get_meal(db, serving_data.meal_id)  # Bu ingredientlarni va ularning unit/product.unitlarini yuklaydi
+    if not db_meal:
+        return None, "Ovqat topilmadi."
+
+    product_consumption_in_base_units, error_message = _calculate_serving_consumption(
+        db_meal, serving_data.portions_served)
+    if error_message:
+        return None, error_message
+
+    products_by_id = {mi.product_id: mi.product for mi in db_meal.ingredients}
+    error_message = _check_stock_for_consumption(db, product_consumption_in_base_units, products_by_id)
+    if error_message:
+        return None, error_message
+
+    try:
+        insufficient_product_id = _reserve_product_stock(db, product_consumption_in_base_units)
+        if insufficient_product_id is not None:
+            # Tekshiruvdan keyin boshqa ovqat berish shu mahsulotni sarflab ulgurgan
+            product_name = products_by_id[insufficient_product_id].name
+            db.rollback()
+            return None, f"'{product_name}' mahsuloti yetarli emas (boshqa ovqat berish bilan bir vaqtda sarflandi)."
+
+        db_serving = _add_meal_serving(db, serving_data, user_id, product_consumption_in_base_units, datetime.now(),
+                                       db_meal.current_recipe_version_id)
+        db.flush()
         # db.commit()
         return get_meal_serving_with_details(db, db_serving.id), None  # To'liq ma'lumot bilan qaytarish
     except Exception as e:
@@ -466,6 +727,53 @@ def create_meal_serving(db: Session, serving_data: schemas.MealServingCreate, us
         return None, f"Ovqat berishni ma'lumotlar bazasiga yozishda xatolik yuz berdi."
 
 
+def create_meal_servings_batch(db: Session, servings_data: List[schemas.MealServingCreate], user_id: int) -> Tuple[
+    List[models.MealServing], Optional[str]]:
+    """
+    Bir nechta ovqat berishni bitta tranzaksiyada qayd etadi (commit qilmaydi).
+    Barcha ovqatlar bitta so'rovda yuklanadi, sarf mahsulotlar bo'yicha yig'ilib, qoldiq bir marta
+    tekshiriladi va band qilinadi. Biror element xato bo'lsa, hech narsa yozilmaydi.
+    """
+    meals_by_id = {meal.id: meal for meal in get_meals_by_ids(db, {item.meal_id for item in servings_data})}
+
+    total_consumption: Dict[int, float] = {}
+    consumption_per_serving: List[Dict[int, float]] = []
+    products_by_id: Dict[int, models.Product] = {}
+    for index, serving_data in enumerate(servings_data, start=1):
+        db_meal = meals_by_id.get(serving_data.meal_id)
+        if not db_meal:
+            return [], f"#{index}: ID={serving_data.meal_id} bo'lgan ovqat topilmadi."
+        consumption, error_message = _calculate_serving_consumption(db_meal, serving_data.portions_served)
+        if error_message:
+            return [], f"#{index}: {error_message}"
+        consumption_per_serving.append(consumption)
+        for product_id_key, quantity_to_consume in consumption.items():
+            total_consumption[product_id_key] = total_consumption.get(product_id_key, 0.0) + quantity_to_consume
+        products_by_id.update({mi.product_id: mi.product for mi in db_meal.ingredients})
+
+    error_message = _check_stock_for_consumption(db, total_consumption, products_by_id)
+    if error_message:
+        return [], error_message
+
+    try:
+        insufficient_product_id = _reserve_product_stock(db, total_consumption)
+        if insufficient_product_id is not None:
+            product_name = products_by_id[insufficient_product_id].name
+            db.rollback()
+            return [], f"'{product_name}' mahsuloti yetarli emas (boshqa ovqat berish bilan bir vaqtda sarflandi)."
+
+        served_at = datetime.now()
+        db_servings = [_add_meal_serving(db, serving_data, user_id, consumption, served_at,
+                                         meals_by_id[serving_data.meal_id].current_recipe_version_id)
+                       for serving_data, consumption in zip(servings_data, consumption_per_serving)]
+        db.flush()
+        return get_meal_servings_with_details_by_ids(db, [s.id for s in db_servings]), None
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR: CRUD_SERVING - Exception during batch database transaction: {str(e)}")
+        return [], "Ovqat berishlarni ma'lumotlar bazasiga yozishda xatolik yuz berdi."
+
+
 def get_meal_serving(db: Session, serving_id: int) -> Optional[models.MealServing]:
     return db.query(models.MealServing).filter(models.MealServing.id == serving_id).first()
 
@@ -479,6 +787,16 @@ def get_meal_serving_with_details(db: Session, serving_id: int) -> Optional[mode
     ).filter(models.MealServing.id == serving_id).first()
 
 
+def get_meal_servings_with_details_by_ids(db: Session, serving_ids: List[int]) -> List[models.MealServing]:
+    servings = db.query(models.MealServing).options(
+        selectinload(models.MealServing.serving_details).selectinload(models.ServingDetail.product).selectinload(models.Product.unit),
+        selectinload(models.MealServing.meal),
+        selectinload(models.MealServing.served_by_user).selectinload(models.User.role)
+    ).filter(models.MealServing.id.in_(serving_ids)).all()
+    servings_by_id = {serving.id: serving for serving in servings}
+    return [servings_by_id[serving_id] for serving_id in serving_ids if serving_id in servings_by_id]
+
+
 def get_meal_servings(
         db: Session, skip: int = 0, limit: int = 100, meal_id: Optional[int] = None,
         user_id: Optional[int] = None, start_date: Optional[date] = None, end_date: Optional[date] = None
@@ -502,18 +820,31 @@ def get_serving_details_for_serving(db: Session, serving_id: int) -> list[Type[m
 # --- Porsiya hisoblash (PossibleMeals) ---
 # Bu funksiyalar WS yubormaydi, Celery taski o'zi Redisga yozadi yoki API endpoint WS yuboradi
 
-def calculate_possible_portions_for_meal(db: Session, meal_id: int) -> Tuple[int, Optional[int]]:
-    meal = get_meal(db, meal_id)  # Bu ingredientlarni va ularning unit/product.unitlarini yuklaydi
-    if not meal: return 0, None  # Ovqat topilmadi
+def _get_stock_map(db: Session, product_ids: Iterable[int]) -> Dict[int, float]:
+    """Bir nechta mahsulotning joriy qoldig'ini bitta so'rov bilan oladi."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    stock_map = dict(db.query(models.ProductStock.product_id, models.ProductStock.quantity).filter(
+        models.ProductStock.product_id.in_(product_ids)
+    ).all())
+    for product_id in product_ids - stock_map.keys():  # Balansi yo'q (eski) mahsulotlar uchun jurnaldan
+        stock_map[product_id] = _get_product_quantity_from_ledger(db, product_id)
+    return stock_map
+
+
+def _calculate_possible_portions(meal: models.Meal, stock_map: Dict[int, float]) -> Tuple[int, Optional[int]]:
+    """
+    Ovqatdan nechta porsiya tayyorlash mumkinligini va cheklovchi mahsulotni hisoblaydi.
+    `meal` ingredientlari (product.unit va unit bilan) yuklangan bo'lishi, `stock_map` esa
+    ingredient mahsulotlarining qoldig'ini (asosiy birlikda) o'z ichiga olishi kerak. DBga murojaat qilmaydi.
+    """
     if not meal.is_active: return 0, None  # Faol bo'lmagan ovqat uchun hisoblamaymiz
     if not meal.ingredients: return 0, None  # Ingredientlarsiz ovqatdan 0 porsiya (yoki cheksiz, talabga qarab)
 
     min_possible_portions = float('inf')
     limiting_product_id_val: Optional[int] = None
 
-    if not meal.ingredients:  # Agar ingredientlar ro'yxati bo'sh bo'lsa
-        return 0, None  # Yoki juda katta son (cheksiz deb hisoblash uchun), lekin hozircha 0
-
     for ingredient_in_recipe in meal.ingredients:
         product_in_db = ingredient_in_recipe.product
         ingredient_unit_in_recipe = ingredient_in_recipe.unit
@@ -529,41 +860,26 @@ def calculate_possible_portions_for_meal(db: Session, meal_id: int) -> Tuple[int
             # Bu ingredient deyarli sarflanmaydi, porsiyani cheklamaydi
             continue
 
-        unit_short_recipe = ingredient_unit_in_recipe.short_name
-        unit_short_product_base = product_in_db.unit.short_name
-
-        # 1 porsiya uchun kerakli miqdorni mahsulotning ombordagi asosiy birligiga konvertatsiya qilish
-        qty_per_portion_in_product_base_unit = _convert_units_for_comparison(
-            quantity_per_portion_recipe,
-            unit_short_recipe,
-            unit_short_product_base
-        )
+        # 1 porsiya uchun miqdor mahsulotning ombordagi asosiy birligida (retsept saqlanganda hisoblangan)
+        qty_per_portion_in_product_base_unit = ingredient_in_recipe.quantity_per_portion_base
 
         if qty_per_portion_in_product_base_unit is None:
             # Birliklar mos kelmadi va konvertatsiya qilinmadi.
             # Bu ovqatni tayyorlab bo'lmaydi, shu ingredient tufayli.
             print(
-                f"WARN: CRUD_PORTION_CALC - Cannot convert units for {product_in_db.name} ({unit_short_recipe} to {unit_short_product_base}) in meal '{meal.name}'. Assuming 0 portions possible for this meal.")
+                f"WARN: CRUD_PORTION_CALC - Cannot convert units for {product_in_db.name} ({ingredient_unit_in_recipe.short_name} to {product_in_db.unit.short_name}) in meal '{meal.name}'. Assuming 0 portions possible for this meal.")
             return 0, product_in_db.id  # Shu mahsulot cheklovchi deb belgilanadi
 
         if qty_per_portion_in_product_base_unit <= 1e-9:  # Konvertatsiyadan keyin ham juda kichik
-            print(
-                f"INFO: CRUD_PORTION_CALC - Ingredient '{product_in_db.name}' in meal '{meal.name}' has near-zero quantity per portion after conversion. Skipping as a limiting factor.")
             continue
 
-        current_stock_in_product_base_unit = get_product_current_quantity(db, product_in_db.id)
+        current_stock_in_product_base_unit = stock_map.get(product_in_db.id, 0.0)
 
         if current_stock_in_product_base_unit <= 1e-9:  # Agar omborda shu mahsulot umuman yo'q bo'lsa
             min_possible_portions = 0
             limiting_product_id_val = product_in_db.id
             break  # Darhol 0 porsiya, boshqa ingredientlarni tekshirish shart emas
 
-        # Agar bir porsiyaga kerakli miqdor ombordagidan ko'p bo'lsa (bu tekshiruv yuqorida qilingan)
-        # if current_stock_in_product_base_unit < qty_per_portion_in_product_base_unit:
-        #     min_possible_portions = 0
-        #     limiting_product_id_val = product_in_db.id
-        #     break
-
         portions_for_this_ingredient = math.floor(
             current_stock_in_product_base_unit / qty_per_portion_in_product_base_unit)
 
@@ -574,56 +890,146 @@ def calculate_possible_portions_for_meal(db: Session, meal_id: int) -> Tuple[int
     # Agar birorta ham ingredient porsiyani cheklamasa (masalan, hamma ingredientlar uchun qty_per_portion <=0 bo'lsa)
     # unda min_possible_portions float('inf') ligicha qoladi. Bunday holatda 0 qaytaramiz.
     final_portions = int(min_possible_portions) if min_possible_portions != float('inf') else 0
+    return final_portions, limiting_product_id_val
 
-    # Agar porsiya 0 bo'lsa-yu, lekin limiting_product_id_val None bo'lsa (masalan, ingredientlar ro'yxati bo'sh bo'lsa)
-    # Unda limiting_product_id_val ni None qilib qoldiramiz.
-    # Agar porsiya > 0 bo'lsa, limiting_product_id_val None bo'lishi mumkin emas (agar ingredientlar bor bo'lsa).
-    # Agar ingredientlar bo'sh bo'lsa, limiting_product_id_val None bo'ladi.
 
-    if final_portions > 0 and limiting_product_id_val is None and meal.ingredients:
-        # Bu g'alati holat, agar porsiya musbat bo'lsa, cheklovchi ingredient bo'lishi kerak.
-        # Ehtimol, barcha ingredientlar cheksiz miqdorda mavjud deb hisoblangan.
-        # Yoki faqat bitta ingredient bor va u yetarli. Bu holatda limiting_product_id_val None bo'lmaydi.
-        # Bu shartga tushmasligi kerak.
-        print(
-            f"WARN: CRUD_PORTION_CALC - Calculated {final_portions} portions for meal '{meal.name}' but no limiting product identified. This might be an issue in logic if ingredients exist.")
+def _load_active_meals_with_recipes(db: Session, meal_ids: Optional[Iterable[int]] = None) -> List[models.Meal]:
+    """Faol ovqatlar retseptlari (product.unit va unit bilan) bilan, bitta so'rovda (+ selectinload)."""
+    query = db.query(models.Meal).options(
+        selectinload(models.Meal.ingredients).selectinload(models.MealIngredient.product).selectinload(
+            models.Product.unit),
+        selectinload(models.Meal.ingredients).selectinload(models.MealIngredient.unit)
+    ).filter(models.Meal.is_active == True, models.Meal.deleted_at == None)
+    if meal_ids is not None:
+        query = query.filter(models.Meal.id.in_(meal_ids))
+    return query.order_by(models.Meal.id).all()
 
-    return final_portions, limiting_product_id_val
 
+def _get_recipe_fingerprint(db: Session) -> Tuple:
+    """
+    Porsiya matritsasiga ta'sir qiluvchi o'zgarishlar izi (bitta so'rov): ingredient qo'shish/o'chirish/tahrirlash,
+    ovqatni faollashtirish/o'chirish va mahsulot birligini o'zgartirish `updated_at`, soni yoki max(id) ni o'zgartiradi.
+    """
+    return tuple(db.query(
+        db.query(func.count(models.MealIngredient.id)).scalar_subquery(),
+        db.query(func.max(models.MealIngredient.id)).scalar_subquery(),
+        db.query(func.max(models.MealIngredient.updated_at)).scalar_subquery(),
+        db.query(func.count(models.Meal.id)).scalar_subquery(),
+        db.query(func.max(models.Meal.updated_at)).scalar_subquery(),
+        db.query(func.max(models.Product.updated_at)).scalar_subquery(),
+    ).one())
+
+
+def get_portion_matrix(db: Session) -> Optional[portion_matrix.PortionMatrix]:
+    """Faol ovqatlar talab matritsasi (retseptlar o'zgarmaguncha keshdan). numpy o'rnatilmagan bo'lsa None."""
+    if portion_matrix.np is None:
+        return None
+    return portion_matrix.get_cached_matrix(_get_recipe_fingerprint(db), lambda: _load_active_meals_with_recipes(db))
+
+
+def get_meal_ids_using_products(db: Session, product_ids: Iterable[int]) -> List[int]:
+    """Teskari indeks: berilgan mahsulotlar ishlatiladigan ovqatlar IDlari (meal_ingredients.product_id bo'yicha)."""
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return []
+    rows = db.query(models.MealIngredient.meal_id).filter(
+        models.MealIngredient.product_id.in_(product_ids)
+    ).distinct().all()
+    return [meal_id for (meal_id,) in rows]
+
+
+POSSIBLE_MEALS_UPSERT_CHUNK_SIZE = 200  # SQLite parametrlar chegarasidan oshmaslik uchun
+
+
+def _upsert_possible_meals(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """`possible_meals` ga bir nechta qatorni bitta INSERT ... ON CONFLICT (meal_id) DO UPDATE bilan yozadi."""
+    if not rows:
+        return
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:  # Boshqa DBlar uchun oddiy ORM yo'li
+        existing = {pm.meal_id: pm for pm in db.query(models.PossibleMeals).filter(
+            models.PossibleMeals.meal_id.in_([r["meal_id"] for r in rows])).all()}
+        for row in rows:
+            if row["meal_id"] in existing:
+                for key, value in row.items():
+                    setattr(existing[row["meal_id"]], key, value)
+            else:
+                db.add(models.PossibleMeals(**row))
+        return
+
+    for i in range(0, len(rows), POSSIBLE_MEALS_UPSERT_CHUNK_SIZE):
+        stmt = dialect_insert(models.PossibleMeals).values(rows[i:i + POSSIBLE_MEALS_UPSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.PossibleMeals.meal_id],
+            set_={
+                "possible_portions": stmt.excluded.possible_portions,
+                "limiting_product_id": stmt.excluded.limiting_product_id,
+                "calculated_at": stmt.excluded.calculated_at,
+            }
+        )
+        db.execute(stmt)
 
-def update_all_possible_meal_portions(db: Session):
-    active_meals = get_meals(db, active_only=True, limit=10000)
-
-    # Avval barcha PossibleMeals yozuvlarini o'chirish yoki meal_id bo'yicha topib yangilash
-    # Hozircha, mavjudlarini topib, yangilaymiz, yo'qlarini qo'shamiz.
-    # Noaktiv bo'lib qolgan ovqatlar uchun PossibleMeals ni o'chiramiz.
-
-    all_possible_meal_entries = {pm.meal_id: pm for pm in db.query(models.PossibleMeals).all()}
-    active_meal_ids = {m.id for m in active_meals}
-
-    for meal in active_meals:
-        possible_portions, limiting_product_id = calculate_possible_portions_for_meal(db, meal.id)
-
-        if meal.id in all_possible_meal_entries:  # Update existing
-            existing_pm = all_possible_meal_entries[meal.id]
-            existing_pm.possible_portions = possible_portions
-            existing_pm.limiting_product_id = limiting_product_id
-            existing_pm.calculated_at = datetime.now()
-        else:  # Create new
-            db_possible_meal = models.PossibleMeals(
-                meal_id=meal.id,
-                possible_portions=possible_portions,
-                limiting_product_id=limiting_product_id,
-                calculated_at=datetime.now()
-            )
-            db.add(db_possible_meal)
-
-    # Remove entries for meals that are no longer active or deleted
-    for meal_id_in_pm, pm_entry in all_possible_meal_entries.items():
-        if meal_id_in_pm not in active_meal_ids:
-            db.delete(pm_entry)
+
+def update_possible_meal_portions_for_meals(db: Session, meal_ids: Optional[Iterable[int]] = None) -> List[int]:
+    """
+    Berilgan ovqatlar uchun `PossibleMeals` ni qayta hisoblaydi (meal_ids=None - barcha ovqatlar).
+    Porsiyalar keshdagi talab matritsasi va qoldiqlar vektoridan bitta vektorlashgan hisob bilan olinadi
+    (numpy bo'lmasa - ovqatma-ovqat). Qoldiqlar bitta so'rovda yuklanadi, natija bitta upsert bilan yoziladi.
+    Faol bo'lmagan/o'chirilgan ovqatlar yozuvlari o'chiriladi. Commit qiladi.
+    Qayta hisoblangan (faol) ovqatlar IDlarini qaytaradi.
+    """
+    if meal_ids is not None:
+        meal_ids = set(meal_ids)
+        if not meal_ids:
+            return []
+
+    matrix = get_portion_matrix(db)
+    if matrix is not None:
+        active_meal_ids = set(matrix.meal_index) if meal_ids is None else meal_ids & matrix.meal_index.keys()
+        stock_map = _get_stock_map(db, matrix.product_ids_for_meals(None if meal_ids is None else active_meal_ids))
+        portions_by_meal = matrix.possible_portions(stock_map, active_meal_ids)
+    else:
+        active_meals = _load_active_meals_with_recipes(db, meal_ids)
+        active_meal_ids = {m.id for m in active_meals}
+        stock_map = _get_stock_map(db, (mi.product_id for m in active_meals for mi in m.ingredients))
+        portions_by_meal = {meal.id: _calculate_possible_portions(meal, stock_map) for meal in active_meals}
+
+    calculated_at = datetime.now()
+    rows = [{
+        "meal_id": meal_id,
+        "possible_portions": possible_portions,
+        "limiting_product_id": limiting_product_id,
+        "calculated_at": calculated_at,
+    } for meal_id, (possible_portions, limiting_product_id) in sorted(portions_by_meal.items())]
+    _upsert_possible_meals(db, rows)
+
+    # Faol bo'lmagan yoki o'chirilgan ovqatlar yozuvlarini olib tashlash
+    stale_query = db.query(models.PossibleMeals)
+    if meal_ids is not None:
+        stale_query = stale_query.filter(models.PossibleMeals.meal_id.in_(meal_ids - active_meal_ids))
+    elif active_meal_ids:
+        stale_query = stale_query.filter(models.PossibleMeals.meal_id.notin_(active_meal_ids))
+    stale_query.delete(synchronize_session=False)
 
     db.commit()
+    return sorted(active_meal_ids)
+
+
+def update_possible_meal_portions_for_products(db: Session, product_ids: Iterable[int]) -> List[int]:
+    """Faqat qoldig'i o'zgargan mahsulotlarga bog'liq ovqatlarni qayta hisoblaydi."""
+    meal_ids = get_meal_ids_using_products(db, product_ids)
+    if not meal_ids:
+        return []
+    return update_possible_meal_portions_for_meals(db, meal_ids)
+
+
+def update_all_possible_meal_portions(db: Session):
+    # To'liq qayta hisoblash (`python -m app.cli portions` va Celery Beat dagi xavfsizlik tarmog'i uchun)
+    return update_possible_meal_portions_for_meals(db, None)
 
 
 def get_possible_meal_portions_list(db: Session, limit: int = 50) -> List[schemas.MealPortionInfo]:
@@ -757,49 +1163,14 @@ def create_suspicious_report_db_notifications(db: Session, report: models.Monthl
                 created_notifications.append(notif)
     return created_notifications
 
-def _convert_units_for_comparison(
-        quantity_recipe: float,
-        unit_short_recipe: str,
-        unit_short_base_product: str
-) -> Optional[float]:
+def convert_to_product_unit(db: Session, quantity: float, unit_id: int,
+                             product: models.Product) -> Optional[float]:
     """
-    Retseptdagi miqdorni mahsulotning ombordagi asosiy birligiga o'tkazadi.
-    - Agar birliklar bir xil bo'lsa (nomi yoki qisqa nomi bo'yicha), miqdorni o'zgartirmaydi.
-    - Faqat gramm <-> kilogramm va millilitr <-> litr juftliklarini konvertatsiya qiladi.
-    - Boshqa mos kelmaydigan konvertatsiyalar uchun (masalan, "dona" vs "kg") None qaytaradi.
+    Retsept birligidagi miqdorni mahsulotning ombordagi asosiy birligiga o'tkazadi (keshlangan konvertatsiya
+    jadvali, app/unit_conversion.py). Konvertatsiya qilib bo'lmasa (masalan, "dona" vs "kg") None qaytaradi.
     """
-    u_recipe_clean = unit_short_recipe.lower().strip()
-    u_base_clean = unit_short_base_product.lower().strip()
-
-    # 1. Agar birliklar bir xil bo'lsa
-    if u_recipe_clean == u_base_clean:
-        return quantity_recipe
-
-    # 2. Og'irlik konvertatsiyasi (gramm <-> kilogramm)
-    # Kengroq aliaslarni ishlatish
-    gram_aliases = ["gr", "gramm", "g", "грамм", "гр"]
-    kg_aliases = ["kg", "kilogramm", "килограмм", "кг"]
-
-    if u_recipe_clean in gram_aliases and u_base_clean in kg_aliases:
-        return quantity_recipe / 1000.0  # Retsept grammda, ombor kg da => kg ga o'tkazamiz
-    if u_recipe_clean in kg_aliases and u_base_clean in gram_aliases:
-        return quantity_recipe * 1000.0  # Retsept kg da, ombor grammda => grammga o'tkazamiz
-
-    # 3. Hajm konvertatsiyasi (millilitr <-> litr)
-    ml_aliases = ["ml", "millilitr", "мл", "миллилитr"]
-    l_aliases = ["l", "litr", "литр", "л"]
-
-    if u_recipe_clean in ml_aliases and u_base_clean in l_aliases:
-        return quantity_recipe / 1000.0  # Retsept ml da, ombor l da => litrga o'tkazamiz
-    if u_recipe_clean in l_aliases and u_base_clean in ml_aliases:
-        return quantity_recipe * 1000.0  # Retsept l da, ombor ml da => millilitrga o'tkazamiz
-
-    # 4. Agar yuqoridagi shartlarga tushmasa, birliklar har xil va
-    #    biz qo'llab-quvvatlaydigan standart konvertatsiya yo'q.
-    #    Bu "dona" vs "kg" kabi holatlarni ham o'z ichiga oladi.
-    print(
-        f"WARN: CRUD_UNIT_CONVERSION - Cannot convert from '{unit_short_recipe}' to '{unit_short_base_product}'. Units are incompatible or conversion is not supported.")
-    return None
+    table = unit_conversion.get_conversion_table(db, (unit_id, product.unit_id))
+    return table.convert(quantity, unit_id, product.unit_id, product.density)
 
 # --- Hisobotlar (Bu funksiyalar WS yubormaydi, Celery taski Redisga yozadi) ---
 def get_monthly_report(db: Session, report_id: int) -> Optional[models.MonthlyReport]:
@@ -870,12 +1241,89 @@ List[schemas.ProductDeliveryDataPoint]:
     ) for r in results]
 
 
-def generate_monthly_report_db_only(db: Session, year: int, month: int, user_id: Optional[int] = None) -> Optional[
-    models.MonthlyReport]:
+def _get_monthly_ledger_totals(db: Session, start_dt: datetime, end_dt: datetime) -> Tuple[
+    Dict[int, float], Dict[Tuple[int, int], float]]:
+    """
+    Oy davomidagi kirim va sarf jurnallarini guruhlangan SQL bilan bir marta o'qiydi.
+    Qaytaradi: ({product_id: kirim}, {(meal_id, product_id): haqiqiy sarf}).
+    """
+    received_rows = db.query(
+        models.ProductDelivery.product_id,
+        func.sum(models.ProductDelivery.quantity)
+    ).filter(
+        models.ProductDelivery.delivery_date >= start_dt,
+        models.ProductDelivery.delivery_date <= end_dt
+    ).group_by(models.ProductDelivery.product_id).all()
+
+    usage_rows = db.query(
+        models.MealServing.meal_id,
+        models.ServingDetail.product_id,
+        func.sum(models.ServingDetail.quantity_used)
+    ).join(models.ServingDetail, models.MealServing.id == models.ServingDetail.serving_id).filter(
+        models.MealServing.served_at >= start_dt,
+        models.MealServing.served_at <= end_dt
+    ).group_by(models.MealServing.meal_id, models.ServingDetail.product_id).all()
+
+    received_map = {product_id: float(total or 0.0) for product_id, total in received_rows}
+    usage_map = {(meal_id, product_id): float(total or 0.0) for meal_id, product_id, total in usage_rows}
+    return received_map, usage_map
+
+
+def _get_calculated_consumption(db: Session, start_dt: datetime, end_dt: datetime) -> Dict[int, float]:
+    """
+    Retsept bo'yicha nazariy sarf: har bir mahsulot uchun SUM(berilgan porsiyalar x 1 porsiya miqdori asosiy
+    birlikda), to'liq bazada. Ovqat berishlar o'sha paytdagi retsept versiyasi talab vektori bo'yicha hisoblanadi,
+    shuning uchun keyingi retsept o'zgarishlari o'tgan oylar hisobotini o'zgartirmaydi. Versiyasiz (migratsiyadan
+    oldingi) ovqat berishlar uchun joriy retsept ishlatiladi.
+    """
+    in_period = and_(models.MealServing.served_at >= start_dt, models.MealServing.served_at <= end_dt)
+    served_by_version = db.query(
+        models.MealServing.recipe_version_id,
+        func.sum(models.MealServing.portions_served).label("portions")
+    ).filter(in_period, models.MealServing.recipe_version_id != None).group_by(
+        models.MealServing.recipe_version_id).subquery()
+    versioned_rows = db.query(
+        models.MealRecipeVersionItem.product_id,
+        func.sum(models.MealRecipeVersionItem.quantity_per_portion_base * served_by_version.c.portions)
+    ).join(
+        served_by_version, served_by_version.c.recipe_version_id == models.MealRecipeVersionItem.recipe_version_id
+    ).group_by(models.MealRecipeVersionItem.product_id).all()
+
+    served_without_version = db.query(
+        models.MealServing.meal_id,
+        func.sum(models.MealServing.portions_served).label("portions")
+    ).filter(in_period, models.MealServing.recipe_version_id == None).group_by(models.MealServing.meal_id).subquery()
+    legacy_rows = db.query(
+        models.MealIngredient.product_id,
+        func.sum(models.MealIngredient.quantity_per_portion_base * served_without_version.c.portions)
+    ).join(
+        served_without_version, served_without_version.c.meal_id == models.MealIngredient.meal_id
+    ).filter(
+        models.MealIngredient.quantity_per_portion_base != None
+    ).group_by(models.MealIngredient.product_id).all()
+
+    calculated_map: Dict[int, float] = {}
+    for product_id, total in versioned_rows + legacy_rows:
+        calculated_map[product_id] = calculated_map.get(product_id, 0.0) + float(total or 0.0)
+    return calculated_map
+
+
+def generate_monthly_report_db_only(db: Session, year: int, month: int, user_id: Optional[int] = None,
+                                    force: bool = False) -> Optional[models.MonthlyReport]:
+    """
+    Oylik hisobotni generatsiya qiladi. Oy ma'lumotlari (ovqat berishlar, retseptlar, kirimlar,
+    boshlang'ich qoldiqlar) bir necha guruhlangan so'rov bilan bir marta yuklanadi va barcha
+    mahsulotlar uchun bitta o'tishda hisoblanadi; natija qatorlari ommaviy (bulk) yoziladi.
+    Oy yopilgandan keyin generatsiya qilingan (final) hisobot o'zgarmaydi va `force` berilmasa qayta
+    hisoblanmasdan qaytariladi.
+    """
     report_month_date = date(year, month, 1)
 
     existing_report = db.query(models.MonthlyReport).filter(
         models.MonthlyReport.report_month == report_month_date).first()
+    if existing_report and existing_report.is_final and not force:
+        print(f"INFO: CRUD - Report for {year}-{month:02d} is final, returning the stored report.")
+        return get_monthly_report_with_all_details(db, existing_report.id)
     if existing_report:
         print(f"INFO: CRUD - Deleting existing report data for {year}-{month:02d} before regeneration.")
         db.query(models.ReportMealPerformance).filter(
@@ -884,6 +1332,7 @@ def generate_monthly_report_db_only(db: Session, year: int, month: int, user_id:
             synchronize_session=False)
         db.query(models.ProductMonthlyBalance).filter(
             models.ProductMonthlyBalance.report_id == existing_report.id).delete(synchronize_session=False)
+        db.expire(existing_report)  # Sessiyada yuklangan (o'chirilgan) bog'liq qatorlar cascade qilinmasin
         db.delete(existing_report)
         db.commit()
 
@@ -900,211 +1349,93 @@ def generate_monthly_report_db_only(db: Session, year: int, month: int, user_id:
         generated_by=user_id,
         total_portions_served_overall=0,
         is_overall_suspicious=False,
+        # Oy tugagan - ovqat berishlar versiyalangan retseptlar bo'yicha, natija endi o'zgarmaydi
+        is_final=datetime.now() > end_of_month_dt_with_time,
         # difference_percentage=0.0,
     )
     db.add(db_report)
     db.flush()
 
-    # --- 1. ReportMealPerformance ---
+    # --- 0. Oy ma'lumotlarini bir marta yuklash ---
     served_portions_by_meal_id_q = db.query(
         models.MealServing.meal_id,
         func.sum(models.MealServing.portions_served).label("monthly_served_for_meal")
     ).filter(
         models.MealServing.served_at >= start_of_month_dt,
         models.MealServing.served_at <= end_of_month_dt_with_time
-    ).group_by(models.MealServing.meal_id).all()
-    served_portions_map = {item.meal_id: item.monthly_served_for_meal for item in served_portions_by_meal_id_q}
+    ).group_by(models.MealServing.meal_id)
+    served_portions_map = {item.meal_id: int(item.monthly_served_for_meal or 0)
+                           for item in served_portions_by_meal_id_q.all()}
 
-    current_possible_meals_q = db.query(models.PossibleMeals).all()
-    possible_portions_map = {pm.meal_id: pm.possible_portions for pm in current_possible_meals_q}
+    possible_portions_map = dict(db.query(models.PossibleMeals.meal_id, models.PossibleMeals.possible_portions).all())
+    active_meal_ids = [meal_id for (meal_id,) in db.query(models.Meal.id).filter(models.Meal.deleted_at == None).all()]
+    active_product_ids = [product_id for (product_id,) in
+                          db.query(models.Product.id).filter(models.Product.deleted_at == None).all()]
 
-    all_meals_in_db = db.query(models.Meal).filter(models.Meal.deleted_at == None).all()
+    received_map, usage_map = _get_monthly_ledger_totals(db, start_of_month_dt, end_of_month_dt_with_time)
+    initial_stock_map = _get_opening_stock_map(db, start_of_month_dt.date(), active_product_ids)
+    calculated_consumption_map = _get_calculated_consumption(db, start_of_month_dt, end_of_month_dt_with_time)
 
+    # --- 1. ReportMealPerformance ---
     calculated_total_served_overall_var = 0  # O'zgaruvchi nomini aniqlashtirdim
     at_least_one_meal_suspicious_calc = False
-
-    # for meal_obj_loop in all_meals_in_db:
-    #     meal_id_val = meal_obj_loop.id
-    #     portions_served = int(served_portions_map.get(meal_id_val, 0))
-    #     possible_portions = int(possible_portions_map.get(meal_id_val, 0))
-    #     calculated_total_served_overall_var += portions_served
-    #
-    #     diff_perc_meal = 0.0
-    #     is_susp_meal = False
-    #     if possible_portions > 0:
-    #         difference = possible_portions - portions_served
-    #         diff_perc_meal = (abs(difference) / possible_portions) * 100 if possible_portions > 0 else 0
-    #         if portions_served > possible_portions:
-    #             is_susp_meal = True
-    #         elif diff_perc_meal > settings.SUSPICIOUS_DIFFERENCE_PERCENTAGE:
-    #             is_susp_meal = True
-    #     elif portions_served > 0:
-    #         is_susp_meal = True
-    #
-    #     if is_susp_meal:
-    #         at_least_one_meal_suspicious_calc = True
-    #
-    #     meal_perf_entry = models.ReportMealPerformance(
-    #         report_id=db_report.id,
-    #         meal_id=meal_id_val,
-    #         portions_served_this_meal=portions_served,
-    #         possible_portions_at_report_time=possible_portions,
-    #         difference_percentage=round(diff_perc_meal, 2) if possible_portions > 0 else (100.0 if portions_served > 0 else 0.0),
-    #         is_suspicious=is_susp_meal
-    #     )
-    #     db.add(meal_perf_entry)
-
-    # Joriy oyni aniqlaymiz (misol uchun)
-    current_month = datetime.now().replace(day=1)  # Har oyning boshidan boshlanadi
-    last_month = current_month - timedelta(days=30)  # O'tgan oyning hisoblangan boshlanishi
-
-    # `MonthlyReport` jadvalidan ma'lumotlarni olamiz
-    current_report = db.query(models.MonthlyReport).filter(
-        models.MonthlyReport.report_month == current_month
-    ).first()
-    last_report = db.query(models.MonthlyReport).filter(
-        models.MonthlyReport.report_month == last_month
-    ).first()
-
-    if not current_report or not last_report:
-        # Agar hisobot mavjud bo'lmasa, kodni to'xtatamiz
-        print("Joriy va/yoki o'tgan oy uchun hisobot ma'lumotlari topilmadi!")
-    else:
-        # Joriy oy ingredient sarflari
-        current_ingredients = (
-            db.query(models.ReportDetail)
-            .filter(models.ReportDetail.report_id == current_report.id)
-            .all()
-        )
-
-        # O'tgan oy ingredient sarflari
-        last_ingredients = (
-            db.query(models.ReportDetail)
-            .filter(models.ReportDetail.report_id == last_report.id)
-            .all()
-        )
-
-        # O'tgan oy ingredientlarini dictionary formatida saqlaymiz
-        last_ingredients_map = {
-            detail.product_id: detail.total_quantity_used for detail in last_ingredients
-        }
-
-        # Eng kam shubhali farq (%) chegarasi
-        MIN_SUSPICIOUS_PERCENTAGE = 15
-
-        for current_detail in current_ingredients:
-            product_id = current_detail.product_id  # Mahsulot ID
-            current_quantity = current_detail.total_quantity_used  # Joriy oy miqdori
-
-            # O'tgan oy ingredient ma'lumotlari - agar mavjud bo'lsa
-            last_quantity = last_ingredients_map.get(product_id, 0)
-
-            is_suspicious = False  # Har bir ingredient uchun shubhalilik tekshiruvi
-            diff_percent = 0.0  # Farq boshlang'ich qiymati
-
-            if last_quantity > 0:
-                # Foiz farqni hisoblash
-                diff_percent = abs((1 - (current_quantity / last_quantity)) * 100)
-
-                # Agar farq belgilangan foizdan yuqori bo'lsa
-                if diff_percent >= MIN_SUSPICIOUS_PERCENTAGE:
-                    is_suspicious = True
-
-            elif last_quantity == 0 and current_quantity > 0:
-                # Agar o'tgan oyda ishlatilmagan bo'lsa, lekin hozir ishlatilsa
-                is_suspicious = True
-
-            if is_suspicious:
-                # Agar shubhali bo'lsa, bildirish chiqaramiz
-                create_notification(
-                    db,
-                    schemas.NotificationCreate(
-                        message=f"Shubhali ingredient ID {product_id}: Foiz farqi - {round(diff_percent, 2)}%, "
-                                f"Joriy oy: {current_quantity}, O'tgan oy: {last_quantity}.",
-                        notification_type_id=settings.NOTIFICATION_TYPE_ID
-                    )
-                )
-
-            # Natijalarni hisobotga yozamiz
-            meal_perf_entry = models.ReportMealPerformance(
-                report_id=current_report.id,
-                meal_id=current_detail.meal_id,
-                portions_served_this_meal=current_quantity,
-                difference_percentage=diff_percent,
-                is_suspicious=is_suspicious
-            )
-            db.add(meal_perf_entry)
-
+    meal_performance_rows = []
+
+    for meal_id_val in active_meal_ids:
+        portions_served = served_portions_map.get(meal_id_val, 0)
+        possible_portions = int(possible_portions_map.get(meal_id_val, 0))
+        calculated_total_served_overall_var += portions_served
+
+        diff_perc_meal = 0.0
+        is_susp_meal = False
+        if possible_portions > 0:
+            difference = possible_portions - portions_served
+            diff_perc_meal = (abs(difference) / possible_portions) * 100
+            if portions_served > possible_portions:
+                is_susp_meal = True
+            elif diff_perc_meal > settings.SUSPICIOUS_DIFFERENCE_PERCENTAGE:
+                is_susp_meal = True
+        elif portions_served > 0:
+            is_susp_meal = True
+
+        if is_susp_meal:
+            at_least_one_meal_suspicious_calc = True
+
+        meal_performance_rows.append({
+            "report_id": db_report.id,
+            "meal_id": meal_id_val,
+            "portions_served_this_meal": portions_served,
+            "possible_portions_at_report_time": possible_portions,
+            "difference_percentage": round(diff_perc_meal, 2) if possible_portions > 0 else (
+                100.0 if portions_served > 0 else 0.0),
+            "is_suspicious": is_susp_meal,
+        })
 
     # --- 2. ReportDetail (Ingredient Sarfi) ---
-    ingredient_usage_data = db.query(
-        models.MealServing.meal_id,  # Bu MealServing.meal_id
-        models.ServingDetail.product_id,
-        func.sum(models.ServingDetail.quantity_used).label("total_quantity_used")
-    ).join(models.ServingDetail, models.MealServing.id == models.ServingDetail.serving_id) \
-        .filter(
-        models.MealServing.served_at >= start_of_month_dt,
-        models.MealServing.served_at <= end_of_month_dt_with_time
-    ).group_by(models.MealServing.meal_id, models.ServingDetail.product_id).all()
-
-    for usage_row in ingredient_usage_data:
-        meal_for_detail = db.get(models.Meal, usage_row.meal_id)
-        product_for_detail = db.get(models.Product, usage_row.product_id)
-
-        if meal_for_detail and not meal_for_detail.deleted_at and \
-                product_for_detail and not product_for_detail.deleted_at:
-            ingredient_detail_entry = models.ReportDetail(
-                report_id=db_report.id,
-                meal_id=usage_row.meal_id,
-                product_id=usage_row.product_id,
-                total_quantity_used=float(usage_row.total_quantity_used or 0.0)
-            )
-            db.add(ingredient_detail_entry)
+    active_meal_id_set, active_product_id_set = set(active_meal_ids), set(active_product_ids)
+    ingredient_detail_rows = [
+        {"report_id": db_report.id, "meal_id": meal_id, "product_id": product_id, "total_quantity_used": total_used}
+        for (meal_id, product_id), total_used in usage_map.items()
+        if meal_id in active_meal_id_set and product_id in active_product_id_set
+    ]
 
     # --- 3. ProductMonthlyBalance ---
-    all_products_for_balance = db.query(models.Product).filter(models.Product.deleted_at == None).all()
-    any_product_balance_suspicious = False
+    actual_consumption_map: Dict[int, float] = {}
+    for (_, product_id), total_used in usage_map.items():
+        actual_consumption_map[product_id] = actual_consumption_map.get(product_id, 0.0) + total_used
 
-    for product_loop_bal in all_products_for_balance:
-        initial_stock_val = _get_product_stock_at_date(db, product_loop_bal.id, start_of_month_dt.date())
-        total_received_val = db.query(func.sum(models.ProductDelivery.quantity)).filter(
-            models.ProductDelivery.product_id == product_loop_bal.id,
-            func.date(models.ProductDelivery.delivery_date) >= start_of_month_dt.date(),  # Sanani sanaga solishtirish
-            func.date(models.ProductDelivery.delivery_date) <= end_of_month_date_obj
-        ).scalar() or 0.0
+    any_product_balance_suspicious = False
+    balance_rows = []
+    for product_id in active_product_ids:
+        initial_stock_val = initial_stock_map.get(product_id, 0.0)
+        total_received_val = received_map.get(product_id, 0.0)
         total_available_val = initial_stock_val + total_received_val
-        actual_consumption_val = db.query(func.sum(models.ServingDetail.quantity_used)).join(
-            models.MealServing, models.ServingDetail.serving_id == models.MealServing.id
-        ).filter(
-            models.ServingDetail.product_id == product_loop_bal.id,
-            models.MealServing.served_at >= start_of_month_dt,
-            models.MealServing.served_at <= end_of_month_dt_with_time
-        ).scalar() or 0.0
-        calculated_consumption_val = 0.0
-        # ... (calculated_consumption_val hisoblash logikasi o'zgarishsiz) ...
-        servings_in_month_for_calc_q = db.query(models.MealServing).filter(
-            models.MealServing.served_at >= start_of_month_dt,
-            models.MealServing.served_at <= end_of_month_dt_with_time
-        ).options(
-            selectinload(models.MealServing.meal).selectinload(models.Meal.ingredients).selectinload(
-                models.MealIngredient.unit),
-            selectinload(models.MealServing.meal).selectinload(models.Meal.ingredients).selectinload(
-                models.MealIngredient.product).selectinload(models.Product.unit)
-        ).all()
-
-        for serving_item_calc in servings_in_month_for_calc_q:
-            if serving_item_calc.meal and serving_item_calc.meal.ingredients:
-                for mi_calc in serving_item_calc.meal.ingredients:
-                    if mi_calc.product_id == product_loop_bal.id:
-                        if mi_calc.unit and product_loop_bal.unit:
-                            qty_in_base = _convert_units_for_comparison(mi_calc.quantity_per_portion,
-                                                                        mi_calc.unit.short_name,
-                                                                        product_loop_bal.unit.short_name)
-                            if qty_in_base is not None:
-                                calculated_consumption_val += qty_in_base * serving_item_calc.portions_served
-        # ... (calculated_consumption_val hisoblash logikasi tugadi) ...
+        actual_consumption_val = actual_consumption_map.get(product_id, 0.0)
+        calculated_consumption_val = calculated_consumption_map.get(product_id, 0.0)
+
         theoretical_ending_stock_val = total_available_val - calculated_consumption_val
-        actual_ending_stock_val = get_product_current_quantity(db, product_loop_bal.id)
+        # Oy oxiridagi haqiqiy qoldiq (hisobot qachon generatsiya qilinishidan qat'i nazar)
+        actual_ending_stock_val = total_available_val - actual_consumption_val
         discrepancy_val = theoretical_ending_stock_val - actual_ending_stock_val
 
         discrepancy_perc = 0.0
@@ -1118,22 +1449,29 @@ def generate_monthly_report_db_only(db: Session, year: int, month: int, user_id:
         if actual_ending_stock_val < 0 and theoretical_ending_stock_val >= 0:  # Agar haqiqiy qoldiq minus bo'lsa
             is_bal_susp_val = True
 
-        balance_entry = models.ProductMonthlyBalance(
-            report_id=db_report.id, product_id=product_loop_bal.id,
-            initial_stock=initial_stock_val,
-            total_received=total_received_val,
-            total_available=total_available_val,
-            calculated_consumption=calculated_consumption_val,
-            actual_consumption=actual_consumption_val,
-            theoretical_ending_stock=theoretical_ending_stock_val,
-            actual_ending_stock=actual_ending_stock_val,
-            discrepancy=discrepancy_val,
-            is_balance_suspicious=is_bal_susp_val
-        )
-        db.add(balance_entry)
+        balance_rows.append({
+            "report_id": db_report.id, "product_id": product_id,
+            "initial_stock": initial_stock_val,
+            "total_received": total_received_val,
+            "total_available": total_available_val,
+            "calculated_consumption": calculated_consumption_val,
+            "actual_consumption": actual_consumption_val,
+            "theoretical_ending_stock": theoretical_ending_stock_val,
+            "actual_ending_stock": actual_ending_stock_val,
+            "discrepancy": discrepancy_val,
+            "is_balance_suspicious": is_bal_susp_val,
+        })
         if is_bal_susp_val:
             any_product_balance_suspicious = True
 
+    # Ommaviy yozish (har bir qator uchun alohida ORM obyekt yaratilmaydi)
+    if meal_performance_rows:
+        db.execute(insert(models.ReportMealPerformance), meal_performance_rows)
+    if ingredient_detail_rows:
+        db.execute(insert(models.ReportDetail), ingredient_detail_rows)
+    if balance_rows:
+        db.execute(insert(models.ProductMonthlyBalance), balance_rows)
+
     db_report.total_portions_served_overall = calculated_total_served_overall_var
     db_report.is_overall_suspicious = at_least_one_meal_suspicious_calc or any_product_balance_suspicious
 
@@ -1188,6 +1526,102 @@ def _get_product_stock_at_date(db: Session, product_id: int, target_date: date)
     return total_delivered_before_target - total_used_before_target
 
 
+def _get_products_stock_delta(db: Session, start_dt: Optional[datetime], end_dt: datetime,
+                              product_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """
+    [start_dt, end_dt) oralig'idagi qoldiq o'zgarishi (kirim - sarf) mahsulotlar bo'yicha,
+    ikki guruhlangan so'rov bilan. start_dt=None - tizim boshidan.
+    """
+    delivered_query = db.query(
+        models.ProductDelivery.product_id, func.sum(models.ProductDelivery.quantity)
+    ).filter(models.ProductDelivery.delivery_date < end_dt)
+    used_query = db.query(
+        models.ServingDetail.product_id, func.sum(models.ServingDetail.quantity_used)
+    ).join(
+        models.MealServing, models.ServingDetail.serving_id == models.MealServing.id
+    ).filter(models.MealServing.served_at < end_dt)
+    if start_dt is not None:
+        delivered_query = delivered_query.filter(models.ProductDelivery.delivery_date >= start_dt)
+        used_query = used_query.filter(models.MealServing.served_at >= start_dt)
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        delivered_query = delivered_query.filter(models.ProductDelivery.product_id.in_(product_ids))
+        used_query = used_query.filter(models.ServingDetail.product_id.in_(product_ids))
+
+    delta_map = {product_id: float(total or 0.0) for product_id, total in
+                 delivered_query.group_by(models.ProductDelivery.product_id).all()}
+    for product_id, total in used_query.group_by(models.ServingDetail.product_id).all():
+        delta_map[product_id] = delta_map.get(product_id, 0.0) - float(total or 0.0)
+    return delta_map
+
+
+def _get_products_stock_at_date(db: Session, target_date: date,
+                                product_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """Mahsulotlarning berilgan sana boshidagi qoldig'i, butun tarix bo'yicha hisoblangan."""
+    return _get_products_stock_delta(db, None, datetime.combine(target_date, datetime.min.time()), product_ids)
+
+
+def _get_last_stock_snapshot(db: Session, before_date: date) -> Tuple[Optional[datetime], Dict[int, float]]:
+    """
+    `before_date` dan oldingi eng so'nggi yopilgan oy hisobotidagi `actual_ending_stock` qiymatlari.
+    Faqat final hisobotlar olinadi (oy tugagandan keyin generatsiya qilingan va o'sha oyga keyin sanalangan kirim
+    bilan eskirmagan - `_unfinalize_reports_from`); qatorlar ichida o'zaro mos kelmaydiganlari
+    (boshlang'ich + kirim - sarf != oy oxiri qoldig'i, masalan eski hisobotlar) tashlab yuboriladi.
+    Qaytaradi: (snapshot tugash vaqti (keyingi oy boshi), {product_id: qoldiq}).
+    """
+    candidate_reports = db.query(models.MonthlyReport).filter(
+        models.MonthlyReport.report_month < before_date,
+        models.MonthlyReport.is_final == True
+    ).order_by(models.MonthlyReport.report_month.desc()).limit(12).all()
+
+    for report in candidate_reports:
+        rm = report.report_month
+        snapshot_end_dt = datetime(rm.year + 1, 1, 1) if rm.month == 12 else datetime(rm.year, rm.month + 1, 1)
+        if report.generated_at is None or report.generated_at < snapshot_end_dt:
+            continue  # Oy davomida generatsiya qilingan - oy oxiri qoldig'i to'liq emas
+
+        balance_rows = db.query(
+            models.ProductMonthlyBalance.product_id,
+            models.ProductMonthlyBalance.initial_stock,
+            models.ProductMonthlyBalance.total_received,
+            models.ProductMonthlyBalance.actual_consumption,
+            models.ProductMonthlyBalance.actual_ending_stock,
+        ).filter(models.ProductMonthlyBalance.report_id == report.id).all()
+
+        snapshot = {}
+        for product_id, initial_stock, total_received, actual_consumption, actual_ending_stock in balance_rows:
+            if None in (initial_stock, total_received, actual_consumption, actual_ending_stock):
+                continue
+            if abs(initial_stock + total_received - actual_consumption - actual_ending_stock) > 1e-6:
+                continue
+            snapshot[product_id] = actual_ending_stock
+        if snapshot:
+            return snapshot_end_dt, snapshot
+    return None, {}
+
+
+def _get_opening_stock_map(db: Session, month_start_date: date, product_ids: List[int]) -> Dict[int, float]:
+    """
+    Oy boshidagi qoldiq = oxirgi snapshot (oldingi hisobotning oy oxiri qoldig'i) + snapshotdan keyingi o'zgarish.
+    Snapshotda yo'q mahsulotlar uchungina butun tarix bo'yicha hisoblanadi.
+    """
+    month_start_dt = datetime.combine(month_start_date, datetime.min.time())
+    snapshot_end_dt, snapshot = _get_last_stock_snapshot(db, month_start_date)
+    if snapshot_end_dt is None:
+        return _get_products_stock_at_date(db, month_start_date, product_ids)
+
+    opening_map = dict(snapshot)
+    for product_id, delta in _get_products_stock_delta(db, snapshot_end_dt, month_start_dt, product_ids).items():
+        opening_map[product_id] = opening_map.get(product_id, 0.0) + delta
+
+    missing_product_ids = [product_id for product_id in product_ids if product_id not in snapshot]
+    if missing_product_ids:
+        # Snapshot qilinmagan mahsulotlar: snapshotgacha bo'lgan tarix ham hisobga olinadi
+        for product_id, stock_before in _get_products_stock_at_date(db, snapshot_end_dt.date(), missing_product_ids).items():
+            opening_map[product_id] = opening_map.get(product_id, 0.0) + stock_before
+    return opening_map
+
+
 
 
 
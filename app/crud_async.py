@@ -0,0 +1,148 @@
+# app/crud_async.py
+# crud.py dagi eng ko'p chaqiriladigan o'qish funksiyalarining AsyncSession (create_async_engine) variantlari:
+# auth, ombor qoldig'i, mumkin bo'lgan porsiyalar, ovqat berishlar va bildirishnomalar.
+# AsyncSession da yashirin (lazy) yuklash ishlamaydi - javobda kerak bo'ladigan barcha relationshiplar
+# so'rovning o'zida (joinedload/selectinload) yuklanadi.
+from datetime import datetime, date
+from typing import List, Optional
+
+from sqlalchemy import select, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import models, schemas
+
+
+# --- User ---
+async def get_active_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    # Faqat aktiv va o'chirilmagan foydalanuvchi, roli bilan bitta so'rovda
+    result = await db.execute(
+        select(models.User).options(joinedload(models.User.role)).filter(
+            models.User.username == username,
+            models.User.is_active == True,
+            models.User.deleted_at == None
+        )
+    )
+    return result.scalars().first()
+
+
+# --- Product / ombor qoldig'i ---
+async def get_product(db: AsyncSession, product_id: int) -> Optional[models.Product]:
+    result = await db.execute(
+        select(models.Product).options(
+            selectinload(models.Product.unit),
+            selectinload(models.Product.created_by_user)
+        ).filter(models.Product.id == product_id, models.Product.deleted_at == None)
+    )
+    return result.scalars().first()
+
+
+async def _get_product_quantity_from_ledger(db: AsyncSession, product_id: int) -> float:
+    """Kirim va sarf jurnallaridan qoldiqni qayta hisoblaydi (crud._get_product_quantity_from_ledger bilan bir xil)."""
+    total_delivered = await db.scalar(
+        select(func.sum(models.ProductDelivery.quantity)).filter(models.ProductDelivery.product_id == product_id)
+    ) or 0.0
+    total_used = await db.scalar(
+        select(func.sum(models.ServingDetail.quantity_used)).filter(models.ServingDetail.product_id == product_id)
+    ) or 0.0
+    return total_delivered - total_used
+
+
+async def get_product_current_quantity(db: AsyncSession, product_id: int) -> float:
+    db_stock = await db.get(models.ProductStock, product_id)
+    if db_stock is None:  # Balans yaratilmagan (masalan, rebuild_product_stock hali ishlamagan)
+        return await _get_product_quantity_from_ledger(db, product_id)
+    return db_stock.quantity
+
+
+async def get_all_products_with_current_quantity(
+        db: AsyncSession,
+        skip: int = 0,
+        limit: int = 100,
+        name_filter: Optional[str] = None,
+        low_stock_only: Optional[bool] = False
+) -> List[schemas.ProductWithQuantity]:
+    # Bitta so'rov: mahsulot + birlik + yaratuvchi + balans (LEFT JOIN), filtr, tartib va sahifalash SQL da
+    current_quantity_col = func.coalesce(models.ProductStock.quantity, 0.0).label("current_quantity")
+    query = select(models.Product, current_quantity_col) \
+        .outerjoin(models.ProductStock, models.ProductStock.product_id == models.Product.id) \
+        .options(
+            joinedload(models.Product.unit),
+            joinedload(models.Product.created_by_user)
+        ).filter(models.Product.deleted_at == None)
+
+    if name_filter:
+        query = query.filter(models.Product.name.ilike(f"%{name_filter}%"))
+    if low_stock_only:
+        query = query.filter(func.coalesce(models.ProductStock.quantity, 0.0) < models.Product.min_quantity)
+
+    result = await db.execute(query.order_by(models.Product.name, models.Product.id).offset(skip).limit(limit))
+    return [
+        schemas.ProductWithQuantity(
+            **schemas.Product.model_validate(p_orm).model_dump(),
+            current_quantity=current_quantity
+        )
+        for p_orm, current_quantity in result.all()
+    ]
+
+
+# --- Porsiya hisoblash (PossibleMeals) ---
+async def get_possible_meal_portions_list(db: AsyncSession, limit: int = 50) -> List[schemas.MealPortionInfo]:
+    result = await db.execute(
+        select(models.PossibleMeals)
+        .join(models.Meal, models.PossibleMeals.meal_id == models.Meal.id)
+        .options(
+            joinedload(models.PossibleMeals.meal),
+            joinedload(models.PossibleMeals.limiting_product).joinedload(models.Product.unit)
+        )
+        .filter(models.Meal.is_active == True, models.Meal.deleted_at == None)
+        .order_by(models.PossibleMeals.possible_portions.asc())
+        .limit(limit)
+    )
+
+    portions_info = []
+    for pm in result.scalars().all():
+        limiting_product = pm.limiting_product
+        portions_info.append(schemas.MealPortionInfo(
+            meal_id=pm.meal.id, meal_name=pm.meal.name,
+            possible_portions=pm.possible_portions,
+            limiting_ingredient_name=limiting_product.name if limiting_product else None,
+            limiting_ingredient_unit=limiting_product.unit.short_name if limiting_product and limiting_product.unit else None
+        ))
+    return portions_info
+
+
+# --- MealServing ---
+async def get_meal_servings(
+        db: AsyncSession, skip: int = 0, limit: int = 100, meal_id: Optional[int] = None,
+        user_id: Optional[int] = None, start_date: Optional[date] = None, end_date: Optional[date] = None
+) -> List[models.MealServing]:
+    query = select(models.MealServing).options(
+        selectinload(models.MealServing.meal),
+        selectinload(models.MealServing.served_by_user)
+    )
+    if meal_id:
+        query = query.filter(models.MealServing.meal_id == meal_id)
+    if user_id:
+        query = query.filter(models.MealServing.served_by == user_id)
+    if start_date:
+        query = query.filter(models.MealServing.served_at >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        query = query.filter(models.MealServing.served_at <= datetime.combine(end_date, datetime.max.time()))
+    result = await db.execute(query.order_by(models.MealServing.served_at.desc()).offset(skip).limit(limit))
+    return list(result.scalars().all())
+
+
+# --- Notification ---
+async def get_notifications_for_user(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 20,
+                                     unread_only: bool = False) -> List[models.Notification]:
+    query = select(models.Notification).options(
+        selectinload(models.Notification.notification_type),
+        selectinload(models.Notification.user)
+    ).filter(
+        or_(models.Notification.user_id == user_id, models.Notification.user_id == None)
+    )
+    if unread_only:
+        query = query.filter(models.Notification.is_read == False)
+    result = await db.execute(query.order_by(models.Notification.created_at.desc()).offset(skip).limit(limit))
+    return list(result.scalars().all())
@@ -1,5 +1,10 @@
 # app/database.py
-from sqlalchemy import create_engine
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from app.config import settings
@@ -7,14 +12,63 @@ from app.config import settings
 # Ma'lumotlar bazasi URL manzilini config.py dan olamiz
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    # SQLite uchun `check_same_thread` ni o'rnatamiz
-    engine_args["connect_args"] = {"check_same_thread": False}
 
-engine = create_engine(
+def get_sqlite_pragmas() -> Dict[str, Any]:
+    """Settings dagi SQLite PRAGMA profili (bo'sh qiymatli PRAGMA qo'llanilmaydi)."""
+    pragmas = {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,  # WAL: o'quvchilar yozuvchini bloklamaydi
+        "synchronous": settings.SQLITE_SYNCHRONOUS,  # WAL + NORMAL: har commitda fsync yo'q
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,  # "database is locked" o'rniga qulf bo'shashini kutish
+        "cache_size": -settings.SQLITE_CACHE_SIZE_KB if settings.SQLITE_CACHE_SIZE_KB else None,  # Manfiy - KiB da
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "temp_store": settings.SQLITE_TEMP_STORE,
+    }
+    return {name: value for name, value in pragmas.items() if value not in (None, "")}
+
+
+def install_sqlite_pragmas(sync_engine: Engine, pragmas: Dict[str, Any]):
+    """Har bir yangi SQLite ulanishida PRAGMAlarni bajaradi (sinxron va aiosqlite engine uchun ham)."""
+    if not pragmas:
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def get_engine_options(database_url: str) -> Dict[str, Any]:
+    """Pool sozlamalari: PostgreSQL uchun to'liq profil, fayldagi SQLite uchun faqat pool hajmi."""
+    url = make_url(database_url)
+    options: Dict[str, Any] = {}
+    if url.get_backend_name() == "sqlite":
+        if url.drivername == "sqlite":
+            # SQLite uchun `check_same_thread` ni o'rnatamiz
+            options["connect_args"] = {"check_same_thread": False}
+        if not url.database or url.database == ":memory:":
+            return options  # Xotiradagi baza bitta ulanishda yashaydi - pool sozlanmaydi
+    else:
+        options["pool_pre_ping"] = settings.DB_POOL_PRE_PING  # Uzilgan ulanishni so'rovdan oldin aniqlash
+        options["pool_recycle"] = settings.DB_POOL_RECYCLE_SECONDS
+    options.update(pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW,
+                   pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS)
+    return options
+
+
+def create_db_engine(database_url: str, sqlite_pragmas: Optional[Dict[str, Any]] = None, **kwargs) -> Engine:
+    """Settings profilidagi engine. `sqlite_pragmas=None` - settings dagi PRAGMAlar, `{}` - PRAGMAsiz."""
+    db_engine = create_engine(database_url, **{**get_engine_options(database_url), **kwargs})
+    if db_engine.dialect.name == "sqlite":
+        install_sqlite_pragmas(db_engine, get_sqlite_pragmas() if sqlite_pragmas is None else sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine(
     SQLALCHEMY_DATABASE_URL,
-    **engine_args
     # echo=True # Agar SQL so'rovlarini konsolda ko'rishni xohlasangiz (faqat developmentda)
 )
 
@@ -22,10 +76,83 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+
+# --- Sxema versiyasi (Alembic migratsiyalari: app/migrations, `python -m app.cli migrate`) ---
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+ALEMBIC_VERSION_TABLE = "alembic_version"
+
+
+def get_head_revision() -> Optional[str]:
+    """
+    Kod kutayotgan sxema revisioni. Migratsiyalar ketma-ket raqamlanadi (0001_..., 0002_...), shuning uchun
+    eng katta raqam - head. Alembic import qilinmaydi (web worker ishga tushishini sekinlashtirmaslik uchun).
+    """
+    revisions = [path.name.split("_", 1)[0] for path in (MIGRATIONS_DIR / "versions").glob("[0-9]*_*.py")]
+    return max(revisions) if revisions else None
+
+
+def get_current_revision(bind: Engine) -> Optional[str]:
+    """Bazadagi sxema revisioni (`alembic_version` jadvali), migratsiya qilinmagan bazada None."""
+    with bind.connect() as connection:
+        if not inspect(connection).has_table(ALEMBIC_VERSION_TABLE):
+            return None
+        return connection.execute(text(f"SELECT version_num FROM {ALEMBIC_VERSION_TABLE}")).scalar()
+
+
+def verify_schema_version(bind: Engine) -> str:
+    """Baza sxemasi kod bilan bir xil revisionda ekanini tekshiradi, aks holda RuntimeError."""
+    head_revision = get_head_revision()
+    current_revision = get_current_revision(bind)
+    if current_revision != head_revision:
+        raise RuntimeError(
+            f"Database schema revision is {current_revision or 'missing'}, expected {head_revision}. "
+            f"Run 'python -m app.cli migrate' (or 'python -m app.cli setup' for a new database) first."
+        )
+    return current_revision
+
+
 # Dependency: Har bir so'rov uchun DB sessiyasini olish
 def get_db() -> Session:
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- Asinxron engine (AsyncSession) ---
+# Ko'p so'raladigan (dashboard polling) endpointlar crud_async orqali shu engine bilan ishlaydi - threadpool band
+# qilinmaydi. Sinxron engine (crud.py, Celery tasklari, yozish amallari) o'zgarishsiz qoladi.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """DATABASE_URL dan asinxron drayverli URL yasaydi (ASYNC_DATABASE_URL berilmagan bo'lsa)."""
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+
+ASYNC_SQLALCHEMY_DATABASE_URL = settings.ASYNC_DATABASE_URL or get_async_database_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[async_sessionmaker] = None
+try:
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL,
+                                       **get_engine_options(ASYNC_SQLALCHEMY_DATABASE_URL))
+    if async_engine.dialect.name == "sqlite":
+        install_sqlite_pragmas(async_engine.sync_engine, get_sqlite_pragmas())
+    # expire_on_commit=False: commitdan keyin atributlarga murojaat qilish yashirin (lazy) so'rov yubormaydi
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+except ImportError as e:  # aiosqlite / asyncpg o'rnatilmagan (masalan, faqat Celery worker uchun muhit)
+    print(f"WARN:     Async database driver is not available ({e}). Async endpoints will not work.")
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine is not configured (aiosqlite/asyncpg o'rnatilmagan).")
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -3,176 +3,83 @@
 # eventlet.monkey_patch()
 
 import asyncio
+import anyio
 import json
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
-import redis
 from fastapi import (
     FastAPI, Depends, Request, WebSocket, WebSocketDisconnect,
     HTTPException, status, Query, Security
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
-from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from pathlib import Path
+from zoneinfo import ZoneInfo
 
-from app import crud, models, schemas, security
-from app.database import engine, get_db, SessionLocal
+from app import models, schemas, security
+from app.database import engine, async_engine, get_db, SessionLocal, verify_schema_version
 from app.config import settings
-from app.utils import create_initial_data
 
 # Routerlarni import qilish
 from app.routers import auth, users, products, meals, servings, reports, audit_logs
 
-# WebSocket Connection Manager va Redis Pub/Sub
-from app.websockets.connection_manager import manager as ws_manager
+# WebSocket Connection Manager va Redis Stream
+from app.websockets.connection_manager import manager as ws_manager, ClientConnection, is_client_subscribable_topic
+from app.websockets.redis_listener import redis_message_listener, replay_missed_events
+from app.websockets import presence
 from app.schemas import WebSocketMessage
-from app.celery_config import redis_client_for_celery_config as redis_client, \
-    WS_MESSAGE_CHANNEL  # celery_config dan olamiz
+from app.websockets.publisher import publish_ws_message
 
 # JWT xatoliklari uchun
 from jose import JWTError, jwt
 
 
-# --- Redis Pub/Sub Listener ---
-async def redis_message_listener():
-    """
-    Redis Pub/Sub kanaliga obuna bo'ladi va kelgan xabarlarni
-    WebSocket orqali barcha ulangan klientlarga (yoki kerakli guruhlarga) yuboradi.
-    Bu funksiya FastAPI startup eventida `asyncio.create_task` orqali ishga tushiriladi.
-    """
-    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-    try:
-        pubsub.subscribe(WS_MESSAGE_CHANNEL)
-        print(f"INFO:     Successfully subscribed to Redis channel: '{WS_MESSAGE_CHANNEL}'")
-
-        # Xabarlarni asinxron o'qish uchun
-        # `pubsub.listen()` bloking, shuning uchun uni to'g'ridan-to'g'ri async funksiyada ishlatish qiyin.
-        # `aioredis` kutubxonasi bu ishni osonlashtiradi, lekin hozirgi `redis` kutubxonasi bilan
-        # `pubsub.get_message(timeout=...)` ni loopda ishlatish yoki `threading` bilan yechish mumkin.
-        # Eng yaxshi yechim `aioredis` ishlatish.
-
-        # Hozirgi `redis` kutubxonasi bilan (bloklanish xavfi bor, test qilish kerak):
-        # while True:
-        #     message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) # timeout bilan
-        #     if message and message['type'] == 'message':
-        #         print(f"DEBUG:    Received message from Redis: {message['data']}")
-        #         try:
-        #             message_data_dict = json.loads(message['data'])
-        #             # Bu yerda message_data_dict ni WebSocketMessage ga validatsiya qilish mumkin
-        #             # schemas.WebSocketMessage.model_validate(message_data_dict)
-        #             await ws_manager.broadcast_to_all_active(message_data_dict)
-        #         except json.JSONDecodeError:
-        #             print(f"ERROR:    Could not decode JSON from Redis message: {message['data']}")
-        #         except Exception as e:
-        #             print(f"ERROR:    Error broadcasting message from Redis via WebSocket: {e}")
-        #     await asyncio.sleep(0.01) # Boshqa tasklarga ham imkon berish
-
-        # `redis` >= 4.2.0rc1 `pubsub.listen()` generator qaytaradi, `async for` bilan ishlatsa bo'ladi.
-        # Ammo hozirgi barqaror versiyalarda (masalan, 5.0.1) `listen()` bloking.
-        # Keling, `get_message` bilan vaqtinchalik yechim qilamiz.
-        # Production uchun `aioredis` yoki `listen()` ni alohida thread da ishlatish yaxshiroq.
-
-        # Yaxshilangan yondashuv (get_message bilan, FastAPI async contextida ishlashi uchun):
-        while True:
-            # print("DEBUG: Checking Redis for messages...") # Har soniyada tekshirish (bu yaxshi emas)
-            message = None
-            try:
-                message = pubsub.get_message(timeout=0.5)  # Non-blocking qilishga harakat
-            except redis.exceptions.TimeoutError:
-                await asyncio.sleep(0.1)  # Agar timeout bo'lsa, biroz kutish
-                continue
-            except redis.exceptions.ConnectionError as e:
-                print(f"ERROR: Redis connection error in listener: {e}. Reconnecting...")
-                await asyncio.sleep(5)  # 5 sekunddan keyin qayta ulanishga harakat qilish
-                try:
-                    # pubsub obyektini qayta yaratish kerak bo'lishi mumkin
-                    pubsub.close()  # Eskisini yopish
-                    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-                    pubsub.subscribe(WS_MESSAGE_CHANNEL)
-                    print("INFO: Reconnected to Redis Pub/Sub.")
-                except Exception as recon_e:
-                    print(f"ERROR: Failed to reconnect to Redis Pub/Sub: {recon_e}")
-                    await asyncio.sleep(10)  # Yana kutish
-                continue
-
-            if message and message['type'] == 'message':
-                data_str = message['data']
-                print(f"DEBUG:    Received message from Redis: {data_str}")
-                try:
-                    # Xabarni WebSocketMessage sxemasiga validatsiya qilish
-                    message_obj = schemas.WebSocketMessage.model_validate_json(data_str)
-                    await ws_manager.broadcast_to_all_active(message_obj.model_dump(mode='json'))
-                except ValidationError as ve:
-                    print(f"ERROR:    WebSocketMessage validation error from Redis: {ve.errors()}")
-                except json.JSONDecodeError:
-                    print(f"ERROR:    Could not decode JSON from Redis message: {data_str}")
-                except Exception as e:
-                    print(f"ERROR:    Error broadcasting message from Redis via WebSocket: {e}")
-
-            await asyncio.sleep(0.1)  # Loopni juda tez aylantirmaslik uchun
-
-    except Exception as e:
-        print(f"FATAL_ERROR: Redis Pub/Sub listener failed: {e}")
-    finally:
-        if 'pubsub' in locals() and pubsub:
-            print("INFO:     Unsubscribing and closing Redis Pub/Sub listener.")
-            pubsub.unsubscribe()
-            pubsub.close()
-
-
 # --- FastAPI Lifespan (Startup va Shutdown hodisalari) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("INFO:     Application startup...")
-    # Ma'lumotlar bazasi jadvallarini yaratish
+    # def endpointlar va run_in_threadpool chaqiruvlari uchun threadlar soni
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_MAX_WORKERS
+    # Jadvallar, boshlang'ich ma'lumotlar va porsiyalar bir martalik `python -m app.cli setup` (deploy) buyrug'ida
+    # yaratiladi. Worker faqat sxema versiyasini tekshiradi - eski sxemada ishlashdan ko'ra ishga tushmagani yaxshi.
     try:
-        models.Base.metadata.create_all(bind=engine)
-        print("INFO:     Database tables checked/created.")
-        # Boshlang'ich ma'lumotlarni yaratish (agar kerak bo'lsa)
-        db_for_startup = SessionLocal()
-        try:
-            admin_user = crud.get_user_by_username(db_for_startup, "admin")
-            if not admin_user:
-                print("INFO:     Admin user not found, running initial data setup...")
-                create_initial_data(db_for_startup)
-            else:
-                print("INFO:     Initial data (admin user) already exists. Skipping setup.")
-
-            possible_meals_count = db_for_startup.query(models.PossibleMeals).count()
-            if possible_meals_count == 0 and db_for_startup.query(models.Meal).count() > 0:
-                print("INFO:     PossibleMeals table is empty, calculating initial possible portions...")
-                crud.update_all_possible_meal_portions(db_for_startup)
-                print("INFO:     Initial possible portions calculated.")
-        finally:
-            db_for_startup.close()
+        schema_revision = await run_in_threadpool(verify_schema_version, engine)
+        print(f"INFO:     Database schema revision {schema_revision} verified.")
     except Exception as e:
-        print(f"ERROR:    Error during initial database setup or data creation: {e}")
+        print(f"ERROR:    Database schema check failed: {e}")
+        raise
 
     # Redis listenerini ishga tushirish
     # Bu asyncio taskini `background_tasks` ga qo'shish mumkin emas, chunki u request scope da ishlaydi.
     # `asyncio.create_task` to'g'ri yechim.
     listener_task = asyncio.create_task(redis_message_listener())
-    print("INFO:     Redis Pub/Sub listener task created.")
+    heartbeat_task = asyncio.create_task(presence.worker_heartbeat_loop())
+    print(f"INFO:     Redis stream listener task created (worker: {presence.WORKER_ID}).")
 
     yield  # Ilova ishlayotgan payt
 
     # Shutdown
     print("INFO:     Application shutdown...")
     if listener_task:
-        print("INFO:     Cancelling Redis Pub/Sub listener task...")
+        print("INFO:     Cancelling Redis stream listener task...")
         listener_task.cancel()
         try:
             await listener_task
         except asyncio.CancelledError:
-            print("INFO:     Redis Pub/Sub listener task cancelled successfully.")
+            print("INFO:     Redis stream listener task cancelled successfully.")
         except Exception as e:
             print(f"ERROR:    Error during Redis listener task cancellation: {e}")
+    heartbeat_task.cancel()
+    await presence.unregister_worker()
+    security.shutdown_password_executor()
+    if async_engine is not None:
+        await async_engine.dispose()
     print("INFO:     Application shutdown complete.")
 
 
@@ -218,13 +125,57 @@ app.include_router(reports.router)
 app.include_router(audit_logs.router)
 
 # --- WebSocket Endpoint ---
+def _ws_client_message(message_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Yo'naltirish maydonlari (topics/user_ids) klientga yuborilmaydi
+    return WebSocketMessage(type=message_type, payload=payload).model_dump(mode='json', exclude={"topics", "user_ids"})
+
+
+async def _handle_ws_command(connection: ClientConnection, data: str):
+    try:
+        command = json.loads(data)
+        action = command.get("action")
+        topics = command.get("topics") or []
+        if action not in ("subscribe", "unsubscribe") or not isinstance(topics, list):
+            raise ValueError("Noma'lum komanda")
+    except (ValueError, AttributeError):
+        await ws_manager.send_to_connection(
+            _ws_client_message("error_message", {"detail": "Komanda formati noto'g'ri."}), connection)
+        return
+
+    allowed_topics = [t for t in topics if isinstance(t, str) and is_client_subscribable_topic(t)]
+    if action == "subscribe":
+        ws_manager.subscribe(connection, allowed_topics)
+    else:
+        ws_manager.unsubscribe(connection, allowed_topics)
+    rejected_topics = [t for t in topics if t not in allowed_topics]
+    ack_payload = {"topics": sorted(connection.topics), "rejected_topics": rejected_topics}
+    await ws_manager.send_to_connection(_ws_client_message("subscriptions_updated", ack_payload), connection)
+
+
+def _authenticate_ws_user(token: str) -> Optional[Tuple[int, Optional[str]]]:
+    """
+    WebSocket tokenini tekshiradi: (user_id, rol_nomi) yoki None.
+    Threadpoolda chaqiriladi; sessiya darhol yopiladi - ulanish davomida DB pool ulanishi band qilinmaydi.
+    """
+    db = SessionLocal()
+    try:
+        user = security.get_user_from_token(db=db, token=token)
+        if not user:
+            return None
+        return user.id, (user.role.name if user.role else None)
+    finally:
+        db.close()
+
+
 @app.websocket(f"{settings.API_V1_STR}/ws")  # Prefix bilan
 async def websocket_endpoint(
         websocket: WebSocket,
-        token: Optional[str] = Query(None, description="Autentifikatsiya uchun JWT tokeni")
+        token: Optional[str] = Query(None, description="Autentifikatsiya uchun JWT tokeni"),
+        since: Optional[str] = Query(None, description="Oxirgi olingan xabarning `stream_id` si: o'tkazib yuborilganlar qayta yuboriladi"),
+        topics: Optional[str] = Query(None, description="Ulanishda obuna bo'linadigan topiclar, vergul bilan: product:5,product:7")
 ):
-    current_user_ws: Optional[models.User] = None
-    db_ws: Optional[Session] = None
+    ws_user_id: Optional[int] = None
+    connection: Optional[ClientConnection] = None
 
     if not token:
         print("WARN:     WebSocket connection attempt without token.")
@@ -232,43 +183,53 @@ async def websocket_endpoint(
         return
 
     try:
-        db_ws = SessionLocal()
-        # Tokenni tekshirish (security.py dagi get_user_from_token dan foydalanish)
-        current_user_ws = security.get_user_from_token(db=db_ws, token=token)
+        # Tokenni tekshirish (security.py dagi get_user_from_token dan foydalanish, threadpoolda)
+        auth_result = await run_in_threadpool(_authenticate_ws_user, token)
 
-        if not current_user_ws:  # Token yaroqsiz yoki foydalanuvchi topilmadi/aktiv emas
+        if not auth_result:  # Token yaroqsiz yoki foydalanuvchi topilmadi/aktiv emas
             print(f"WARN:     WebSocket authentication failed for token: {token[:20]}...")
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Autentifikatsiya xatoligi")
             return
 
         # Muvaffaqiyatli autentifikatsiyadan so'ng ulanish
-        await ws_manager.connect(websocket, current_user_ws.id)
+        ws_user_id, role_name = auth_result
+        # Qayta ulanishda jonli xabarlar replaydan keyin yuboriladi (aks holda klient eski xabarlarni tashlab yuboradi)
+        connection = await ws_manager.connect(websocket, ws_user_id, role_name, hold_live=bool(since))
+        if topics:
+            ws_manager.subscribe(connection, [t for t in topics.split(",") if is_client_subscribable_topic(t)])
 
         # Klientga ulanish muvaffaqiyatli ekanligi haqida xabar (ixtiyoriy)
-        ack_payload = {"user_id": current_user_ws.id, "message": "WebSocket ulanishi muvaffaqiyatli o'rnatildi."}
-        ack_message = WebSocketMessage(type="connection_ack", payload=ack_payload)
-        await ws_manager.send_personal_message(ack_message.model_dump(mode='json'), current_user_ws.id)
+        ack_payload = {"user_id": ws_user_id, "message": "WebSocket ulanishi muvaffaqiyatli o'rnatildi."}
+        await ws_manager.send_to_connection(_ws_client_message("connection_ack", ack_payload), connection)
+        if since:
+            # Qayta ulanish: uzilish paytida o'tkazib yuborilgan xabarlar (Redis Streamdan)
+            replayed_until = None
+            try:
+                replayed_until = await replay_missed_events(connection, since)
+            finally:
+                await ws_manager.release_held(connection, replayed_until)
 
         while True:  # Klientdan keladigan xabarlarni tinglash
             try:
                 data = await websocket.receive_text()
-                print(f"DEBUG:    WebSocket received from user {current_user_ws.id}: {data}")
+                print(f"DEBUG:    WebSocket received from user {ws_user_id}: {data}")
                 # Bu yerda klientdan kelgan maxsus komandalarni qayta ishlash mumkin
                 if data.lower() == "ping":
-                    pong_payload = {"response_to": "ping", "server_time": datetime.now(settings.TIMEZONE).isoformat()}
-                    pong_message = WebSocketMessage(type="pong", payload=pong_payload)
-                    await ws_manager.send_personal_message(pong_message.model_dump(mode='json'), current_user_ws.id)
+                    pong_payload = {"response_to": "ping", "server_time": datetime.now(ZoneInfo(settings.TIMEZONE)).isoformat()}
+                    await ws_manager.send_to_connection(_ws_client_message("pong", pong_payload), connection)
+                elif data.startswith("{"):
+                    # Obuna komandalari: {"action": "subscribe" | "unsubscribe", "topics": ["product:5", ...]}
+                    await _handle_ws_command(connection, data)
                 # Boshqa komandalar...
             except WebSocketDisconnect:
-                print(f"INFO:     WebSocket disconnected for user {current_user_ws.id} (client closed).")
+                print(f"INFO:     WebSocket disconnected for user {ws_user_id} (client closed).")
                 break
             except Exception as e_inner:
-                print(f"ERROR:    Error processing WebSocket message from user {current_user_ws.id}: {e_inner}")
+                print(f"ERROR:    Error processing WebSocket message from user {ws_user_id}: {e_inner}")
                 # Xatolik haqida klientga xabar yuborish (agar ulanish hali ham aktiv bo'lsa)
                 try:
                     error_payload = {"detail": "Xabaringizni qayta ishlashda xatolik yuz berdi."}
-                    error_message_ws = WebSocketMessage(type="error_message", payload=error_payload)
-                    await ws_manager.send_personal_message(error_message_ws.model_dump(mode='json'), current_user_ws.id)
+                    await ws_manager.send_to_connection(_ws_client_message("error_message", error_payload), connection)
                 except:
                     pass
                 break  # Ichki xatolikdan keyin loopdan chiqish
@@ -282,16 +243,20 @@ async def websocket_endpoint(
         except:
             pass
     finally:
-        if current_user_ws and current_user_ws.id in ws_manager.active_connections:
-            ws_manager.disconnect(current_user_ws.id)
-        if db_ws:
-            db_ws.close()
-        print(
-            f"INFO:     WebSocket connection cleanup for user {current_user_ws.id if current_user_ws else 'unknown'}.")
+        if connection:
+            ws_manager.disconnect(connection)  # Foydalanuvchining boshqa ulanishlariga tegmaydi
+        print(f"INFO:     WebSocket connection cleanup for user {ws_user_id if ws_user_id else 'unknown'}.")
+
+
+@app.get(f"{settings.API_V1_STR}/ws/metrics", tags=["WebSocket"], response_model=Dict[str, Any])
+async def read_websocket_metrics(current_user: models.User = Depends(security.get_current_admin_user)):
+    """Aktiv WebSocket ulanishlari: navbat chuqurligi, yuborilgan/tashlangan xabarlar va kechikish (lag)."""
+    # Ko'p workerli rejimda har bir worker faqat o'z ulanishlarini ko'rsatadi
+    return {"worker_id": presence.WORKER_ID, **ws_manager.get_metrics()}
 
 
 # --- Frontend uchun Asosiy Sahifalar (HTMLResponse) ---
-async def get_user_from_cookie_for_template(request: Request, db: Session = Depends(get_db)) -> Optional[models.User]:
+def get_user_from_cookie_for_template(request: Request, db: Session = Depends(get_db)) -> Optional[models.User]:
     token_cookie = request.cookies.get("access_token")
     if not token_cookie or not token_cookie.startswith("Bearer "):
         return None
@@ -413,21 +378,16 @@ async def reports_main_page_render(request: Request,
     response_model=schemas.Msg,
     include_in_schema=settings.APP_ENV == "development"
 )
-async def test_websocket_broadcast_via_redis(message_payload: Dict[str, Any]):
+def test_websocket_broadcast_via_redis(message_payload: Dict[str, Any]):
     """
-    (Faqat Admin uchun) WebSocket orqali test xabarini Redis Pub/Sub kanaliga yuborish.
+    (Faqat Admin uchun) WebSocket orqali test xabarini Redis Streamga yuborish.
     Redis listener bu xabarni olib, barcha ulangan klientlarga tarqatadi.
     `message_payload` `WebSocketMessage.payload` uchun ma'lumot bo'lishi kerak.
     """
-    try:
-        test_ws_message = WebSocketMessage(type="test_broadcast", payload=message_payload)
-        # Bu yerda message_payloadni WebSocketMessagePayload sxemalaridan biriga moslashtirish kerak bo'lishi mumkin.
-        # Hozircha, Dict[str, Any] qilib qoldiramiz.
-        redis_client.publish(WS_MESSAGE_CHANNEL, test_ws_message.model_dump_json())
-        return {"msg": "Test xabari Redis kanaliga muvaffaqiyatli yuborildi."}
-    except Exception as e:
+    if not publish_ws_message("test_broadcast", message_payload):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f"Redisga xabar yuborishda xatolik: {str(e)}")
+                            detail="Redisga xabar yuborishda xatolik yuz berdi.")
+    return {"msg": "Test xabari Redis Streamga muvaffaqiyatli yuborildi."}
 
 # if __name__ == "__main__":
 #     import uvicorn
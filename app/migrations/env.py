@@ -0,0 +1,62 @@
+# app/migrations/env.py
+# Alembic muhiti: `python -m app.cli migrate` yoki `alembic ...` buyruqlari shu fayl orqali bazaga ulanadi.
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models
+from app.config import settings
+from app.database import create_db_engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def _include_object(obj, name, type_, reflected, compare_to):
+    # Alembicning o'z jadvali va modellarda yo'q (qo'lda yaratilgan) jadvallar autogenerate da e'tiborga olinmaydi
+    return not (type_ == "table" and reflected and compare_to is None)
+
+
+def _configure(**kwargs):
+    context.configure(
+        target_metadata=target_metadata,
+        include_object=_include_object,
+        render_as_batch=True,  # SQLite ALTER TABLE cheklovlari uchun (jadval nusxalash orqali)
+        compare_type=True,
+        **kwargs
+    )
+
+
+def run_migrations_offline() -> None:
+    """SQL skript chiqarish (`alembic upgrade head --sql`), bazaga ulanmasdan."""
+    _configure(url=config.get_main_option("sqlalchemy.url") or settings.DATABASE_URL, literal_binds=True,
+               dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")  # app.cli tayyor ulanish berishi mumkin
+    if connection is not None:
+        _configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    migration_engine = create_db_engine(config.get_main_option("sqlalchemy.url") or settings.DATABASE_URL)
+    try:
+        with migration_engine.connect() as connection:
+            _configure(connection=connection)
+            with context.begin_transaction():
+                context.run_migrations()
+    finally:
+        migration_engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
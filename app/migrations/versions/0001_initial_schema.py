@@ -0,0 +1,363 @@
+"""initial schema
+
+Migratsiyalar kiritilishidan oldin `create_all` yaratgan boshlang'ich sxema. Migratsiya tarixi yo'q eski
+bazalar `python -m app.cli migrate` tomonidan mos revisionga "stamp" qilinadi.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 02:07:51.289101
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('notification_types',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    with op.batch_alter_table('notification_types', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_types_id'), ['id'], unique=False)
+
+    op.create_table('roles',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('roles', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_roles_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_roles_name'), ['name'], unique=True)
+
+    op.create_table('units',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('short_name', sa.String(length=10), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name'),
+    sa.UniqueConstraint('short_name')
+    )
+    with op.batch_alter_table('units', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_units_id'), ['id'], unique=False)
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('password_hash', sa.String(length=255), nullable=False),
+    sa.Column('full_name', sa.String(length=100), nullable=False),
+    sa.Column('role_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_login', sa.DateTime(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['role_id'], ['roles.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_users_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_users_username'), ['username'], unique=True)
+
+    op.create_table('audit_logs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('username', sa.String(), nullable=True),
+    sa.Column('action', sa.String(length=100), nullable=False),
+    sa.Column('target_entity_type', sa.String(length=50), nullable=True),
+    sa.Column('target_entity_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.Column('changes_before', sa.JSON(), nullable=True),
+    sa.Column('changes_after', sa.JSON(), nullable=True),
+    sa.Column('ip_address', sa.String(length=50), nullable=True),
+    sa.Column('user_agent', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_logs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_logs_action'), ['action'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_logs_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_logs_target_entity_id'), ['target_entity_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_logs_timestamp'), ['timestamp'], unique=False)
+
+    op.create_table('meals',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=150), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meals', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meals_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_meals_name'), ['name'], unique=True)
+
+    op.create_table('monthly_reports',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('report_month', sa.Date(), nullable=False),
+    sa.Column('generated_at', sa.DateTime(), nullable=True),
+    sa.Column('generated_by', sa.Integer(), nullable=True),
+    sa.Column('total_portions_served_overall', sa.Integer(), nullable=True),
+    sa.Column('is_overall_suspicious', sa.Boolean(), nullable=True),
+    sa.Column('difference_percentage', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['generated_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('report_month')
+    )
+    with op.batch_alter_table('monthly_reports', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_monthly_reports_id'), ['id'], unique=False)
+
+    op.create_table('notifications',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('notification_type_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('is_read', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['notification_type_id'], ['notification_types.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notifications_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_notifications_id'), ['id'], unique=False)
+
+    op.create_table('products',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('unit_id', sa.Integer(), nullable=False),
+    sa.Column('min_quantity', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['unit_id'], ['units.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_products_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_products_name'), ['name'], unique=False)
+
+    op.create_table('meal_ingredients',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity_per_portion', sa.Float(), nullable=False),
+    sa.Column('unit_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['unit_id'], ['units.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meal_ingredients', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meal_ingredients_id'), ['id'], unique=False)
+
+    op.create_table('meal_servings',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('portions_served', sa.Integer(), nullable=False),
+    sa.Column('served_at', sa.DateTime(), nullable=False),
+    sa.Column('served_by', sa.Integer(), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.ForeignKeyConstraint(['served_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meal_servings', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meal_servings_id'), ['id'], unique=False)
+
+    op.create_table('possible_meals',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('possible_portions', sa.Integer(), nullable=False),
+    sa.Column('limiting_product_id', sa.Integer(), nullable=True),
+    sa.Column('calculated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['limiting_product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('meal_id')
+    )
+    with op.batch_alter_table('possible_meals', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_possible_meals_id'), ['id'], unique=False)
+
+    op.create_table('product_deliveries',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Float(), nullable=False),
+    sa.Column('delivery_date', sa.DateTime(), nullable=False),
+    sa.Column('supplier', sa.String(length=100), nullable=True),
+    sa.Column('price', sa.Float(), nullable=True),
+    sa.Column('received_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['received_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('product_deliveries', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_deliveries_id'), ['id'], unique=False)
+
+    op.create_table('product_monthly_balances',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('report_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('initial_stock', sa.Float(), nullable=True),
+    sa.Column('total_received', sa.Float(), nullable=True),
+    sa.Column('total_available', sa.Float(), nullable=True),
+    sa.Column('calculated_consumption', sa.Float(), nullable=True),
+    sa.Column('actual_consumption', sa.Float(), nullable=True),
+    sa.Column('theoretical_ending_stock', sa.Float(), nullable=True),
+    sa.Column('actual_ending_stock', sa.Float(), nullable=True),
+    sa.Column('discrepancy', sa.Float(), nullable=True),
+    sa.Column('is_balance_suspicious', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['report_id'], ['monthly_reports.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('product_monthly_balances', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_monthly_balances_id'), ['id'], unique=False)
+
+    op.create_table('report_ingredient_details',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('report_id', sa.Integer(), nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('total_quantity_used', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['report_id'], ['monthly_reports.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('report_ingredient_details', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_report_ingredient_details_id'), ['id'], unique=False)
+
+    op.create_table('report_meal_performance',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('report_id', sa.Integer(), nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('portions_served_this_meal', sa.Integer(), nullable=False),
+    sa.Column('possible_portions_at_report_time', sa.Integer(), nullable=False),
+    sa.Column('difference_percentage', sa.Float(), nullable=True),
+    sa.Column('is_suspicious', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.ForeignKeyConstraint(['report_id'], ['monthly_reports.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('report_meal_performance', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_report_meal_performance_id'), ['id'], unique=False)
+
+    op.create_table('serving_details',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('serving_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity_used', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['serving_id'], ['meal_servings.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('serving_details', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_serving_details_id'), ['id'], unique=False)
+
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('serving_details', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_serving_details_id'))
+
+    op.drop_table('serving_details')
+    with op.batch_alter_table('report_meal_performance', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_report_meal_performance_id'))
+
+    op.drop_table('report_meal_performance')
+    with op.batch_alter_table('report_ingredient_details', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_report_ingredient_details_id'))
+
+    op.drop_table('report_ingredient_details')
+    with op.batch_alter_table('product_monthly_balances', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_monthly_balances_id'))
+
+    op.drop_table('product_monthly_balances')
+    with op.batch_alter_table('product_deliveries', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_deliveries_id'))
+
+    op.drop_table('product_deliveries')
+    with op.batch_alter_table('possible_meals', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_possible_meals_id'))
+
+    op.drop_table('possible_meals')
+    with op.batch_alter_table('meal_servings', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_meal_servings_id'))
+
+    op.drop_table('meal_servings')
+    with op.batch_alter_table('meal_ingredients', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_meal_ingredients_id'))
+
+    op.drop_table('meal_ingredients')
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_products_name'))
+        batch_op.drop_index(batch_op.f('ix_products_id'))
+
+    op.drop_table('products')
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notifications_id'))
+        batch_op.drop_index(batch_op.f('ix_notifications_created_at'))
+
+    op.drop_table('notifications')
+    with op.batch_alter_table('monthly_reports', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_monthly_reports_id'))
+
+    op.drop_table('monthly_reports')
+    with op.batch_alter_table('meals', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_meals_name'))
+        batch_op.drop_index(batch_op.f('ix_meals_id'))
+
+    op.drop_table('meals')
+    with op.batch_alter_table('audit_logs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_audit_logs_timestamp'))
+        batch_op.drop_index(batch_op.f('ix_audit_logs_target_entity_id'))
+        batch_op.drop_index(batch_op.f('ix_audit_logs_id'))
+        batch_op.drop_index(batch_op.f('ix_audit_logs_action'))
+
+    op.drop_table('audit_logs')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_username'))
+        batch_op.drop_index(batch_op.f('ix_users_id'))
+
+    op.drop_table('users')
+    with op.batch_alter_table('units', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_units_id'))
+
+    op.drop_table('units')
+    with op.batch_alter_table('roles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_roles_name'))
+        batch_op.drop_index(batch_op.f('ix_roles_id'))
+
+    op.drop_table('roles')
+    with op.batch_alter_table('notification_types', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notification_types_id'))
+
+    op.drop_table('notification_types')
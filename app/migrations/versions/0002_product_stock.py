@@ -0,0 +1,47 @@
+"""product_stock summary table
+
+Mahsulotning joriy qoldig'i (kirim va sarf bilan bir tranzaksiyada yangilanadi). Mavjud mahsulotlar uchun
+balanslar kirim/sarf jurnallaridan (product_deliveries - serving_details) to'ldiriladi, shuning uchun faqat
+`migrate` ham to'g'ri qoldiqlarni beradi; `python -m app.cli stock-rebuild` ularni keyin ham tekshirib tuzatadi.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 02:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_stock',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+
+    op.execute(
+        "INSERT INTO product_stock (product_id, quantity, updated_at) "
+        "SELECT p.id, "
+        "COALESCE((SELECT SUM(d.quantity) FROM product_deliveries d WHERE d.product_id = p.id), 0) - "
+        "COALESCE((SELECT SUM(sd.quantity_used) FROM serving_details sd WHERE sd.product_id = p.id), 0), "
+        "CURRENT_TIMESTAMP "
+        "FROM products p"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('product_stock')
@@ -0,0 +1,55 @@
+"""composite indexes for report and ledger hot paths
+
+Vaqt oralig'i va FK bo'yicha guruhlanadigan so'rovlar (oylik hisobot, grafiklar, qoldiq jurnali,
+bildirishnomalar) uchun kompozit (covering) indekslar. Migratsiyalardan oldingi versiya bu indekslarni
+ishga tushishda yaratgan bo'lishi mumkin - mavjudlari qayta yaratilmaydi.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 02:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (jadval, indeks nomi, ustunlar)
+INDEXES = [
+    ('meal_servings', 'ix_meal_servings_served_at_meal_id', ['served_at', 'meal_id']),
+    ('serving_details', 'ix_serving_details_serving_id_product_id', ['serving_id', 'product_id', 'quantity_used']),
+    ('serving_details', 'ix_serving_details_product_id', ['product_id', 'serving_id', 'quantity_used']),
+    ('product_deliveries', 'ix_product_deliveries_product_id_delivery_date', ['product_id', 'delivery_date', 'quantity']),
+    ('product_deliveries', 'ix_product_deliveries_delivery_date_product_id', ['delivery_date', 'product_id', 'quantity']),
+    ('notifications', 'ix_notifications_user_id_is_read_created_at', ['user_id', 'is_read', 'created_at']),
+    ('meal_ingredients', 'ix_meal_ingredients_meal_id', ['meal_id']),
+    ('meal_ingredients', 'ix_meal_ingredients_product_id', ['product_id']),
+    ('report_meal_performance', 'ix_report_meal_performance_report_id', ['report_id']),
+    ('report_ingredient_details', 'ix_report_ingredient_details_report_id', ['report_id']),
+    ('product_monthly_balances', 'ix_product_monthly_balances_report_id_product_id', ['report_id', 'product_id']),
+]
+
+
+def _existing_indexes(table_name: str) -> set:
+    return {ix['name'] for ix in sa.inspect(op.get_bind()).get_indexes(table_name)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name, index_name, columns in INDEXES:
+        if index_name not in _existing_indexes(table_name):
+            op.create_index(index_name, table_name, columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, index_name, _ in reversed(INDEXES):
+        if index_name in _existing_indexes(table_name):
+            op.drop_index(index_name, table_name=table_name)
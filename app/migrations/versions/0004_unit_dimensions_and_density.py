@@ -0,0 +1,66 @@
+"""unit dimensions, base factors and product density
+
+Birliklar konvertatsiyasi ma'lumotlarga asoslanadi: units.dimension ("mass", "volume", "count") va
+units.base_factor (gramm, millilitr yoki dona da), products.density (g/ml, hajm <-> og'irlik uchun).
+Mavjud birliklar nomi bo'yicha to'ldiriladi (avvalgi kodda qattiq yozilgan gramm/kg va ml/litr aliaslari,
+shuningdek qoshiq = 15 ml, stakan = 250 ml); noma'lum birliklar bo'sh qoladi va faqat o'zi bilan mos keladi.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 03:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (o'lcham, koeffitsiyent, nom/qisqa nom aliaslari) - migratsiya app kodiga bog'liq bo'lmasligi uchun shu yerda
+KNOWN_UNITS = [
+    ('mass', 1.0, ['gr', 'gramm', 'g', 'грамм', 'гр']),
+    ('mass', 1000.0, ['kg', 'kilogramm', 'килограмм', 'кг']),
+    ('volume', 1.0, ['ml', 'millilitr', 'мл', 'миллилитр']),
+    ('volume', 1000.0, ['l', 'litr', 'литр', 'л']),
+    ('volume', 15.0, ['qoshiq', 'osh qoshiq']),
+    ('volume', 250.0, ['stakan']),
+    ('count', 1.0, ['dona', 'шт']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('units', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dimension', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('base_factor', sa.Float(), nullable=True))
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('density', sa.Float(), nullable=True))
+
+    units = sa.table('units', sa.column('id', sa.Integer), sa.column('name', sa.String),
+                     sa.column('short_name', sa.String), sa.column('dimension', sa.String),
+                     sa.column('base_factor', sa.Float))
+    connection = op.get_bind()
+    for unit_id, name, short_name in connection.execute(sa.select(units.c.id, units.c.name, units.c.short_name)):
+        keys = {(short_name or '').lower().strip(), (name or '').lower().strip()}
+        for dimension, base_factor, aliases in KNOWN_UNITS:
+            if keys & set(aliases):
+                connection.execute(units.update().where(units.c.id == unit_id)
+                                   .values(dimension=dimension, base_factor=base_factor))
+                break
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('density')
+
+    with op.batch_alter_table('units', schema=None) as batch_op:
+        batch_op.drop_column('base_factor')
+        batch_op.drop_column('dimension')
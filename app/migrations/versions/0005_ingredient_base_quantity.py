@@ -0,0 +1,72 @@
+"""meal_ingredients.quantity_per_portion_base
+
+1 porsiya uchun miqdor mahsulotning asosiy birligida - retsept saqlanganda hisoblanadi, shuning uchun ovqat berish,
+porsiya va hisobot hisoblari birlik konvertatsiyasisiz (oddiy ko'paytirish). Mavjud retseptlar units.dimension /
+base_factor va products.density (0004) bo'yicha to'ldiriladi; konvertatsiya qilib bo'lmaydiganlari NULL qoladi.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 03:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _convert(quantity, from_unit, to_unit, density):
+    """app/unit_conversion.py dagi qoidalar (migratsiya app kodiga bog'liq bo'lmasligi uchun nusxa)."""
+    (from_dimension, from_factor), (to_dimension, to_factor) = from_unit, to_unit
+    if not (from_factor and to_factor):
+        return None
+    if from_dimension == to_dimension and from_dimension is not None:
+        return quantity * from_factor / to_factor
+    if not density or density <= 0:
+        return None
+    if from_dimension == 'volume' and to_dimension == 'mass':
+        return quantity * from_factor * density / to_factor
+    if from_dimension == 'mass' and to_dimension == 'volume':
+        return quantity * from_factor / density / to_factor
+    return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('meal_ingredients', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('quantity_per_portion_base', sa.Float(), nullable=True))
+
+    connection = op.get_bind()
+    units = {row.id: (row.dimension, row.base_factor)
+             for row in connection.execute(sa.text("SELECT id, dimension, base_factor FROM units"))}
+    products = {row.id: (row.unit_id, row.density)
+                for row in connection.execute(sa.text("SELECT id, unit_id, density FROM products"))}
+    meal_ingredients = sa.table('meal_ingredients', sa.column('id', sa.Integer),
+                                sa.column('quantity_per_portion_base', sa.Float))
+    rows = connection.execute(sa.text("SELECT id, product_id, quantity_per_portion, unit_id FROM meal_ingredients"))
+    for ingredient_id, product_id, quantity, unit_id in rows.fetchall():
+        if product_id not in products:
+            continue
+        product_unit_id, density = products[product_id]
+        if unit_id == product_unit_id:
+            base_quantity = quantity
+        elif unit_id in units and product_unit_id in units:
+            base_quantity = _convert(quantity, units[unit_id], units[product_unit_id], density)
+        else:
+            base_quantity = None
+        if base_quantity is not None:
+            connection.execute(meal_ingredients.update().where(meal_ingredients.c.id == ingredient_id)
+                               .values(quantity_per_portion_base=base_quantity))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('meal_ingredients', schema=None) as batch_op:
+        batch_op.drop_column('quantity_per_portion_base')
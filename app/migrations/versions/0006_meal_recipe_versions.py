@@ -0,0 +1,117 @@
+"""meal recipe versions
+
+Retseptlarning o'zgarmas versiyalari (meal_recipe_versions) va ularning talab vektori
+(meal_recipe_version_items: mahsulot bo'yicha 1 porsiya miqdori asosiy birlikda). meal_servings.recipe_version_id -
+ovqat berilgan paytdagi versiya, meals.current_recipe_version_id - amaldagi versiya, monthly_reports.is_final -
+yopilgan oy hisoboti (qayta hisoblanmaydi).
+Har bir mavjud ovqat uchun joriy retseptdan 1-versiya yaratiladi va mavjud ovqat berishlar shunga bog'lanadi
+(eski tarixiy retseptlar saqlanmagan - mavjud eng yaxshi ma'lumot). Mavjud hisobotlar final emas deb belgilanadi.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 04:20:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('meal_recipe_versions',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('meal_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['meal_id'], ['meals.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meal_recipe_versions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meal_recipe_versions_id'), ['id'], unique=False)
+        batch_op.create_index('ix_meal_recipe_versions_meal_id_version', ['meal_id', 'version'], unique=True)
+
+    op.create_table('meal_recipe_version_items',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('recipe_version_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('quantity_per_portion_base', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['recipe_version_id'], ['meal_recipe_versions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('meal_recipe_version_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_meal_recipe_version_items_id'), ['id'], unique=False)
+        batch_op.create_index('ix_meal_recipe_version_items_version_product',
+                              ['recipe_version_id', 'product_id', 'quantity_per_portion_base'], unique=False)
+
+    with op.batch_alter_table('meal_servings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recipe_version_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_meal_servings_recipe_version_id', 'meal_recipe_versions',
+                                    ['recipe_version_id'], ['id'])
+
+    with op.batch_alter_table('meals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('current_recipe_version_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_meals_current_recipe_version_id', 'meal_recipe_versions',
+                                    ['current_recipe_version_id'], ['id'], use_alter=True)
+
+    with op.batch_alter_table('monthly_reports', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_final', sa.Boolean(), server_default='0', nullable=False))
+
+    # Mavjud ovqatlar uchun 1-versiya (joriy retseptdan) va mavjud ovqat berishlarni unga bog'lash
+    connection = op.get_bind()
+    now = datetime.now()
+    connection.execute(sa.text(
+        "INSERT INTO meal_recipe_versions (meal_id, version, created_at) SELECT id, 1, :now FROM meals"
+    ), {"now": now})
+    connection.execute(sa.text(
+        "INSERT INTO meal_recipe_version_items (recipe_version_id, product_id, quantity_per_portion_base) "
+        "SELECT v.id, mi.product_id, SUM(mi.quantity_per_portion_base) "
+        "FROM meal_ingredients mi JOIN meal_recipe_versions v ON v.meal_id = mi.meal_id "
+        "WHERE mi.quantity_per_portion_base IS NOT NULL AND mi.quantity_per_portion_base > 0 "
+        "GROUP BY v.id, mi.product_id"
+    ))
+    connection.execute(sa.text(
+        "UPDATE meals SET current_recipe_version_id = "
+        "(SELECT v.id FROM meal_recipe_versions v WHERE v.meal_id = meals.id)"
+    ))
+    connection.execute(sa.text(
+        "UPDATE meal_servings SET recipe_version_id = "
+        "(SELECT v.id FROM meal_recipe_versions v WHERE v.meal_id = meal_servings.meal_id)"
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('monthly_reports', schema=None) as batch_op:
+        batch_op.drop_column('is_final')
+
+    with op.batch_alter_table('meals', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_meals_current_recipe_version_id', type_='foreignkey')
+        batch_op.drop_column('current_recipe_version_id')
+
+    with op.batch_alter_table('meal_servings', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_meal_servings_recipe_version_id', type_='foreignkey')
+        batch_op.drop_column('recipe_version_id')
+
+    with op.batch_alter_table('meal_recipe_version_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_meal_recipe_version_items_version_product')
+        batch_op.drop_index(batch_op.f('ix_meal_recipe_version_items_id'))
+
+    op.drop_table('meal_recipe_version_items')
+    with op.batch_alter_table('meal_recipe_versions', schema=None) as batch_op:
+        batch_op.drop_index('ix_meal_recipe_versions_meal_id_version')
+        batch_op.drop_index(batch_op.f('ix_meal_recipe_versions_id'))
+
+    op.drop_table('meal_recipe_versions')
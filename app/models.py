@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Date
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Date, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -53,6 +53,8 @@ class Unit(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(50), unique=True, nullable=False)
     short_name = Column(String(10), unique=True, nullable=False)
+    dimension = Column(String(20), nullable=True) # "mass", "volume", "count" (app/unit_conversion.py)
+    base_factor = Column(Float, nullable=True) # O'lcham asosiy birligida: gramm, millilitr yoki dona (kg = 1000)
     created_at = Column(DateTime, default=datetime.now)
 
     products = relationship("Product", back_populates="unit")
@@ -69,6 +71,7 @@ class Product(Base):
     name = Column(String(100), nullable=False, index=True)
     unit_id = Column(Integer, ForeignKey("units.id"), nullable=False)
     min_quantity = Column(Float, nullable=False) # Minimal miqdor (ogohlantirish uchun)
+    density = Column(Float, nullable=True) # Zichlik, g/ml (hajm <-> og'irlik konvertatsiyasi uchun, masalan qoshiq -> kg)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     created_by = Column(Integer, ForeignKey("users.id"), nullable=True) # Kim yaratgani
@@ -85,6 +88,7 @@ class Product(Base):
                                             back_populates="product_for_ingredient_detail")  # Type hint olib tashlandi
     monthly_balances_of_product = relationship("ProductMonthlyBalance", back_populates="product_in_balance",
                                                cascade="all, delete-orphan")
+    stock = relationship("ProductStock", back_populates="product", uselist=False, cascade="all, delete-orphan")
 
 
 def __repr__(self):
@@ -94,6 +98,11 @@ def __repr__(self):
 # --- ProductDelivery ---
 class ProductDelivery(Base):
     __tablename__ = "product_deliveries"
+    __table_args__ = (
+        # Mahsulot bo'yicha qoldiq/jurnal va sana oralig'idagi kirim yig'indilari (quantity - covering)
+        Index("ix_product_deliveries_product_id_delivery_date", "product_id", "delivery_date", "quantity"),
+        Index("ix_product_deliveries_delivery_date_product_id", "delivery_date", "product_id", "quantity"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -110,6 +119,19 @@ class ProductDelivery(Base):
     def __repr__(self):
         return f"<ProductDelivery(id={self.id}, product_id={self.product_id}, quantity={self.quantity})>"
 
+# --- ProductStock ---
+class ProductStock(Base): # Mahsulotning ombordagi joriy qoldig'i (kirim va sarf bilan bir tranzaksiyada yangilanadi)
+    __tablename__ = "product_stock"
+
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Float, nullable=False, default=0.0) # Mahsulotning asosiy birligida
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    product = relationship("Product", back_populates="stock")
+
+    def __repr__(self):
+        return f"<ProductStock(product_id={self.product_id}, quantity={self.quantity})>"
+
 # --- Meal ---
 class Meal(Base):
     __tablename__ = "meals"
@@ -122,9 +144,17 @@ class Meal(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     is_active = Column(Boolean, default=True) # Ovqat menyuda faolmi?
     deleted_at = Column(DateTime, nullable=True) # Soft delete
+    # Amaldagi retsept versiyasi (yangi ovqat berishlar shunga bog'lanadi). meals <-> meal_recipe_versions sikli
+    # uchun use_alter.
+    current_recipe_version_id = Column(Integer, ForeignKey("meal_recipe_versions.id", use_alter=True,
+                                                           name="fk_meals_current_recipe_version_id"), nullable=True)
 
     created_by_user = relationship("User", back_populates="created_meals")
     ingredients = relationship("MealIngredient", back_populates="meal", cascade="all, delete-orphan")
+    recipe_versions = relationship("MealRecipeVersion", back_populates="meal", cascade="all, delete-orphan",
+                                   foreign_keys="MealRecipeVersion.meal_id")
+    current_recipe_version = relationship("MealRecipeVersion", foreign_keys=[current_recipe_version_id],
+                                          post_update=True)
     servings = relationship("MealServing", back_populates="meal", cascade="all, delete-orphan")
     possible_meals_entry = relationship("PossibleMeals", back_populates="meal", uselist=False,
                                         cascade="all, delete-orphan")
@@ -141,12 +171,18 @@ class Meal(Base):
 # --- MealIngredient ---
 class MealIngredient(Base):
     __tablename__ = "meal_ingredients"
+    __table_args__ = (
+        Index("ix_meal_ingredients_meal_id", "meal_id"),
+        Index("ix_meal_ingredients_product_id", "product_id"),  # Mahsulot o'zgarsa, qaysi ovqatlar qayta hisoblanadi
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     meal_id = Column(Integer, ForeignKey("meals.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity_per_portion = Column(Float, nullable=False) # 1 porsiya uchun kerakli miqdor
     unit_id = Column(Integer, ForeignKey("units.id"), nullable=False) # Shu ingredient qaysi birlikda o'lchanadi
+    # 1 porsiya uchun miqdor mahsulotning asosiy birligida (yozishda hisoblanadi; None - konvertatsiya qilib bo'lmaydi)
+    quantity_per_portion_base = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -157,9 +193,50 @@ class MealIngredient(Base):
     def __repr__(self):
         return f"<MealIngredient(meal_id={self.meal_id}, product_id={self.product_id})>"
 
+# --- MealRecipeVersion ---
+class MealRecipeVersion(Base): # Retseptning o'zgarmas (immutable) nusxasi - tarixiy hisobotlar shu bo'yicha
+    __tablename__ = "meal_recipe_versions"
+    __table_args__ = (
+        Index("ix_meal_recipe_versions_meal_id_version", "meal_id", "version", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    meal_id = Column(Integer, ForeignKey("meals.id"), nullable=False)
+    version = Column(Integer, nullable=False) # Ovqat ichida 1, 2, 3, ...
+    created_at = Column(DateTime, default=datetime.now)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    meal = relationship("Meal", back_populates="recipe_versions", foreign_keys=[meal_id])
+    items = relationship("MealRecipeVersionItem", back_populates="recipe_version", cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f"<MealRecipeVersion(meal_id={self.meal_id}, version={self.version})>"
+
+class MealRecipeVersionItem(Base): # Versiyaning talab vektori: 1 porsiya uchun mahsulot miqdori asosiy birlikda
+    __tablename__ = "meal_recipe_version_items"
+    __table_args__ = (
+        # Hisobot: versiya bo'yicha berilgan porsiyalar x talab (covering)
+        Index("ix_meal_recipe_version_items_version_product", "recipe_version_id", "product_id",
+              "quantity_per_portion_base"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    recipe_version_id = Column(Integer, ForeignKey("meal_recipe_versions.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity_per_portion_base = Column(Float, nullable=False)
+
+    recipe_version = relationship("MealRecipeVersion", back_populates="items")
+
+    def __repr__(self):
+        return f"<MealRecipeVersionItem(recipe_version_id={self.recipe_version_id}, product_id={self.product_id})>"
+
 # --- MealServing ---
 class MealServing(Base):
     __tablename__ = "meal_servings"
+    __table_args__ = (
+        # Oylik hisobot va grafiklar: served_at oralig'i + meal_id bo'yicha guruhlash
+        Index("ix_meal_servings_served_at_meal_id", "served_at", "meal_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     meal_id = Column(Integer, ForeignKey("meals.id"), nullable=False)
@@ -167,6 +244,8 @@ class MealServing(Base):
     served_at = Column(DateTime, default=datetime.now, nullable=False)
     served_by = Column(Integer, ForeignKey("users.id"), nullable=True) # Kim bergani
     notes = Column(Text, nullable=True) # Qo'shimcha izohlar
+    recipe_version_id = Column(Integer, ForeignKey("meal_recipe_versions.id", name="fk_meal_servings_recipe_version_id"),
+                               nullable=True) # Berilgan paytdagi retsept versiyasi
 
     meal = relationship("Meal", back_populates="servings")
     served_by_user = relationship("User", back_populates="served_meals")
@@ -178,6 +257,11 @@ class MealServing(Base):
 # --- ServingDetail ---
 class ServingDetail(Base): # Ovqat berilganda qaysi ingredientdan qancha ishlatilgani
     __tablename__ = "serving_details"
+    __table_args__ = (
+        # meal_servings bilan JOIN va product_id bo'yicha yig'indi (quantity_used - covering)
+        Index("ix_serving_details_serving_id_product_id", "serving_id", "product_id", "quantity_used"),
+        Index("ix_serving_details_product_id", "product_id", "serving_id", "quantity_used"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     serving_id = Column(Integer, ForeignKey("meal_servings.id"), nullable=False)
@@ -208,6 +292,9 @@ class NotificationType(Base):
 # --- Notification ---
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_user_id_is_read_created_at", "user_id", "is_read", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     message = Column(Text, nullable=False)
@@ -235,6 +322,9 @@ class MonthlyReport(Base):
     is_overall_suspicious = Column(Boolean, default=False, nullable=True)
 
     difference_percentage = Column(Float, nullable=True)
+    # Oy yopilgandan keyin generatsiya qilingan (o'zgarmaydi, qayta generatsiya shart emas). O'tgan oyga
+    # kiritilgan kirim shu oy va keyingi oylar hisobotlarini yana "final emas" qiladi.
+    is_final = Column(Boolean, default=False, nullable=False, server_default="0")
 
     generated_by_user = relationship("User", back_populates="generated_reports")  # Optional["User"] edi
     meal_performance_summaries = relationship("ReportMealPerformance", back_populates="report",
@@ -251,6 +341,7 @@ class MonthlyReport(Base):
 # Bu har bir ovqat uchun oylik porsiya ko'rsatkichlarini saqlaydi
 class ReportMealPerformance(Base):
     __tablename__ = "report_meal_performance"
+    __table_args__ = (Index("ix_report_meal_performance_report_id", "report_id"),)
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     report_id = Column(Integer, ForeignKey("monthly_reports.id"), nullable=False)
     meal_id = Column(Integer, ForeignKey("meals.id"), nullable=False)
@@ -267,6 +358,7 @@ class ReportMealPerformance(Base):
 
 class ReportDetail(Base): # Ingredient sarfi uchun (bu klass bir marta e'lon qilingan)
     __tablename__ = "report_ingredient_details" # JADVAL NOMINI ANIQ QILAMIZ
+    __table_args__ = (Index("ix_report_ingredient_details_report_id", "report_id"),)
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     report_id = Column(Integer, ForeignKey("monthly_reports.id"), nullable=False)
     meal_id = Column(Integer, ForeignKey("meals.id"), nullable=False)
@@ -300,6 +392,7 @@ class PossibleMeals(Base): # Har bir ovqatdan hozirda qancha porsiya tayyorlash
 # --- ProductMonthlyBalance Modeli (YANGI) ---
 class ProductMonthlyBalance(Base):
     __tablename__ = "product_monthly_balances"
+    __table_args__ = (Index("ix_product_monthly_balances_report_id_product_id", "report_id", "product_id"),)
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     report_id = Column(Integer, ForeignKey("monthly_reports.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -0,0 +1,162 @@
+# app/portion_matrix.py
+# Barcha faol ovqatlar uchun mumkin bo'lgan porsiyalarni bitta vektorlashgan hisob bilan topish.
+# Retseptlar ovqat x mahsulot siyrak (CSR) talab matritsasiga aylantiriladi: qiymatlar 1 porsiya uchun kerakli
+# miqdor, mahsulotning ASOSIY birligida (MealIngredient.quantity_per_portion_base, retsept saqlanganda hisoblangan).
+# Qoldiqlar vektori bilan: porsiya[ovqat] = min(floor(qoldiq[mahsulot] / talab[ovqat, mahsulot])).
+# Matritsa faqat retseptlar o'zgarganda (recipe fingerprint) qayta quriladi va har bir processda keshlanadi.
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy o'rnatilmagan - crud oddiy (ovqatma-ovqat) Python hisobiga qaytadi
+    np = None
+
+MIN_QUANTITY = 1e-9  # Bundan kichik talab porsiyani cheklamaydi, bundan kichik qoldiq - "yo'q"
+
+
+class PortionMatrix:
+    """
+    Faol ovqatlar retseptlarining o'zgarmas (immutable) matritsa ko'rinishi.
+    - `meal_ids[i]` - i-qator ovqati, `product_ids[j]` - j-ustun mahsuloti;
+    - `indptr`, `columns`, `requirements` - CSR: i-qatorning yozuvlari `indptr[i]:indptr[i + 1]` oralig'ida,
+      retseptdagi tartibda (bir mahsulot bir necha marta uchrasa, talablar qo'shiladi);
+    - `blocked_product_ids[i]` - birligi konvertatsiya qilinmaydigan yoki ma'lumoti to'liq bo'lmagan birinchi
+      ingredient mahsuloti (-1 - yo'q). Bunday ovqatdan 0 porsiya, cheklovchi - shu mahsulot.
+    """
+
+    def __init__(self, fingerprint: Hashable, meal_ids: Sequence[int], product_ids: Sequence[int],
+                 indptr: Sequence[int], columns: Sequence[int], requirements: Sequence[float],
+                 blocked_product_ids: Sequence[int]):
+        self.fingerprint = fingerprint
+        self.meal_ids = np.asarray(meal_ids, dtype=np.int64)
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.columns = np.asarray(columns, dtype=np.int64)
+        self.requirements = np.asarray(requirements, dtype=np.float64)
+        self.blocked_product_ids = np.asarray(blocked_product_ids, dtype=np.int64)
+        self.meal_index = {meal_id: i for i, meal_id in enumerate(meal_ids)}
+        self.product_index = {product_id: j for j, product_id in enumerate(product_ids)}
+        self._entry_rows = np.repeat(np.arange(len(meal_ids), dtype=np.int64), np.diff(self.indptr))
+
+    @classmethod
+    def build(cls, fingerprint: Hashable, meals: Iterable) -> "PortionMatrix":
+        """`meals` - faol ovqatlar, ingredientlari (product.unit va unit bilan) yuklangan holda."""
+        meal_ids: List[int] = []
+        product_index: Dict[int, int] = {}
+        indptr = [0]
+        columns: List[int] = []
+        requirements: List[float] = []
+        blocked_product_ids: List[int] = []
+
+        for meal in meals:
+            row: Dict[int, float] = {}  # product_id -> talab (dict retseptdagi tartibni saqlaydi)
+            blocked_product_id = -1
+            for ingredient in meal.ingredients:
+                product, recipe_unit = ingredient.product, ingredient.unit
+                if not (product and product.unit and recipe_unit):
+                    print(f"WARN: PORTION_MATRIX - Ingredient data incomplete for meal '{meal.name}', "
+                          f"product_id {ingredient.product_id}. Meal is marked as 0 portions.")
+                    blocked_product_id = ingredient.product_id
+                    break
+                if ingredient.quantity_per_portion <= MIN_QUANTITY:
+                    continue
+                quantity_in_base_unit = ingredient.quantity_per_portion_base
+                if quantity_in_base_unit is None:
+                    print(f"WARN: PORTION_MATRIX - Cannot convert units for {product.name} "
+                          f"({recipe_unit.short_name} to {product.unit.short_name}) in meal '{meal.name}'. "
+                          f"Meal is marked as 0 portions.")
+                    blocked_product_id = product.id
+                    break
+                if quantity_in_base_unit <= MIN_QUANTITY:
+                    continue
+                row[product.id] = row.get(product.id, 0.0) + quantity_in_base_unit
+
+            meal_ids.append(meal.id)
+            blocked_product_ids.append(blocked_product_id)
+            if blocked_product_id == -1:
+                for product_id, quantity in row.items():
+                    columns.append(product_index.setdefault(product_id, len(product_index)))
+                    requirements.append(quantity)
+            indptr.append(len(columns))
+
+        return cls(fingerprint, meal_ids, list(product_index), indptr, columns, requirements, blocked_product_ids)
+
+    def product_ids_for_meals(self, meal_ids: Optional[Iterable[int]] = None) -> List[int]:
+        """Berilgan ovqatlar retseptidagi mahsulotlar (None - matritsadagi barcha mahsulotlar)."""
+        if meal_ids is None:
+            return self.product_ids.tolist()
+        rows = [self.meal_index[m] for m in meal_ids if m in self.meal_index]
+        if not rows:
+            return []
+        entry_slices = [self.columns[self.indptr[r]:self.indptr[r + 1]] for r in rows]
+        return self.product_ids[np.unique(np.concatenate(entry_slices))].tolist()
+
+    def stock_vector(self, stock_map: Dict[int, float]) -> "np.ndarray":
+        """Qoldiqlar vektori (matritsa ustunlari tartibida); stock_map da yo'q mahsulotlar - 0."""
+        vector = np.zeros(len(self.product_ids), dtype=np.float64)
+        for product_id, quantity in stock_map.items():
+            j = self.product_index.get(product_id)
+            if j is not None:
+                vector[j] = quantity
+        return vector
+
+    def compute(self, stock: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Barcha ovqatlar uchun (porsiyalar, cheklovchi product_id; -1 - yo'q) massivlari, bitta o'tishda.
+        Bir xil minimumda omborda umuman yo'q mahsulot, keyin retseptda birinchi kelgan ingredient cheklovchi.
+        """
+        n_meals = len(self.meal_ids)
+        entry_stock = stock[self.columns]
+        in_stock = entry_stock > MIN_QUANTITY
+        entry_portions = np.where(in_stock, np.floor(entry_stock / self.requirements), 0.0)
+        # Qator ichida (porsiyalar, omborda borligi) bo'yicha saralash (lexsort barqaror - tenglikda retsept
+        # tartibi saqlanadi); qatorlar tartibi o'zgarmagani uchun har bir qatorning minimumi `indptr[i]` pozitsiyasida
+        order = np.lexsort((in_stock, entry_portions, self._entry_rows))
+        non_empty = np.diff(self.indptr) > 0
+        first_entries = order[self.indptr[:-1][non_empty]]
+
+        portions = np.zeros(n_meals, dtype=np.int64)
+        limiting_product_ids = np.full(n_meals, -1, dtype=np.int64)
+        portions[non_empty] = entry_portions[first_entries].astype(np.int64)
+        limiting_product_ids[non_empty] = self.product_ids[self.columns[first_entries]]
+
+        blocked = self.blocked_product_ids != -1
+        portions[blocked] = 0
+        limiting_product_ids[blocked] = self.blocked_product_ids[blocked]
+        return portions, limiting_product_ids
+
+    def possible_portions(self, stock_map: Dict[int, float],
+                          meal_ids: Optional[Iterable[int]] = None) -> Dict[int, Tuple[int, Optional[int]]]:
+        """{meal_id: (porsiyalar, cheklovchi product_id yoki None)} - matritsadagi (faol) ovqatlar uchun."""
+        portions, limiting_product_ids = self.compute(self.stock_vector(stock_map))
+        rows = range(len(self.meal_ids)) if meal_ids is None else \
+            [self.meal_index[m] for m in meal_ids if m in self.meal_index]
+        return {
+            int(self.meal_ids[i]): (int(portions[i]), int(limiting_product_ids[i]) if limiting_product_ids[i] != -1 else None)
+            for i in rows
+        }
+
+
+_cached_matrix: Optional[PortionMatrix] = None
+_cache_lock = threading.Lock()
+
+
+def get_cached_matrix(fingerprint: Hashable, load_meals: Callable[[], Iterable]) -> Optional[PortionMatrix]:
+    """
+    Keshdagi matritsa (fingerprint o'zgarmagan bo'lsa), aks holda `load_meals()` dan qayta quradi.
+    numpy o'rnatilmagan bo'lsa None.
+    """
+    global _cached_matrix
+    if np is None:
+        return None
+    with _cache_lock:
+        if _cached_matrix is None or _cached_matrix.fingerprint != fingerprint:
+            _cached_matrix = PortionMatrix.build(fingerprint, load_meals())
+        return _cached_matrix
+
+
+def invalidate_cache() -> None:
+    global _cached_matrix
+    with _cache_lock:
+        _cached_matrix = None
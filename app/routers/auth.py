@@ -1,8 +1,10 @@
 # app/routers/auth.py
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
+from typing import Optional
 
 from app import crud, schemas, models, security
 from app.database import get_db
@@ -26,19 +28,19 @@ async def login_for_access_token(
     """
     Foydalanuvchi nomi va parol bilan tizimga kirish va JWT token olish.
     Token javobda va HTTPOnly cookie sifatida qaytariladi.
+    bcrypt tekshiruvini kutish uchun endpoint async; sinxron DB ishlari esa threadpoolda bajariladi.
     """
-    user = crud.get_active_user_by_username(db, username=form_data.username)
+    # Rol bilan birga yuklanadi - keyinchalik event loopda lazy-load so'rovi bo'lmaydi
+    user = await run_in_threadpool(security.get_user_by_username_for_auth, db, form_data.username)
 
-    if not user or not security.verify_password(form_data.password, user.password_hash):
-        # Login muvaffaqiyatsiz bo'lganini loglash
-        log_action(
-            db=db,
-            request=request,
-            current_user=None, # Login fail bo'lganda user noma'lum
-            action_name="LOGIN_ATTEMPT",
-            status="FAILURE",
-            details=f"Login attempt failed for username: {form_data.username}."
-        )
+    password_ok, new_password_hash = False, None
+    if user:
+        # bcrypt alohida thread poolda - event loop (WebSocket, boshqa so'rovlar) bloklanmaydi
+        password_ok, new_password_hash = await security.verify_and_update_password(form_data.password,
+                                                                                  user.password_hash)
+
+    if not password_ok:
+        await run_in_threadpool(_record_failed_login, db, request, form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Foydalanuvchi nomi yoki parol noto'g'ri",
@@ -65,6 +67,31 @@ async def login_for_access_token(
         path="/"
     )
 
+    await run_in_threadpool(_record_successful_login, db, request, user, new_password_hash)
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_info": user_info_for_token
+    }
+
+
+def _record_failed_login(db: Session, request: Request, username: str):
+    # Login muvaffaqiyatsiz bo'lganini loglash
+    log_action(
+        db=db,
+        request=request,
+        current_user=None, # Login fail bo'lganda user noma'lum
+        action_name="LOGIN_ATTEMPT",
+        status="FAILURE",
+        details=f"Login attempt failed for username: {username}."
+    )
+
+
+def _record_successful_login(db: Session, request: Request, user: models.User, new_password_hash: Optional[str]):
+    if new_password_hash:
+        # BCRYPT_ROUNDS o'zgargan - parol yangi parametrlar bilan qayta xeshlanadi (quyidagi commit bilan saqlanadi)
+        user.password_hash = new_password_hash
     crud.update_user_last_login(db, user.id)
     # db.commit() # Agar update_user_last_login o'zi commit qilmasa
 
@@ -87,15 +114,9 @@ async def login_for_access_token(
     # Yaxshiroq yechim:
     db.commit() # Oxirgi kirish va log yozuvlari uchun yagona commit
 
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user_info": user_info_for_token
-    }
-
 
 @router.post("/logout", summary="Tizimdan chiqish")
-async def logout(
+def logout(
     response: Response,
     request: Request, # Request obyektini olish
     db: Session = Depends(get_db), # DB sessiyasini olish
@@ -154,7 +175,7 @@ async def read_users_me(
     summary="Boshlang'ich ma'lumotlarni sozlash (Faqat Admin)",
     include_in_schema=settings.APP_ENV == "development"
 )
-async def setup_initial_data_endpoint(
+def setup_initial_data_endpoint(
         request: Request, # Request obyektini olish
         db: Session = Depends(get_db),
         current_admin: models.User = Depends(security.get_current_admin_user)
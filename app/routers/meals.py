@@ -1,15 +1,16 @@
 # app/routers/meals.py
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security, Request # Request ni import qiling
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Dict
 
-from app import crud, schemas, models, security
-from app.database import get_db
+from app import crud, crud_async, schemas, models, security
+from app.database import get_db, get_async_db
 from app.config import settings
-from app.celery_config import redis_client_for_celery_config as redis_client, \
-    WS_MESSAGE_CHANNEL
-from app.schemas import WebSocketMessage, MealDefinitionUpdatedPayload, MealDeletedPayload # Payload sxemalarini import qiling
+from app.schemas import MealDefinitionUpdatedPayload, MealDeletedPayload # Payload sxemalarini import qiling
 from app.tasks.portion_tasks import task_update_all_possible_meal_portions_celery
+from app.tasks.dispatch import schedule_portion_recalc_for_meals, get_dispatch_metrics
+from app.websockets.publisher import publish_ws_message
 from app.logging_utils import log_action # log_action ni import qiling
 
 router = APIRouter(
@@ -71,6 +72,19 @@ def create_new_meal(
                 print(f"CRITICAL: Failed to write FAILURE audit log for meal creation (unit not found): {log_e}")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                 detail=f"Ingredient uchun ID={ing_data.unit_id} bo'lgan o'lchov birligi topilmadi.")
+        if crud.get_ingredient_base_quantity(db, ing_data) is None:
+            details_log = f"Meal creation by user '{current_user_from_dep.username}' failed. Unit '{db_unit.short_name}' cannot be converted to the base unit of product '{db_product.name}' for meal '{meal_in.name}'."
+            try:
+                log_action(db=db, request=request, current_user=current_user_from_dep,
+                           action_name="CREATE_MEAL_ATTEMPT", status="FAILURE", details=details_log,
+                           changes_after=meal_in.model_dump(mode='json'))
+                db.commit()
+            except Exception as log_e:
+                print(f"CRITICAL: Failed to write FAILURE audit log for meal creation (unit mismatch): {log_e}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"'{db_product.name}' uchun birliklar mos kelmaydi: retseptda '{db_unit.name}', "
+                                       f"omborda '{db_product.unit.name}'. Hajm va og'irlik orasida konvertatsiya "
+                                       f"uchun mahsulot zichligini kiriting.")
 
     try:
         # 1. Ovqatni yaratish (crud.create_meal commit qilmaydi)
@@ -100,14 +114,14 @@ def create_new_meal(
             raise HTTPException(status_code=500, detail="Failed to retrieve created meal after commit.")
 
         # Keyingi amallar
-        task_update_all_possible_meal_portions_celery.delay()
+        schedule_portion_recalc_for_meals([final_created_meal.id])
         ws_payload_new_meal = MealDefinitionUpdatedPayload(
             meal_id=final_created_meal.id,
             meal_name=final_created_meal.name,
+            changed_product_ids=sorted({mi.product_id for mi in final_created_meal.ingredients}),
             message=f"Yangi '{final_created_meal.name}' ovqati tizimga qo'shildi."
         )
-        ws_message_obj_new_meal = WebSocketMessage(type="meal_definition_updated", payload=ws_payload_new_meal)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_new_meal.model_dump_json())
+        publish_ws_message("meal_definition_updated", ws_payload_new_meal)
 
         return final_created_meal  # To'liq yuklangan obyektni qaytarish
 
@@ -155,13 +169,24 @@ def read_all_meals(
     summary="Tayyorlash mumkin bo'lgan faol ovqatlar ro'yxati",
     dependencies=[Security(security.get_current_active_user)]
 )
-def get_meals_available_for_serving(
-        db: Session = Depends(get_db)
+async def get_meals_available_for_serving(
+        db: AsyncSession = Depends(get_async_db)
 ):
-    available_meals = crud.get_possible_meal_portions_list(db, limit=100)
+    available_meals = await crud_async.get_possible_meal_portions_list(db, limit=100)
     return [meal_info for meal_info in available_meals if meal_info.possible_portions > 0]
 
 
+@router.get(
+    "/recalculation-dispatch-metrics",
+    response_model=Dict[str, int],
+    summary="Porsiya qayta hisoblash dispetcheri statistikasi (nechta trigger birlashtirilgani)",
+    dependencies=[Security(security.get_current_manager_user)]
+)
+def read_recalculation_dispatch_metrics():
+    # triggers_absorbed - oynada mavjud flushga qo'shilib, alohida task yubormagan triggerlar soni
+    return get_dispatch_metrics()
+
+
 @router.get(
     "/{meal_id}",
     response_model=schemas.Meal,
@@ -191,7 +216,7 @@ from datetime import datetime  # Agar crud.update_meal ichida datetime.now() ish
     summary="Mavjud ovqatni va retseptini yangilash",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def update_existing_meal(
+def update_existing_meal(
         request: Request,  # Birinchi parametr
         meal_id: int,
         meal_in: schemas.MealUpdate,
@@ -254,12 +279,27 @@ async def update_existing_meal(
                     print(f"CRITICAL: Failed to write FAILURE audit log for meal update (unit not found): {log_e}")
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                                     detail=f"Ingredient uchun ID={ing_data.unit_id} bo'lgan o'lchov birligi topilmadi.")
+            if crud.get_ingredient_base_quantity(db, ing_data) is None:
+                details_log = f"Update meal by user '{current_user_from_dep.username}' failed for meal ID {meal_id}. Unit '{db_unit.short_name}' cannot be converted to the base unit of product '{db_product.name}'."
+                try:
+                    log_action(db=db, request=request, current_user=current_user_from_dep,
+                               action_name="UPDATE_MEAL_ATTEMPT", status="FAILURE", target_entity_type="Meal",
+                               target_entity_id=meal_id, details=details_log, changes_before=old_meal_data_for_log,
+                               changes_after=meal_in.model_dump(exclude_unset=True, mode='json'))
+                    db.commit()
+                except Exception as log_e:
+                    print(f"CRITICAL: Failed to write FAILURE audit log for meal update (unit mismatch): {log_e}")
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"'{db_product.name}' uchun birliklar mos kelmaydi: retseptda '{db_unit.name}', "
+                                           f"omborda '{db_product.unit.name}'. Hajm va og'irlik orasida konvertatsiya "
+                                           f"uchun mahsulot zichligini kiriting.")
 
     try:
         # 1. Ovqatni yangilash (crud.update_meal commit qilmaydi)
-        # Bu funksiya o'zgartirilgan va refresh qilingan ORM obyektini qaytaradi
-        updated_meal_orm = crud.update_meal(db=db, meal_id=meal_id, meal_update_data=meal_in,
-                                            user_id=current_user_from_dep.id)
+        # Yuqorida yuklangan ovqat beriladi (qayta yuklanmaydi); retsept diff orqali yangilanadi
+        updated_meal_orm, changed_product_ids = crud.update_meal(db=db, meal_id=meal_id, meal_update_data=meal_in,
+                                                                 user_id=current_user_from_dep.id,
+                                                                 db_meal=db_meal_to_update)
 
         if updated_meal_orm is None:  # Bu holat agar get_meal None qaytarsa (yuqorida tekshirilgan)
             details_log_err = f"Meal ID {meal_id} update returned None unexpectedly by user '{current_user_from_dep.username}'."
@@ -275,36 +315,34 @@ async def update_existing_meal(
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                 detail="Ovqatni yangilashda noma'lum xatolik (obyekt qaytarilmadi).")
 
+        # Javob commitdan oldin tayyorlanadi (commitdan keyin ORM obyekti expire bo'lib, qayta yuklanardi)
+        updated_meal_response = schemas.Meal.model_validate(updated_meal_orm)
+
         # 2. Log yozish (crud.create_audit_log_entry commit qilmaydi)
         log_action(
             db=db, request=request, current_user=current_user_from_dep,
             action_name="UPDATE_MEAL", status="SUCCESS",
-            target_entity_type="Meal", target_entity_id=updated_meal_orm.id,
-            details=f"Meal '{updated_meal_orm.name}' (ID: {meal_id}) updated by user '{current_user_from_dep.username}'.",
+            target_entity_type="Meal", target_entity_id=updated_meal_response.id,
+            details=f"Meal '{updated_meal_response.name}' (ID: {meal_id}) updated by user '{current_user_from_dep.username}'.",
             changes_before=old_meal_data_for_log,  # Bu allaqachon mode='json' qilingan
-            changes_after=schemas.Meal.model_validate(updated_meal_orm).model_dump(mode='json')
-            # Yangilangan to'liq holat
+            changes_after=updated_meal_response.model_dump(mode='json')  # Yangilangan to'liq holat
         )
 
         # ***** MUHIM: Yagona COMMIT *****
         db.commit()
 
-        # Javob qaytarishdan oldin obyektni qayta refresh qilish shart emas,
-        # chunki crud.update_meal oxirida get_meal(db, meal_id) ni chaqiradi,
-        # bu esa selectinload bilan to'liq yuklangan obyektni qaytaradi.
-        # db.refresh(updated_meal_orm) # Agar crud.update_meal faqat refresh qilsa, bu kerak bo'lardi
-
-        # Keyingi amallar
-        task_update_all_possible_meal_portions_celery.delay()
+        # Keyingi amallar: porsiyalar faqat retsept yoki faollik o'zgarganda qayta hisoblanadi
+        if changed_product_ids or "is_active" in meal_in.model_fields_set:
+            schedule_portion_recalc_for_meals([meal_id])
         ws_payload_meal_updated = MealDefinitionUpdatedPayload(
-            meal_id=updated_meal_orm.id,
-            meal_name=updated_meal_orm.name,
-            message=f"'{updated_meal_orm.name}' ovqati yangilandi."
+            meal_id=meal_id,
+            meal_name=updated_meal_response.name,
+            changed_product_ids=changed_product_ids,
+            message=f"'{updated_meal_response.name}' ovqati yangilandi."
         )
-        ws_message_obj_meal_updated = WebSocketMessage(type="meal_definition_updated", payload=ws_payload_meal_updated)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_meal_updated.model_dump_json())
+        publish_ws_message("meal_definition_updated", ws_payload_meal_updated)
 
-        return updated_meal_orm
+        return updated_meal_response
 
     except HTTPException:
         # Agar xatolik yuqoridagi if bloklarida yuzaga kelsa va log yozilib, commit qilingan bo'lsa,
@@ -343,7 +381,7 @@ from datetime import datetime  # Agar crud.soft_delete_meal ichida datetime.now(
     summary="Ovqatni \"soft delete\" qilish",
     dependencies=[Security(security.get_current_admin_user)]
 )
-async def soft_delete_existing_meal(
+def soft_delete_existing_meal(
         request: Request,  # Birinchi parametr
         meal_id: int,
         db: Session = Depends(get_db),
@@ -406,14 +444,13 @@ async def soft_delete_existing_meal(
         # if not final_deleted_meal: ... handle error ...
 
         # Keyingi amallar
-        task_update_all_possible_meal_portions_celery.delay()
+        schedule_portion_recalc_for_meals([db_meal_to_delete.id])
         ws_payload_meal_deleted = MealDeletedPayload(
             meal_id=db_meal_to_delete.id,
             meal_name=db_meal_to_delete.name,
             message=f"'{db_meal_to_delete.name}' ovqati o'chirildi/noaktiv qilindi."
         )
-        ws_message_obj_meal_deleted = WebSocketMessage(type="meal_deleted", payload=ws_payload_meal_deleted)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_meal_deleted.model_dump_json())
+        publish_ws_message("meal_deleted", ws_payload_meal_deleted)
 
         return db_meal_to_delete  # Yoki final_deleted_meal
 
@@ -448,7 +485,7 @@ async def soft_delete_existing_meal(
     summary="Barcha ovqatlar uchun mumkin porsiyalarni qayta hisoblashni ishga tushirish",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def trigger_recalculate_possible_portions_endpoint(
+def trigger_recalculate_possible_portions_endpoint(
         request: Request,
         db: Session = Depends(get_db),
         current_user_from_dep: models.User = Depends(security.get_current_manager_user)
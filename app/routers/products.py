@@ -1,16 +1,15 @@
 # app/routers/products.py
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
-from app import crud, schemas, models, security
-from app.database import get_db
+from app import crud, crud_async, schemas, models, security
+from app.database import get_db, get_async_db
 from app.config import settings
-from app.celery_config import redis_client_for_celery_config as redis_client, \
-    WS_MESSAGE_CHANNEL
-from app.schemas import WebSocketMessage, ProductDefinitionUpdatedPayload, ProductDeletedPayload, StockItemReceivedPayload # Payload sxemalarini import qiling
-from app.tasks.portion_tasks import task_update_all_possible_meal_portions_celery, \
-    task_check_product_stock_and_notify_celery
+from app.schemas import ProductDefinitionUpdatedPayload, ProductDeletedPayload, StockItemReceivedPayload # Payload sxemalarini import qiling
+from app.tasks.dispatch import schedule_portion_recalc_for_products, schedule_stock_check
+from app.websockets.publisher import publish_ws_message, staff_topics, product_watcher_topics
 from app.logging_utils import log_action
 from datetime import datetime
 
@@ -118,7 +117,7 @@ def create_new_product(
 
         db.commit()
 
-        task_update_all_possible_meal_portions_celery.delay()
+        # Yangi mahsulot hali hech qaysi retseptda yo'q - porsiyalarni qayta hisoblash shart emas
         db.refresh(created_product_orm)
         return created_product_orm
 
@@ -149,14 +148,14 @@ def create_new_product(
     summary="Barcha mahsulotlar ro'yxati (ombordagi miqdori bilan)",
     dependencies=[Security(security.get_current_active_user)]
 )
-def read_all_products_with_stock(
+async def read_all_products_with_stock(
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=1001),
         name_filter: Optional[str] = Query(None),
         low_stock_only: bool = Query(False),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    products_with_qty = crud.get_all_products_with_current_quantity(
+    products_with_qty = await crud_async.get_all_products_with_current_quantity(
         db, skip=skip, limit=limit, name_filter=name_filter, low_stock_only=low_stock_only
     )
     return products_with_qty
@@ -168,14 +167,14 @@ def read_all_products_with_stock(
     summary="ID bo'yicha mahsulotni olish (ombordagi miqdori bilan)",
     dependencies=[Security(security.get_current_active_user)]
 )
-def read_product_by_id_with_stock(
+async def read_product_by_id_with_stock(
         product_id: int,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    db_product = crud.get_product(db, product_id=product_id)
+    db_product = await crud_async.get_product(db, product_id=product_id)
     if db_product is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Mahsulot topilmadi")
-    current_quantity = crud.get_product_current_quantity(db, product_id)
+    current_quantity = await crud_async.get_product_current_quantity(db, product_id)
     product_data_validated = schemas.Product.model_validate(db_product)
     return schemas.ProductWithQuantity(
         **product_data_validated.model_dump(),
@@ -189,7 +188,7 @@ def read_product_by_id_with_stock(
     summary="Mavjud mahsulotni yangilash",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def update_existing_product(
+def update_existing_product(
         request: Request,
         product_id: int,
         product_in: schemas.ProductUpdate,
@@ -240,6 +239,15 @@ async def update_existing_product(
             setattr(db_product_to_update, key, value)
         db_product_to_update.updated_at = datetime.now()  # updated_at ni qo'lda yangilash
 
+        if "unit_id" in update_data or "density" in update_data:
+            # Retseptlardagi asosiy birlik miqdorlari yangi birlik/zichlik bo'yicha qayta hisoblanadi
+            unconvertible_meal_names = crud.recompute_ingredient_base_quantities(db, db_product_to_update.id)
+            if unconvertible_meal_names:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"'{db_product_to_update.name}' mahsulotining yangi birligi quyidagi "
+                                           f"ovqatlar retseptidagi birliklarga mos kelmaydi: "
+                                           f"{', '.join(unconvertible_meal_names)}.")
+
         db.add(db_product_to_update)
 
         current_state_for_log = schemas.Product.model_validate(db_product_to_update).model_dump(mode='json')
@@ -264,7 +272,7 @@ async def update_existing_product(
             db.refresh(db_product_to_update.created_by_user)
 
         # Keyingi amallar
-        task_check_product_stock_and_notify_celery.delay(db_product_to_update.id)
+        schedule_stock_check([db_product_to_update.id])
         current_qty = crud.get_product_current_quantity(db, db_product_to_update.id)
 
         ws_payload_update = ProductDefinitionUpdatedPayload(
@@ -273,9 +281,8 @@ async def update_existing_product(
             unit=db_product_to_update.unit.short_name if db_product_to_update.unit else "N/A",
             message=f"'{db_product_to_update.name}' mahsuloti ta'rifi yangilandi."
         )
-        ws_message_obj_update = WebSocketMessage(type="product_definition_updated", payload=ws_payload_update)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_update.model_dump_json())
-        task_update_all_possible_meal_portions_celery.delay()
+        publish_ws_message("product_definition_updated", ws_payload_update)
+        schedule_portion_recalc_for_products([db_product_to_update.id])
 
         return db_product_to_update  # Yangilangan ORM obyektini qaytarish
 
@@ -302,7 +309,7 @@ async def update_existing_product(
     summary="Mahsulotni \"soft delete\" qilish",
     dependencies=[Security(security.get_current_admin_user)]
 )
-async def soft_delete_existing_product(
+def soft_delete_existing_product(
         request: Request,
         product_id: int,
         db: Session = Depends(get_db),
@@ -369,14 +376,13 @@ async def soft_delete_existing_product(
         db.commit()
         db.refresh(db_product_to_delete)  # Commitdan keyin to'liq obyektni olish uchun
 
-        task_update_all_possible_meal_portions_celery.delay()
+        schedule_portion_recalc_for_products([db_product_to_delete.id])
         ws_payload_deleted = ProductDeletedPayload(
             product_id=db_product_to_delete.id,
             product_name=db_product_to_delete.name,
             message=f"'{db_product_to_delete.name}' mahsuloti o'chirildi."
         )
-        ws_message_obj_deleted = WebSocketMessage(type="product_deleted", payload=ws_payload_deleted)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_deleted.model_dump_json())
+        publish_ws_message("product_deleted", ws_payload_deleted)
 
         return db_product_to_delete
 
@@ -412,7 +418,7 @@ async def soft_delete_existing_product(
     summary="Yangi mahsulot yetkazib berilishini qayd etish",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def create_new_product_delivery(
+def create_new_product_delivery(
         request: Request,
         delivery_in: schemas.ProductDeliveryCreate,  # Bu yerda delivery_date: datetime keladi
         db: Session = Depends(get_db),
@@ -461,8 +467,8 @@ async def create_new_product_delivery(
             db.refresh(created_delivery_orm.received_by_user)
 
         # Keyingi amallar
-        task_update_all_possible_meal_portions_celery.delay()
-        task_check_product_stock_and_notify_celery.delay(created_delivery_orm.product_id)
+        schedule_portion_recalc_for_products([created_delivery_orm.product_id])
+        schedule_stock_check([created_delivery_orm.product_id])
 
         current_qty_after_delivery = crud.get_product_current_quantity(db, created_delivery_orm.product_id)
         ws_payload_delivery = StockItemReceivedPayload(
@@ -474,8 +480,9 @@ async def create_new_product_delivery(
             delivery_id=created_delivery_orm.id,
             message=f"'{created_delivery_orm.product.name if created_delivery_orm.product else 'N/A'}' mahsulotidan {created_delivery_orm.quantity} {created_delivery_orm.product.unit.short_name if created_delivery_orm.product and created_delivery_orm.product.unit else ''} qabul qilindi. Yangi miqdor: {current_qty_after_delivery:.2f}"
         )
-        ws_message_obj_delivery = WebSocketMessage(type="stock_item_received", payload=ws_payload_delivery)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_delivery.model_dump_json())
+        publish_ws_message("stock_item_received", ws_payload_delivery,
+                           topics=staff_topics(settings.ADMIN_ROLE_NAME, settings.MANAGER_ROLE_NAME)
+                           + product_watcher_topics([created_delivery_orm.product_id]))
 
         return created_delivery_orm
 
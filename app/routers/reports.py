@@ -1,11 +1,12 @@
 # app/routers/reports.py
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security, Request # Request ni import qiling
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 from datetime import date, datetime
 
-from app import crud, schemas, models, security
-from app.database import get_db
+from app import crud, crud_async, schemas, models, security
+from app.database import get_db, get_async_db
 from app.config import settings
 from app.tasks.report_tasks import task_generate_monthly_report_celery
 from app.logging_utils import log_action
@@ -27,10 +28,10 @@ async def get_my_notifications(
         skip: int = Query(0, ge=0),
         limit: int = Query(20, ge=1, le=1000),
         unread_only: bool = Query(False, description="Faqat o'qilmagan bildirishnomalarni ko'rsatish"),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user_from_dep: models.User = Depends(security.get_current_active_user)
 ):
-    notifications = crud.get_notifications_for_user(
+    notifications = await crud_async.get_notifications_for_user(
         db, user_id=current_user_from_dep.id, skip=skip, limit=limit, unread_only=unread_only
     )
     return notifications
@@ -42,7 +43,7 @@ async def get_my_notifications(
     summary="Bildirishnomani o'qilgan deb belgilash",
     dependencies=[Security(security.get_current_active_user)]
 )
-async def mark_notification_read(
+def mark_notification_read(
         notification_id: int,
         request: Request, # Loglash uchun Request obyektini olamiz
         db: Session = Depends(get_db),
@@ -81,7 +82,7 @@ async def mark_notification_read(
     summary="Joriy foydalanuvchi uchun barcha bildirishnomalarni o'qilgan deb belgilash",
     dependencies=[Security(security.get_current_active_user)]
 )
-async def mark_all_my_notifications_read(
+def mark_all_my_notifications_read(
         request: Request, # Loglash uchun Request obyektini olamiz
         db: Session = Depends(get_db),
         current_user_from_dep: models.User = Depends(security.get_current_active_user)
@@ -103,21 +104,23 @@ async def mark_all_my_notifications_read(
     summary="Oylik hisobotni qo'lda generatsiya qilishni rejalashtirish (Faqat Admin)",
     dependencies=[Security(security.get_current_admin_user)]
 )
-async def schedule_manual_monthly_report_generation(request: Request,
+def schedule_manual_monthly_report_generation(request: Request,
         # Non-default parameters first
         year: int = Query(..., description="Hisobot generatsiya qilinadigan yil (masalan, 2023)", ge=2020,
                           le=datetime.now().year + 5),
         month: int = Query(..., description="Hisobot generatsiya qilinadigan oy (1-12)", ge=1, le=12),
+        force: bool = Query(False, description="Yopilgan oyning final hisobotini ham qayta hisoblash"),
          # Loglash uchun Request obyektini olamiz
         # Default parameters (Depends)
         db: Session = Depends(get_db),
         current_admin_from_dep: models.User = Depends(security.get_current_admin_user)
 ):
-    task = task_generate_monthly_report_celery.delay(year, month, triggered_by_user_id=current_admin_from_dep.id)
+    task = task_generate_monthly_report_celery.delay(year, month, triggered_by_user_id=current_admin_from_dep.id,
+                                                     force=force)
     log_action(
         db=db, request=request, current_user=current_admin_from_dep,
         action_name="SCHEDULE_MANUAL_MONTHLY_REPORT", status="INITIATED",
-        details=f"Manual monthly report generation scheduled by admin '{current_admin_from_dep.username}' for {year}-{month:02d}. Celery Task ID: {task.id}",
+        details=f"Manual monthly report generation scheduled by admin '{current_admin_from_dep.username}' for {year}-{month:02d} (force={force}). Celery Task ID: {task.id}",
     )
     return {
         "msg": f"Oylik hisobot ({year}-{month:02d}) generatsiyasi Celery orqali rejalashtirildi. Task ID: {task.id}"}
@@ -129,7 +132,7 @@ async def schedule_manual_monthly_report_generation(request: Request,
     summary="Barcha generatsiya qilingan oylik hisobotlar ro'yxati",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def get_all_monthly_reports(
+def get_all_monthly_reports(
         skip: int = Query(0, ge=0),
         limit: int = Query(12, ge=1, le=500),
         year: Optional[int] = Query(None, description="Yil bo'yicha filtrlash"),
@@ -146,7 +149,7 @@ async def get_all_monthly_reports(
     summary="ID bo'yicha oylik hisobotni barcha tafsilotlari bilan olish",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def get_single_monthly_report_with_details(
+def get_single_monthly_report_with_details(
     report_id: int, # Non-default
     request: Request, # Non-default (loglash uchun)
     # Default parameters (Depends)
@@ -180,7 +183,7 @@ async def get_single_monthly_report_with_details(
     summary="Ingredientlar iste'moli grafigi uchun ma'lumotlar",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def get_ingredient_consumption_chart_data_endpoint(
+def get_ingredient_consumption_chart_data_endpoint(
         start_date: date = Query(..., description="Boshlanish sanasi (YYYY-MM-DD)"),
         end_date: date = Query(..., description="Tugash sanasi (YYYY-MM-DD)"),
         product_id: Optional[int] = Query(None, description="Aniq bir mahsulot IDsi bo'yicha filtrlash"),
@@ -199,7 +202,7 @@ async def get_ingredient_consumption_chart_data_endpoint(
     summary="Mahsulotlarning kelib tushish trendlari grafigi uchun ma'lumotlar",
     dependencies=[Security(security.get_current_manager_user)]
 )
-async def get_product_delivery_chart_data_endpoint(
+def get_product_delivery_chart_data_endpoint(
         start_date: date = Query(..., description="Boshlanish sanasi (YYYY-MM-DD)"),
         end_date: date = Query(..., description="Tugash sanasi (YYYY-MM-DD)"),
         product_id: Optional[int] = Query(None, description="Aniq bir mahsulot IDsi bo'yicha filtrlash"),
@@ -1,18 +1,17 @@
 # app/routers/servings.py
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Security, Request # Request ni import qiling
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
 
-from app import crud, schemas, models, security
-from app.database import get_db
+from app import crud, crud_async, schemas, models, security
+from app.database import get_db, get_async_db
 from app.config import settings
-from app.celery_config import redis_client_for_celery_config as redis_client, \
-    WS_MESSAGE_CHANNEL
 
-from app.schemas import WebSocketMessage, NewMealServedPayload
-from app.tasks.portion_tasks import task_update_all_possible_meal_portions_celery, \
-    task_check_product_stock_and_notify_celery
+from app.schemas import NewMealServedPayload, MealsBatchServedPayload, ServedMealItem
+from app.tasks.dispatch import schedule_portion_recalc_for_products, schedule_stock_check
+from app.websockets.publisher import publish_ws_message
 from app.logging_utils import log_action # log_action ni import qiling
 
 router = APIRouter(
@@ -28,7 +27,7 @@ router = APIRouter(
     summary="Yangi ovqat berilishini qayd etish",
     dependencies=[Security(security.get_current_chef_user)]
 )
-async def create_new_meal_serving(
+def create_new_meal_serving(
         request: Request,
         serving_in: schemas.MealServingCreate,
         db: Session = Depends(get_db),
@@ -46,7 +45,7 @@ async def create_new_meal_serving(
 
     # Bu funksiya (ORM_Object | None, ErrorMessage | None) qaytaradi
     # Yoki ideal holda, xatolik bo'lsa Exception ko'taradi
-    created_serving_orm, error_message_crud = crud.create_meal_serving(db=db, serving_data=serving_in, user_id=current_user_from_dep.id)
+    created_serving_orm, error_message_crud = crud.create_meal_serving(db=db, serving_data=serving_in, user_id=current_user_from_dep.id, db_meal=db_meal)
 
     if error_message_crud:
         details_log = f"Meal serving creation failed for meal '{db_meal.name}' by user '{current_user_from_dep.username}'. Reason: {error_message_crud}"
@@ -98,11 +97,13 @@ async def create_new_meal_serving(
 
 
         # Keyingi amallar
-        task_update_all_possible_meal_portions_celery.delay()
         # serving_details_for_tasks ni final_serving_for_response dan olish kerak
         if final_serving_for_response.serving_details:
-            for detail in final_serving_for_response.serving_details:
-                task_check_product_stock_and_notify_celery.delay(detail.product_id)
+            # Faqat sarflangan mahsulotlarga bog'liq ovqatlar qayta hisoblanadi
+            # Oyna ichidagi boshqa ovqat berishlar bilan bitta taskka birlashtiriladi (app/tasks/dispatch.py)
+            consumed_product_ids = {detail.product_id for detail in final_serving_for_response.serving_details}
+            schedule_portion_recalc_for_products(consumed_product_ids)
+            schedule_stock_check(consumed_product_ids)
 
         ws_payload_served = NewMealServedPayload(
             serving_id=final_serving_for_response.id,
@@ -113,8 +114,7 @@ async def create_new_meal_serving(
             served_by_user_name=current_user_from_dep.full_name,
             message=f"'{db_meal.name}' ovqatidan {final_serving_for_response.portions_served} porsiya {current_user_from_dep.full_name} tomonidan berildi."
         )
-        ws_message_obj_served = WebSocketMessage(type="new_meal_served", payload=ws_payload_served)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj_served.model_dump_json())
+        publish_ws_message("new_meal_served", ws_payload_served)
 
         return schemas.MealServingWithDetails.model_validate(final_serving_for_response)
 
@@ -131,13 +131,96 @@ async def create_new_meal_serving(
             print(f"CRITICAL: Failed to write ERROR audit log after meal serving creation failure: {log_e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Ovqat berishda kutilmagan server xatoligi: {error_log_details}")
 
+@router.post(
+    "/batch",
+    response_model=List[schemas.MealServingWithDetails],
+    status_code=status.HTTP_201_CREATED,
+    summary="Bir nechta ovqat berishni bitta tranzaksiyada qayd etish",
+    dependencies=[Security(security.get_current_chef_user)]
+)
+def create_meal_servings_batch(
+        request: Request,
+        batch_in: schemas.MealServingBatchCreate,
+        db: Session = Depends(get_db),
+        current_user_from_dep: models.User = Depends(security.get_current_chef_user)
+):
+    """
+    Nonushta/tushlik/poldnik kabi bir nechta ovqat berishni birga qayd etadi.
+    Qoldiq barcha ovqatlarning umumiy sarfi bo'yicha bir marta tekshiriladi; biror element
+    o'tmasa, hech biri yozilmaydi. Batch uchun bitta audit yozuvi, bitta qayta hisoblash
+    triggeri va bitta WebSocket xabari yuboriladi.
+    """
+    batch_log = batch_in.model_dump(mode='json')
+    created_servings_orm, error_message_crud = crud.create_meal_servings_batch(
+        db=db, servings_data=batch_in.servings, user_id=current_user_from_dep.id)
+
+    if error_message_crud:
+        details_log = f"Batch meal serving ({len(batch_in.servings)} items) failed for user '{current_user_from_dep.username}'. Reason: {error_message_crud}"
+        try:
+            log_action(db=db, request=request, current_user=current_user_from_dep, action_name="CREATE_MEAL_SERVING_BATCH_ATTEMPT", status="VALIDATION_ERROR", target_entity_type="MealServing", details=details_log, changes_after=batch_log)
+            db.commit()
+        except Exception as log_e:
+            print(f"CRITICAL: Failed to write VALIDATION_ERROR audit log for meal serving batch: {log_e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_message_crud)
+
+    try:
+        log_action(
+            db=db, request=request, current_user=current_user_from_dep,
+            action_name="CREATE_MEAL_SERVING_BATCH", status="SUCCESS",
+            target_entity_type="MealServing",
+            details=f"{len(created_servings_orm)} meal servings ({sum(s.portions_served for s in created_servings_orm)} portions) recorded in one batch by user '{current_user_from_dep.username}'.",
+            changes_after={
+                "servings": [
+                    {
+                        "serving_info": schemas.MealServing.model_validate(s).model_dump(mode='json'),
+                        "consumed_ingredients": [{"product_id": sd.product_id, "quantity_used": sd.quantity_used} for sd in s.serving_details]
+                    } for s in created_servings_orm
+                ]
+            }
+        )
+
+        # Javob commitdan oldin tayyorlanadi (commitdan keyin ORM obyektlari expire bo'ladi va qayta yuklanadi)
+        response_servings = [schemas.MealServingWithDetails.model_validate(s) for s in created_servings_orm]
+        consumed_product_ids = {sd.product_id for s in response_servings for sd in s.serving_details}
+
+        # ***** Yagona COMMIT *****
+        db.commit()
+
+        # Keyingi amallar: butun batch uchun bitta trigger va bitta WS xabari
+        schedule_portion_recalc_for_products(consumed_product_ids)
+        schedule_stock_check(consumed_product_ids)
+
+        total_portions = sum(s.portions_served for s in response_servings)
+        ws_payload_batch = MealsBatchServedPayload(
+            servings=[ServedMealItem(serving_id=s.id, meal_id=s.meal_id, meal_name=s.meal.name,
+                                     portions_served=s.portions_served) for s in response_servings],
+            total_portions_served=total_portions,
+            served_at=response_servings[0].served_at.isoformat(),
+            served_by_user_name=current_user_from_dep.full_name,
+            message=f"{len(response_servings)} ta ovqatdan jami {total_portions} porsiya {current_user_from_dep.full_name} tomonidan berildi."
+        )
+        publish_ws_message("meals_batch_served", ws_payload_batch)
+
+        return response_servings
+
+    except Exception as e:
+        db.rollback()
+        error_log_details = f"Unexpected error in create_meal_servings_batch by user '{current_user_from_dep.username}': {str(e)}"
+        try:
+            log_action(db=db, request=request, current_user=current_user_from_dep, action_name="CREATE_MEAL_SERVING_BATCH_ATTEMPT", status="ERROR", target_entity_type="MealServing", details=error_log_details, changes_after=batch_log)
+            db.commit()
+        except Exception as log_e:
+            print(f"CRITICAL: Failed to write ERROR audit log after meal serving batch failure: {log_e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Ovqat berishda kutilmagan server xatoligi: {error_log_details}")
+
+
 @router.get(
     "/",
     response_model=List[schemas.MealServing],
     summary="Barcha ovqat berish holatlari ro'yxati",
     dependencies=[Security(security.get_current_manager_user)]
 )
-def read_all_meal_servings(
+async def read_all_meal_servings(
         # request: Request, # Agar loglamoqchi bo'lsangiz
         skip: int = Query(0, ge=0),
         limit: int = Query(100, ge=1, le=200),
@@ -145,25 +228,13 @@ def read_all_meal_servings(
         user_id: Optional[int] = Query(None, description="Ovqatni bergan foydalanuvchi IDsi bo'yicha filtrlash"),
         start_date: Optional[date] = Query(None, description="Berilgan sana (boshlanish) bo'yicha filtrlash (YYYY-MM-DD)"),
         end_date: Optional[date] = Query(None, description="Berilgan sana (tugash) bo'yicha filtrlash (YYYY-MM-DD)"),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
         # current_user_from_dep: models.User = Depends(security.get_current_manager_user) # Agar loglamoqchi bo'lsangiz
 ):
-    servings_orm = crud.get_meal_servings(
+    servings_orm = await crud_async.get_meal_servings(
         db, skip=skip, limit=limit, meal_id=meal_id, user_id=user_id, start_date=start_date, end_date=end_date
     )
-    response_servings = []
-    for s_orm in servings_orm:
-        meal_name_val = s_orm.meal.name if s_orm.meal else None
-        user_full_name_val = s_orm.served_by_user.full_name if s_orm.served_by_user else None
-        serving_data_dict = schemas.MealServing.model_validate(s_orm).model_dump()
-        serving_data_dict["meal_name"] = meal_name_val # Bu MealServing sxemasida allaqachon bo'lishi kerak (agar validation_alias ishlatilsa)
-        serving_data_dict["served_by_user_full_name"] = user_full_name_val # Bu ham
-        response_servings.append(schemas.MealServing(**serving_data_dict)) # Agar sxemada yo'q bo'lsa, bu xatolik beradi
-    # Yaxshiroq yechim: schemas.MealServing da meal_name va served_by_user_full_name uchun @computed_field yoki
-    # relationship larni to'g'ri yuklab, Pydantic avtomatik to'ldirishini ta'minlash.
-    # Hozircha, sxema ichida bu maydonlar yo'q deb faraz qilib, ularni qo'shmaymiz,
-    # CRUDda javobni boyitish kerak bo'ladi yoki sxemani moslashtirish kerak.
-    # Avvalgi kodda bu maydonlar sxemaga qo'shilgan edi, shuning uchun o'sha sxemani ishlatish kerak.
+    # meal va served_by_user so'rovda yuklangan - response_model ORM obyektlaridan to'ldiriladi
     return servings_orm # To'g'ridan-to'g'ri ORM obyektlarini qaytarish (agar sxema to'g'ri bo'lsa)
 
 
@@ -1,7 +1,8 @@
 # app/schemas.py
 from pydantic import BaseModel, Field, ConfigDict, computed_field
-from typing import List, Optional, Any, Union, Dict
+from typing import List, Optional, Any, Union, Dict, Literal
 from datetime import datetime, date
+import uuid
 
 # --- Asosiy sozlamalar uchun Pydantic V2 ConfigDict ---
 class BaseSchema(BaseModel):
@@ -29,6 +30,10 @@ class Role(RoleBase):
 class UnitBase(BaseSchema):
     name: str = Field(min_length=1, max_length=50, description="O'lchov birligi nomi (gramm, kilogramm)")
     short_name: str = Field(min_length=1, max_length=10, description="Qisqa nomi (gr, kg)")
+    dimension: Optional[Literal["mass", "volume", "count"]] = Field(
+        None, description="O'lcham (ko'rsatilmasa ma'lum birliklar uchun nomidan aniqlanadi)")
+    base_factor: Optional[float] = Field(
+        None, gt=0, description="O'lcham asosiy birligida qiymati: gramm, millilitr yoki dona (kg = 1000, qoshiq = 15)")
 
 class UnitCreate(UnitBase):
     pass
@@ -78,6 +83,7 @@ class TokenPayload(BaseSchema): # Token ichidagi ma'lumotlar (sub, scopes, exp)
     sub: Optional[str] = None # Username (subject)
     scopes: List[str]
     exp: Optional[int] = None
+    iat: Optional[int] = None # Token berilgan vaqt (auth keshi kaliti uchun)
 
 
 # --- Product Schemas ---
@@ -91,6 +97,7 @@ class ProductBase(BaseSchema):
     name: str = Field(min_length=2, max_length=100, description="Mahsulot nomi")
     unit_id: int = Field(description="Mahsulot o'lchov birligi IDsi") # <--- Mana bu kerak
     min_quantity: float = Field(gt=0, description="Ombordagi minimal miqdor (ogohlantirish uchun)") # <--- Mana bu ham kerak
+    density: Optional[float] = Field(None, gt=0, description="Zichlik, g/ml (hajm va og'irlik birliklari orasida konvertatsiya uchun)")
 
 class ProductCreate(ProductBase):
     pass
@@ -99,6 +106,7 @@ class ProductUpdate(BaseSchema): # Faqat o'zgarishi mumkin bo'lgan maydonlar
     name: Optional[str] = Field(None, min_length=2, max_length=100)
     unit_id: Optional[int] = None
     min_quantity: Optional[float] = Field(None, gt=0)
+    density: Optional[float] = Field(None, gt=0)
 
 class Product(ProductBase):
     id: int
@@ -154,6 +162,7 @@ class MealIngredientCreate(MealIngredientBase):
 
 class MealIngredient(MealIngredientBase): # Bu Meal sxemasi ichida ishlatiladi
     id: int # MealIngredient ning o'zining ID si
+    quantity_per_portion_base: Optional[float] = Field(None, description="1 porsiya uchun miqdor mahsulotning asosiy birligida")
     product: ProductBase # Faqat asosiy mahsulot ma'lumotlari
     unit: UnitBase # Faqat asosiy birlik ma'lumotlari
 
@@ -176,6 +185,7 @@ class MealUpdate(BaseSchema):
 class Meal(MealBase): # Javob uchun sxema
     id: int
     ingredients: List[MealIngredient] # To'liq ingredient ma'lumotlari bilan
+    current_recipe_version_id: Optional[int] = None # Amaldagi retsept versiyasi
     # created_by: Optional[int] = None
     created_by_user: Optional[UserBase] = None # Agar UserBase kerak bo'lsa
     created_at: datetime
@@ -191,6 +201,9 @@ class MealServingBase(BaseSchema):
 class MealServingCreate(MealServingBase):
     pass # served_by va served_at avtomatik
 
+class MealServingBatchCreate(BaseSchema): # Bir nechta ovqat berishni bitta tranzaksiyada qayd etish
+    servings: List[MealServingCreate] = Field(min_length=1, max_length=100, description="Ovqat berishlar ro'yxati")
+
 class ServingDetailBase(BaseSchema): # Bu MealServingWithDetails ichida ishlatiladi
     product_id: int
     quantity_used: float
@@ -203,6 +216,7 @@ class ServingDetail(ServingDetailBase):
 class MealServing(MealServingBase): # Javob uchun asosiy sxema
     id: int
     served_at: datetime
+    recipe_version_id: Optional[int] = None # Berilgan paytdagi retsept versiyasi
     meal: MealBase # To'liq meal o'rniga MealBase
     served_by_user: Optional[UserBase] = None
 
@@ -365,6 +379,19 @@ class NewMealServedPayload(BaseModel):
     message: str
     # consumed_ingredients: Optional[List[Dict[str, Any]]] = None # Agar kerak bo'lsa
 
+class ServedMealItem(BaseModel):
+    serving_id: int
+    meal_id: int
+    meal_name: str
+    portions_served: int
+
+class MealsBatchServedPayload(BaseModel): # Bitta batch uchun bitta WS xabari
+    servings: List[ServedMealItem]
+    total_portions_served: int
+    served_at: str # ISO format
+    served_by_user_name: str
+    message: str
+
 class GeneralNotificationPayload(BaseModel): # Umumiy bildirishnomalar uchun
     title: str
     body: str
@@ -374,10 +401,12 @@ class GeneralNotificationPayload(BaseModel): # Umumiy bildirishnomalar uchun
 class PossiblePortionsRecalculatedPayload(BaseModel):
     message: str
     recalculated_at: str # ISO format
+    meal_ids: Optional[List[int]] = None # None - barcha ovqatlar qayta hisoblangan
 
 class MealDefinitionUpdatedPayload(BaseModel): # Qo'shildi
     meal_id: int
     meal_name: str
+    changed_product_ids: List[int] = [] # Retseptda qo'shilgan, o'zgargan yoki olib tashlangan mahsulotlar
     message: str
 
 class ProductDeletedPayload(BaseModel): # Qo'shildi
@@ -392,6 +421,8 @@ class MealDeletedPayload(BaseModel): # Qo'shildi
 
 
 class WebSocketMessage(BaseModel):
+    # Unikal ID: workerlar bir xabarni ikki marta yetkazmasligi uchun (deduplikatsiya)
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     type: str = Field(description="Xabar turi")
     payload: Union[
         LowStockAlertPayload,
@@ -399,6 +430,7 @@ class WebSocketMessage(BaseModel):
         StockItemReceivedPayload,
         ProductDefinitionUpdatedPayload,
         NewMealServedPayload,
+        MealsBatchServedPayload,
         MealDefinitionUpdatedPayload, # Qo'shildi
         ProductDeletedPayload, # Qo'shildi
         MealDeletedPayload, # Qo'shildi
@@ -407,6 +439,11 @@ class WebSocketMessage(BaseModel):
         Dict[str, Any] # Umumiy holat uchun
     ]
     timestamp: datetime = Field(default_factory=datetime.now)
+    # Yo'naltirish (faqat server ichida, klientga yuborilmaydi). Ikkalasi ham None bo'lsa - hammaga.
+    topics: Optional[List[str]] = Field(None, description="Masalan: 'role:admin', 'product:5'")
+    user_ids: Optional[List[int]] = None
+    # Redis Stream entry IDsi (listener qo'yadi); klient qayta ulanishda `since` sifatida yuboradi
+    stream_id: Optional[str] = None
 
 
 class Msg(BaseSchema): # BaseSchema dan meros olish
@@ -473,6 +510,7 @@ class MonthlyReportBase(BaseSchema):
     total_portions_served_overall: Optional[int] = None
     is_overall_suspicious: Optional[bool] = None
     generated_at: datetime
+    is_final: bool = Field(False, description="Oy yopilgandan keyin generatsiya qilingan (keshdan qaytariladi)")
     # generated_by: Optional[int] = None # UserBase orqali qaytaramiz
 
 
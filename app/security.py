@@ -1,32 +1,65 @@
 # app/security.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Tuple
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import ValidationError  # TokenPayload validatsiyasi uchun
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 
 from app.config import settings
-from app.database import get_db
+from app import crud_async
+from app.database import get_async_db
 from app.models import User as UserModel, Role as RoleModel
 from app.schemas import TokenPayload, User as UserSchema  # User sxemasini ham olamiz
 
 # --- Parol xeshlash ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt__rounds: xesh raundlari shu qiymatdan farq qilsa, needs_update True bo'ladi (login paytida qayta xeshlanadi)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt bitta tekshiruvga ~250 ms CPU sarflaydi (GIL qo'yib yuboriladi). U event loopda emas, shu cheklangan
+# poolda bajariladi: login WebSocket va boshqa so'rovlarni to'xtatib qo'ymaydi, bir vaqtda ko'p login esa
+# barcha CPU ni egallab olmaydi (ortiqchasi navbatda kutadi).
+_password_executor = ThreadPoolExecutor(max_workers=max(1, settings.PASSWORD_HASH_WORKERS),
+                                        thread_name_prefix="password-hash")
 
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _password_executor.submit(pwd_context.verify, plain_password, hashed_password).result()
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    # Sinxron kod (def endpointlar, create_initial_data) uchun ham bcrypt cheklangan pool ichida bajariladi
+    return _password_executor.submit(pwd_context.hash, password).result()
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Parolni event loopni bloklamasdan tekshiradi.
+    Qaytaradi: (to'g'rimi, yangi_xesh). yangi_xesh - xesh parametrlari (BCRYPT_ROUNDS) o'zgargan bo'lsa, aks holda None.
+    """
+    return await asyncio.wrap_future(
+        _password_executor.submit(pwd_context.verify_and_update, plain_password, hashed_password))
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await asyncio.wrap_future(_password_executor.submit(pwd_context.hash, password))
+
+
+def shutdown_password_executor():
+    _password_executor.shutdown(wait=False, cancel_futures=True)
 
 
 # --- JWT Token sozlamalari ---
@@ -48,15 +81,87 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # iat: auth keshi kaliti (username, iat) uchun - yangi login har doim yangi yozuv oladi
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+# --- Autentifikatsiyalangan foydalanuvchi nusxasi va keshi ---
+@dataclass(frozen=True)
+class RoleSnapshot:
+    id: int
+    name: str
+    description: Optional[str]
+    created_at: datetime
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    get_current_user qaytaradigan o'zgarmas foydalanuvchi nusxasi. DB sessiyasiga bog'liq emas,
+    shuning uchun so'rovlar orasida keshlanadi. schemas.User ga (from_attributes) to'g'ridan-to'g'ri o'giriladi.
+    """
+    id: int
+    username: str
+    full_name: str
+    role_id: int
+    role: RoleSnapshot
+    is_active: bool
+    last_login: Optional[datetime]
+    created_at: datetime
+
+    @classmethod
+    def from_model(cls, user: UserModel) -> "AuthenticatedUser":
+        role = user.role
+        return cls(
+            id=user.id, username=user.username, full_name=user.full_name, role_id=user.role_id,
+            role=RoleSnapshot(id=role.id, name=role.name, description=role.description, created_at=role.created_at),
+            is_active=user.is_active, last_login=user.last_login, created_at=user.created_at,
+        )
+
+
+# (username, token iat) -> (amal qilish muddati, AuthenticatedUser). LRU tartibida, TTL bilan.
+# Har bir process (worker) o'z keshiga ega: update_user/soft_delete_user shu processda keshni darhol tozalaydi,
+# boshqa workerlarda eski nusxa ko'pi bilan AUTH_CACHE_TTL_SECONDS yashaydi.
+_auth_cache: "OrderedDict[Tuple[str, Optional[int]], Tuple[float, AuthenticatedUser]]" = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
+
+def _get_cached_auth_user(key: Tuple[str, Optional[int]]) -> Optional[AuthenticatedUser]:
+    with _auth_cache_lock:
+        entry = _auth_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, auth_user = entry
+        if expires_at < time.monotonic():
+            del _auth_cache[key]
+            return None
+        _auth_cache.move_to_end(key)
+        return auth_user
+
+
+def _store_auth_user(key: Tuple[str, Optional[int]], auth_user: AuthenticatedUser):
+    if settings.AUTH_CACHE_TTL_SECONDS <= 0:
+        return  # Kesh o'chirilgan
+    with _auth_cache_lock:
+        _auth_cache[key] = (time.monotonic() + settings.AUTH_CACHE_TTL_SECONDS, auth_user)
+        _auth_cache.move_to_end(key)
+        while len(_auth_cache) > settings.AUTH_CACHE_MAX_SIZE:
+            _auth_cache.popitem(last=False)
+
+
+def invalidate_user_auth_cache(user_id: int):
+    """Foydalanuvchi o'zgartirilganda/o'chirilganda uning barcha keshlangan nusxalarini o'chiradi."""
+    with _auth_cache_lock:
+        for key in [k for k, (_, auth_user) in _auth_cache.items() if auth_user.id == user_id]:
+            del _auth_cache[key]
+
+
 # --- Tokenni tekshirish va foydalanuvchini olish ---
 def get_user_by_username_for_auth(db: Session, username: str) -> Optional[UserModel]:
-    # Bu funksiya faqat aktiv va o'chirilmagan userlarni qaytarishi kerak
-    return db.query(UserModel).filter(
+    # Bu funksiya faqat aktiv va o'chirilmagan userlarni qaytarishi kerak (rol bilan bitta so'rovda)
+    return db.query(UserModel).options(joinedload(UserModel.role)).filter(
         UserModel.username == username,
         UserModel.is_active == True,  # Faqat aktiv
         UserModel.deleted_at == None  # O'chirilmagan
@@ -65,42 +170,41 @@ def get_user_by_username_for_auth(db: Session, username: str) -> Optional[UserMo
 
 async def get_current_user(
         security_scopes: SecurityScopes,  # Endpoint uchun talab qilingan rollar
+        request: Request,
         token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-) -> UserModel:
+        db: AsyncSession = Depends(get_async_db)
+) -> AuthenticatedUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
-        username: Optional[str] = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-
-        # Token ichidagi rollarni olish
-        token_scopes = payload.get("scopes", [])  # Bu ro'yxat bo'lishi kerak
-
-        # Pydantic orqali payloadni validatsiya qilish (ixtiyoriy, lekin yaxshi amaliyot)
-        try:
-            token_data = TokenPayload(sub=username, scopes=token_scopes, exp=payload.get("exp"))
-        except ValidationError:
-            raise credentials_exception
-
-    except JWTError:  # Token yaroqsiz, muddati o'tgan yoki boshqa JWT xatoliklari
-        raise credentials_exception
-
-    user = get_user_by_username_for_auth(db, username=token_data.sub)
-    if user is None:  # Foydalanuvchi topilmadi, aktiv emas yoki o'chirilgan
-        raise credentials_exception
+    # Bir so'rov ichida (turli scopes bilan bir necha marta chaqirilsa) foydalanuvchi qayta aniqlanmaydi
+    memo = getattr(request.state, "auth_user_memo", None)
+    if memo is not None and memo[0] == token:
+        user = memo[1]
+        token_data = None
+    else:
+        user, token_data = None, _decode_token(token, credentials_exception)
+
+    if user is None:
+        cache_key = (token_data.sub, token_data.iat)
+        user = _get_cached_auth_user(cache_key)
+        if user is None:
+            # AsyncSession: event loop ham, threadpool ham band qilinmaydi (kesh topilganda esa umuman so'rov yo'q)
+            db_user = await crud_async.get_active_user_by_username(db, username=token_data.sub)
+            if db_user is None:  # Foydalanuvchi topilmadi, aktiv emas yoki o'chirilgan
+                raise credentials_exception
+            user = AuthenticatedUser.from_model(db_user)
+            _store_auth_user(cache_key, user)
+        request.state.auth_user_memo = (token, user)
 
     # --- Rol tekshiruvi (SecurityScopes) ---
     # Agar endpoint uchun maxsus rollar (scopes) talab qilinsa
     if security_scopes.scopes:
         # Foydalanuvchining roli token ichidagi scopes bilan mos kelishi kerak
         # Yoki DBdagi roli bilan
-        user_role_name = user.role.name  # DBdagi haqiqiy rol
+        user_role_name = user.role.name  # DBdagi haqiqiy rol (keshlangan nusxa)
 
         # Token ichidagi scopes (rollar) ham to'g'ri bo'lishi kerak
         # Bu qismni kuchaytirish mumkin: token scopes DBdagi rolga mos keladimi?
@@ -122,9 +226,31 @@ async def get_current_user(
     return user
 
 
+def _decode_token(token: str, credentials_exception: HTTPException) -> TokenPayload:
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+        username: Optional[str] = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+
+        # Token ichidagi rollarni olish
+        token_scopes = payload.get("scopes", [])  # Bu ro'yxat bo'lishi kerak
+
+        # Pydantic orqali payloadni validatsiya qilish (ixtiyoriy, lekin yaxshi amaliyot)
+        try:
+            token_data = TokenPayload(sub=username, scopes=token_scopes, exp=payload.get("exp"), iat=payload.get("iat"))
+        except ValidationError:
+            raise credentials_exception
+
+    except JWTError:  # Token yaroqsiz, muddati o'tgan yoki boshqa JWT xatoliklari
+        raise credentials_exception
+
+    return token_data
+
+
 # --- Faol foydalanuvchini olish (rol tekshiruvisiz, faqat autentifikatsiya) ---
 # Bu asosan /auth/me kabi endpointlar uchun ishlatiladi
-async def get_current_active_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_active_user(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     # get_current_user ichida is_active allaqachon get_user_by_username_for_auth orqali tekshirilgan.
     # Agar get_user_by_username_for_auth is_active ni tekshirmasa, bu yerda qo'shimcha tekshiruv kerak.
     # Hozirgi holatda, bu funksiya deyarli ortiqcha, lekin aniqlik uchun qoldiramiz.
@@ -149,7 +275,7 @@ def require_role(required_roles: Union[str, List[str]]):
         required_roles_list = required_roles
 
     async def role_checker(
-            current_user_for_role_check: UserModel = Depends(get_current_user)):  # security_scopes bu yerda kerak emas
+            current_user_for_role_check: AuthenticatedUser = Depends(get_current_user)):  # security_scopes bu yerda kerak emas
         # get_current_user ichida scopes tekshirilmaydi, faqat token validatsiyasi va user mavjudligi
         # Rolni bu yerda alohida tekshiramiz
         user_role_name = current_user_for_role_check.role.name
@@ -165,7 +291,7 @@ def require_role(required_roles: Union[str, List[str]]):
     return role_checker
 
 
-async def get_current_admin_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_admin_user(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     # get_current_user endpoint uchun kerakli scopes bilan chaqirilishi kerak
     # Buni routerda `dependencies=[Security(get_current_user, scopes=[settings.ADMIN_ROLE_NAME])]`
     # orqali qilish mumkin. Yoki bu yerda qo'lda tekshirish:
@@ -177,7 +303,7 @@ async def get_current_admin_user(current_user: UserModel = Depends(get_current_u
     return current_user  # is_active allaqachon get_current_user da tekshirilgan
 
 
-async def get_current_manager_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_manager_user(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     # Admin ham menejer ishlarini qila oladi
     if current_user.role.name not in [settings.MANAGER_ROLE_NAME, settings.ADMIN_ROLE_NAME]:
         raise HTTPException(
@@ -187,7 +313,7 @@ async def get_current_manager_user(current_user: UserModel = Depends(get_current
     return current_user
 
 
-async def get_current_chef_user(current_user: UserModel = Depends(get_current_user)) -> UserModel:
+async def get_current_chef_user(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     # Admin ham oshpaz ishlarini qila oladi (agar kerak bo'lsa)
     # Yoki qat'iyroq: current_user.role.name == settings.CHEF_ROLE_NAME
     if current_user.role.name not in [settings.CHEF_ROLE_NAME, settings.ADMIN_ROLE_NAME,
@@ -0,0 +1,196 @@
+# app/tasks/dispatch.py
+# Porsiyalarni qayta hisoblash va qoldiq tekshiruvlarini birlashtiruvchi (coalescing) dispetcher.
+# Har bir yozuv (ovqat berish, kirim, ...) alohida Celery task yubormaydi: o'zgargan IDlar Redisdagi
+# "dirty" to'plamlarga qo'shiladi va oyna (PORTION_RECALC_DEBOUNCE_SECONDS) uchun faqat bitta
+# kechiktirilgan flush task rejalashtiriladi. Flush task IDlarni o'zining "processing" to'plamiga ko'chirib, hammasini
+# bir marta hisoblaydi va faqat ish muvaffaqiyatli tugagach o'chiradi.
+from typing import Iterable, Dict
+
+from app.celery_config import celery_app, redis_client_for_celery_config as redis_client
+from app.config import settings
+from app.database import SessionLocal
+from app import crud
+from app.tasks.portion_tasks import task_update_possible_portions_for_products_celery, \
+    task_update_possible_portions_for_meals_celery, task_check_product_stock_and_notify_celery, \
+    check_product_stock_and_notify, publish_portions_recalculated
+
+DIRTY_PRODUCTS_KEY = "kindergarten:dispatch:dirty_products"  # Porsiyalari qayta hisoblanadigan mahsulotlar
+DIRTY_MEALS_KEY = "kindergarten:dispatch:dirty_meals"  # Retsepti o'zgargan ovqatlar
+DIRTY_STOCK_CHECK_KEY = "kindergarten:dispatch:dirty_stock_check"  # Qoldig'i tekshiriladigan mahsulotlar
+FLUSH_SCHEDULED_KEY = "kindergarten:dispatch:flush_scheduled"  # Oynada flush allaqachon rejalashtirilganmi
+METRICS_KEY = "kindergarten:dispatch:metrics"
+# Flush olgan IDlar "<dirty kalit>:processing:<task id>" da ish tugaguncha saqlanadi. Muddat - task hech qachon qayta
+# yetkazilmasa (broker yo'qotsa) kalit abadiy qolib ketmasligi uchun
+PROCESSING_KEY_TTL_SECONDS = 24 * 3600
+
+METRIC_FIELDS = ("triggers_total", "triggers_absorbed", "flushes_scheduled", "flushes_run",
+                 "products_recalculated", "meals_recalculated", "stock_checks_run", "fallback_dispatches")
+
+
+def _mark_dirty(dirty_key: str, ids: Iterable[int]) -> bool:
+    """
+    IDlarni dirty to'plamga qo'shadi va oyna uchun bitta flush taskni rejalashtiradi.
+    Redis mavjud bo'lmasa False qaytaradi (chaqiruvchi to'g'ridan-to'g'ri task yuboradi).
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return True
+    if redis_client is None:
+        return False
+    try:
+        window = max(settings.PORTION_RECALC_DEBOUNCE_SECONDS, 1)
+        pipe = redis_client.pipeline()
+        pipe.sadd(dirty_key, *ids)
+        pipe.hincrby(METRICS_KEY, "triggers_total", 1)
+        # Flush bajarilmay qolsa (worker o'chgan) kalit baribir muddati tugab o'chadi
+        pipe.set(FLUSH_SCHEDULED_KEY, "1", nx=True, ex=window * 10)
+        _, _, is_first_in_window = pipe.execute()
+
+        if is_first_in_window:
+            task_flush_dirty_portion_recalcs_celery.apply_async(countdown=window)
+            redis_client.hincrby(METRICS_KEY, "flushes_scheduled", 1)
+        else:
+            redis_client.hincrby(METRICS_KEY, "triggers_absorbed", 1)
+        return True
+    except Exception as e:
+        print(f"WARN:     Coalescing dispatch failed for '{dirty_key}', falling back to direct tasks: {e}")
+        return False
+
+
+def schedule_portion_recalc_for_products(product_ids: Iterable[int]) -> None:
+    """Qoldig'i o'zgargan mahsulotlarga bog'liq ovqatlar porsiyalarini (oyna oxirida) qayta hisoblash."""
+    product_ids = sorted(set(product_ids))
+    if not _mark_dirty(DIRTY_PRODUCTS_KEY, product_ids) and product_ids:
+        _record_fallback()
+        task_update_possible_portions_for_products_celery.delay(product_ids)
+
+
+def schedule_portion_recalc_for_meals(meal_ids: Iterable[int]) -> None:
+    """Berilgan ovqatlar porsiyalarini (oyna oxirida) qayta hisoblash."""
+    meal_ids = sorted(set(meal_ids))
+    if not _mark_dirty(DIRTY_MEALS_KEY, meal_ids) and meal_ids:
+        _record_fallback()
+        task_update_possible_portions_for_meals_celery.delay(meal_ids)
+
+
+def schedule_stock_check(product_ids: Iterable[int]) -> None:
+    """Mahsulotlar qoldig'ini (oyna oxirida) minimal miqdor bilan solishtirish."""
+    product_ids = sorted(set(product_ids))
+    if not _mark_dirty(DIRTY_STOCK_CHECK_KEY, product_ids) and product_ids:
+        _record_fallback()
+        for product_id in product_ids:
+            task_check_product_stock_and_notify_celery.delay(product_id)
+
+
+def _record_fallback() -> None:
+    if redis_client is None:
+        return
+    try:
+        redis_client.hincrby(METRICS_KEY, "fallback_dispatches", 1)
+    except Exception:
+        pass
+
+
+def _processing_key(dirty_key: str, task_id: str) -> str:
+    return f"{dirty_key}:processing:{task_id}"
+
+
+def _claim(dirty_key: str, task_id: str) -> set:
+    """
+    Dirty IDlarni shu taskning processing to'plamiga ko'chiradi (bitta tranzaksiyada) va uning a'zolarini qaytaradi.
+    Worker flush o'rtasida o'chsa (task_acks_late), qayta yetkazilgan task xuddi shu task id bilan avvalgi
+    processing to'plamini ham oladi - IDlar yo'qolmaydi. Shu orada qo'shilgan IDlar keyingi flushga qoladi.
+    """
+    processing_key = _processing_key(dirty_key, task_id)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.sunionstore(processing_key, [processing_key, dirty_key])
+    pipe.delete(dirty_key)
+    pipe.expire(processing_key, PROCESSING_KEY_TTL_SECONDS)
+    pipe.smembers(processing_key)
+    *_, members = pipe.execute()
+    return {int(m) for m in members}
+
+
+def _release(dirty_key: str, task_id: str, requeue: bool = False) -> None:
+    """Processing to'plamini o'chiradi; `requeue=True` - IDlar dirty to'plamga qaytariladi (retry/keyingi flush)."""
+    processing_key = _processing_key(dirty_key, task_id)
+    pipe = redis_client.pipeline(transaction=True)
+    if requeue:
+        pipe.sunionstore(dirty_key, [dirty_key, processing_key])
+    pipe.delete(processing_key)
+    pipe.execute()
+
+
+def get_dispatch_metrics() -> Dict[str, int]:
+    """Dispetcher hisoblagichlari va hozirgi kutilayotgan (dirty) IDlar soni."""
+    metrics = {field: 0 for field in METRIC_FIELDS}
+    metrics.update({"pending_products": 0, "pending_meals": 0, "pending_stock_checks": 0})
+    if redis_client is None:
+        return metrics
+    pipe = redis_client.pipeline()
+    pipe.hgetall(METRICS_KEY)
+    pipe.scard(DIRTY_PRODUCTS_KEY)
+    pipe.scard(DIRTY_MEALS_KEY)
+    pipe.scard(DIRTY_STOCK_CHECK_KEY)
+    stored, pending_products, pending_meals, pending_stock_checks = pipe.execute()
+    metrics.update({k: int(v) for k, v in stored.items()})
+    metrics.update({"pending_products": pending_products, "pending_meals": pending_meals,
+                    "pending_stock_checks": pending_stock_checks})
+    return metrics
+
+
+@celery_app.task(
+    name="kindergarten.dispatch.flush",
+    bind=True,
+    autoretry_for=(Exception,),
+    max_retries=3,
+    default_retry_delay=30
+)
+def task_flush_dirty_portion_recalcs_celery(self):
+    """
+    Celery task: Oyna davomida to'plangan dirty mahsulot/ovqat IDlarini oladi,
+    ularga bog'liq ovqatlar porsiyalarini bitta o'tishda qayta hisoblaydi va
+    har bir mahsulot qoldig'ini bir marta tekshiradi. IDlar Redisdan faqat ish tugagach o'chiriladi.
+    """
+    db = None
+    task_id = self.request.id
+    # Bayroq avval o'chiriladi: flush davomida kelgan triggerlar yangi flush rejalashtiradi
+    redis_client.delete(FLUSH_SCHEDULED_KEY)
+    product_ids = _claim(DIRTY_PRODUCTS_KEY, task_id)
+    meal_ids = _claim(DIRTY_MEALS_KEY, task_id)
+    stock_check_ids = _claim(DIRTY_STOCK_CHECK_KEY, task_id)
+    try:
+        db = SessionLocal()
+        print(
+            f"CELERY_TASK: [{task_flush_dirty_portion_recalcs_celery.name}] - Flushing {len(product_ids)} product(s), {len(meal_ids)} meal(s), {len(stock_check_ids)} stock check(s)...")
+
+        meal_ids_to_update = meal_ids | set(crud.get_meal_ids_using_products(db, product_ids))
+        if meal_ids_to_update:
+            crud.update_possible_meal_portions_for_meals(db, meal_ids_to_update)  # O'zi commit qiladi
+            publish_portions_recalculated(sorted(meal_ids_to_update),
+                                          f"{len(meal_ids_to_update)} ta ovqat uchun mumkin bo'lgan porsiyalar qayta hisoblandi.")
+
+        for product_id in sorted(stock_check_ids):
+            check_product_stock_and_notify(db, product_id, task_flush_dirty_portion_recalcs_celery.name)
+
+        for dirty_key in (DIRTY_PRODUCTS_KEY, DIRTY_MEALS_KEY, DIRTY_STOCK_CHECK_KEY):
+            _release(dirty_key, task_id)
+
+        pipe = redis_client.pipeline()
+        pipe.hincrby(METRICS_KEY, "flushes_run", 1)
+        pipe.hincrby(METRICS_KEY, "products_recalculated", len(product_ids))
+        pipe.hincrby(METRICS_KEY, "meals_recalculated", len(meal_ids_to_update))
+        pipe.hincrby(METRICS_KEY, "stock_checks_run", len(stock_check_ids))
+        pipe.execute()
+        return {"status": "success", "meal_ids": sorted(meal_ids_to_update),
+                "stock_checked_product_ids": sorted(stock_check_ids)}
+    except Exception as e:
+        if db: db.rollback()
+        print(f"CELERY_TASK_ERROR: [{task_flush_dirty_portion_recalcs_celery.name}] - {str(e)}")
+        # Olingan IDlarni qaytarib qo'yamiz, retry (yoki keyingi flush) ularni qayta ishlaydi
+        for dirty_key in (DIRTY_PRODUCTS_KEY, DIRTY_MEALS_KEY, DIRTY_STOCK_CHECK_KEY):
+            _release(dirty_key, task_id, requeue=True)
+        raise
+    finally:
+        if db:
+            db.close()
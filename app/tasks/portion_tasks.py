@@ -1,8 +1,9 @@
 # app/tasks/portion_tasks.py
-from app.celery_config import celery_app, redis_client_for_celery_config as redis_client, WS_MESSAGE_CHANNEL
+from app.celery_config import celery_app
 from app.database import SessionLocal
 from app import crud, schemas
-from app.schemas import WebSocketMessage
+from app.config import settings
+from app.websockets.publisher import publish_ws_message, staff_topics, product_watcher_topics
 from datetime import datetime
 import json  # Redisga yuborish uchun
 
@@ -30,8 +31,7 @@ def task_update_all_possible_meal_portions_celery():
         # Yangilangan porsiyalar haqida umumiy WS xabari (Redis orqali)
         ws_payload = {"message": "Barcha ovqatlar uchun mumkin bo'lgan porsiyalar qayta hisoblandi.",
                       "recalculated_at": datetime.now().isoformat()}
-        ws_message_obj = WebSocketMessage(type="possible_portions_recalculated", payload=ws_payload)
-        redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj.model_dump_json())  # Pydantic V2 da .model_dump_json()
+        publish_ws_message("possible_portions_recalculated", ws_payload)
 
         return {"status": "success", "message": "Possible meal portions recalculated and notification sent."}
     except Exception as e:
@@ -43,6 +43,116 @@ def task_update_all_possible_meal_portions_celery():
             db.close()
 
 
+def publish_portions_recalculated(meal_ids, message: str):
+    # Qayta hisoblangan ovqatlar haqida WS xabari (Redis orqali)
+    ws_payload = schemas.PossiblePortionsRecalculatedPayload(
+        message=message,
+        recalculated_at=datetime.now().isoformat(),
+        meal_ids=meal_ids
+    )
+    publish_ws_message("possible_portions_recalculated", ws_payload)
+
+
+@celery_app.task(
+    name="kindergarten.portions.update_for_products",
+    autoretry_for=(Exception,),
+    max_retries=3,
+    default_retry_delay=60
+)
+def task_update_possible_portions_for_products_celery(product_ids: list):
+    """
+    Celery task: Faqat qoldig'i o'zgargan mahsulotlar ishlatiladigan ovqatlar uchun
+    `PossibleMeals` ni qayta hisoblaydi (meal_ingredients bo'yicha teskari indeks).
+    """
+    db = None
+    try:
+        db = SessionLocal()
+        print(f"CELERY_TASK: [{task_update_possible_portions_for_products_celery.name}] - Running for products {product_ids}...")
+        meal_ids = crud.update_possible_meal_portions_for_products(db, product_ids)  # O'zi commit qiladi
+        print(
+            f"CELERY_TASK: [{task_update_possible_portions_for_products_celery.name}] - {len(meal_ids)} meal(s) recalculated.")
+        if meal_ids:
+            publish_portions_recalculated(meal_ids, f"{len(meal_ids)} ta ovqat uchun mumkin bo'lgan porsiyalar qayta hisoblandi.")
+        return {"status": "success", "meal_ids": meal_ids}
+    except Exception as e:
+        if db: db.rollback()
+        print(f"CELERY_TASK_ERROR: [{task_update_possible_portions_for_products_celery.name}] - {str(e)}")
+        raise
+    finally:
+        if db:
+            db.close()
+
+
+@celery_app.task(
+    name="kindergarten.portions.update_for_meals",
+    autoretry_for=(Exception,),
+    max_retries=3,
+    default_retry_delay=60
+)
+def task_update_possible_portions_for_meals_celery(meal_ids: list):
+    """
+    Celery task: Berilgan ovqatlar (retsepti o'zgargan, yaratilgan yoki o'chirilgan) uchun
+    `PossibleMeals` ni qayta hisoblaydi.
+    """
+    db = None
+    try:
+        db = SessionLocal()
+        print(f"CELERY_TASK: [{task_update_possible_portions_for_meals_celery.name}] - Running for meals {meal_ids}...")
+        recalculated_meal_ids = crud.update_possible_meal_portions_for_meals(db, meal_ids)  # O'zi commit qiladi
+        publish_portions_recalculated(list(meal_ids), f"{len(meal_ids)} ta ovqat uchun mumkin bo'lgan porsiyalar qayta hisoblandi.")
+        return {"status": "success", "meal_ids": recalculated_meal_ids}
+    except Exception as e:
+        if db: db.rollback()
+        print(f"CELERY_TASK_ERROR: [{task_update_possible_portions_for_meals_celery.name}] - {str(e)}")
+        raise
+    finally:
+        if db:
+            db.close()
+
+
+def check_product_stock_and_notify(db, product_id: int, task_name: str) -> dict:
+    """
+    Berilgan mahsulot qoldig'ini tekshiradi; minimaldan kam bo'lsa DBga bildirishnoma yozadi
+    va Redis orqali "low_stock_alert" xabarini yuboradi. Sessiyani yopmaydi.
+    """
+    product = crud.get_product(db, product_id)  # deleted_at == None tekshiriladi
+    if not product:
+        print(f"CELERY_TASK_WARN: [{task_name}] - Product {product_id} not found.")
+        return {"status": "error", "message": "Product not found", "product_id": product_id}
+
+    current_quantity = crud.get_product_current_quantity(db, product_id)
+
+    if current_quantity < product.min_quantity:
+        print(f"CELERY_TASK: [{task_name}] - Low stock detected for product {product.name} (ID: {product_id}).")
+        # 1. DBga Notification yozish
+        db_notification = crud.create_low_stock_db_notification(db, product, current_quantity)
+        # create_low_stock_db_notification o'zi commit qiladi (agar kerak bo'lsa) yoki bu yerda commit
+        # crud.create_low_stock_db_notification qaytargan notification obyektini ishlatamiz
+        db_notification_id = db_notification.id if db_notification else None
+
+        # 2. Redis Stream orqali WebSocket uchun xabar yuborish
+        message_text_for_ws = f"DIQQAT! '{product.name}' mahsuloti kam qoldi. Joriy miqdor: {current_quantity:.2f} {product.unit.short_name} (Minimal: {product.min_quantity} {product.unit.short_name})."
+        ws_payload = schemas.LowStockAlertPayload(  # Maxsus payload sxemasidan foydalanish
+            product_id=product.id,
+            product_name=product.name,
+            current_quantity=current_quantity,
+            min_quantity=product.min_quantity,
+            unit=product.unit.short_name,
+            message=message_text_for_ws,
+            notification_id=db_notification_id
+        )
+        # Faqat admin/menejerlar va shu mahsulotni kuzatayotgan ulanishlarga
+        publish_ws_message("low_stock_alert", ws_payload,
+                           topics=staff_topics(settings.ADMIN_ROLE_NAME, settings.MANAGER_ROLE_NAME)
+                           + product_watcher_topics([product.id]))
+        print(f"CELERY_TASK: [{task_name}] - Low stock alert for product {product.name} sent to Redis.")
+        return {"status": "success", "alert_sent": True, "product_id": product_id}
+    else:
+        print(
+            f"CELERY_TASK: [{task_name}] - Stock for product {product.name} (ID: {product_id}) is sufficient.")
+        return {"status": "success", "alert_sent": False, "product_id": product_id}
+
+
 @celery_app.task(
     name="kindergarten.stock.check_and_notify",  # Unikalroq nom
     autoretry_for=(Exception,),
@@ -60,43 +170,7 @@ def task_check_product_stock_and_notify_celery(product_id: int):
         db = SessionLocal()
         print(
             f"CELERY_TASK: [{task_check_product_stock_and_notify_celery.name}] - Checking stock for product_id: {product_id}")
-        product = crud.get_product(db, product_id)  # deleted_at == None tekshiriladi
-        if not product:
-            print(
-                f"CELERY_TASK_WARN: [{task_check_product_stock_and_notify_celery.name}] - Product {product_id} not found.")
-            return {"status": "error", "message": "Product not found", "product_id": product_id}
-
-        current_quantity = crud.get_product_current_quantity(db, product_id)
-
-        if current_quantity < product.min_quantity:
-            print(
-                f"CELERY_TASK: [{task_check_product_stock_and_notify_celery.name}] - Low stock detected for product {product.name} (ID: {product_id}).")
-            # 1. DBga Notification yozish
-            db_notification = crud.create_low_stock_db_notification(db, product, current_quantity)
-            # create_low_stock_db_notification o'zi commit qiladi (agar kerak bo'lsa) yoki bu yerda commit
-            # crud.create_low_stock_db_notification qaytargan notification obyektini ishlatamiz
-            db_notification_id = db_notification.id if db_notification else None
-
-            # 2. Redis Pub/Sub orqali WebSocket uchun xabar yuborish
-            message_text_for_ws = f"DIQQAT! '{product.name}' mahsuloti kam qoldi. Joriy miqdor: {current_quantity:.2f} {product.unit.short_name} (Minimal: {product.min_quantity} {product.unit.short_name})."
-            ws_payload = schemas.LowStockAlertPayload(  # Maxsus payload sxemasidan foydalanish
-                product_id=product.id,
-                product_name=product.name,
-                current_quantity=current_quantity,
-                min_quantity=product.min_quantity,
-                unit=product.unit.short_name,
-                message=message_text_for_ws,
-                notification_id=db_notification_id
-            )
-            ws_message_obj = WebSocketMessage(type="low_stock_alert", payload=ws_payload)  # To'g'ri payload bilan
-            redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj.model_dump_json())
-            print(
-                f"CELERY_TASK: [{task_check_product_stock_and_notify_celery.name}] - Low stock alert for product {product.name} sent to Redis.")
-            return {"status": "success", "alert_sent": True, "product_id": product_id}
-        else:
-            print(
-                f"CELERY_TASK: [{task_check_product_stock_and_notify_celery.name}] - Stock for product {product.name} (ID: {product_id}) is sufficient.")
-            return {"status": "success", "alert_sent": False, "product_id": product_id}
+        return check_product_stock_and_notify(db, product_id, task_check_product_stock_and_notify_celery.name)
     except Exception as e:
         if db: db.rollback()  # Agar create_low_stock_db_notification o'zi commit qilmasa
         print(
@@ -104,4 +178,34 @@ def task_check_product_stock_and_notify_celery(product_id: int):
         raise
     finally:
         if db:
-            db.close()
\ No newline at end of file
+            db.close()
+
+@celery_app.task(
+    name="kindergarten.stock.reconcile",
+    autoretry_for=(Exception,),
+    max_retries=2,
+    default_retry_delay=300
+)
+def task_reconcile_product_stock_celery(fix: bool = True):
+    """
+    Celery task: `product_stock` balanslarini kirim/sarf jurnallaridan qayta hisoblab solishtiradi.
+    Farq (drift) topilsa, uni logga yozadi va (`fix=True` bo'lsa) balansni tuzatadi.
+    """
+    db = None
+    try:
+        db = SessionLocal()
+        print(f"CELERY_TASK: [{task_reconcile_product_stock_celery.name}] - Reconciling product stock balances...")
+        drift_entries = crud.rebuild_product_stock(db, fix=fix)
+        for entry in drift_entries:
+            print(
+                f"CELERY_TASK_WARN: [{task_reconcile_product_stock_celery.name}] - Stock drift for product {entry['product_id']}: stored={entry['stored_quantity']}, ledger={entry['ledger_quantity']:.3f}")
+        print(
+            f"CELERY_TASK: [{task_reconcile_product_stock_celery.name}] - Done. {len(drift_entries)} product(s) with drift{' fixed' if fix else ''}.")
+        return {"status": "success", "drift_count": len(drift_entries), "fixed": fix}
+    except Exception as e:
+        if db: db.rollback()
+        print(f"CELERY_TASK_ERROR: [{task_reconcile_product_stock_celery.name}] - {str(e)}")
+        raise
+    finally:
+        if db:
+            db.close()
@@ -1,10 +1,11 @@
 # app/tasks/report_tasks.py
 from typing import Optional
 
-from app.celery_config import celery_app, redis_client_for_celery_config as redis_client, WS_MESSAGE_CHANNEL
+from app.celery_config import celery_app
 from app.database import SessionLocal
-from app import crud, models, schemas  # schemas.py dan WebSocketMessage ni olish uchun
-from app.schemas import WebSocketMessage
+from app import crud, models, schemas
+from app.config import settings
+from app.websockets.publisher import publish_ws_message, staff_topics
 from datetime import datetime, timedelta
 import json
 
@@ -15,12 +16,14 @@ import json
     max_retries=2,  # Hisobot generatsiyasi og'irroq bo'lishi mumkin, kamroq retry
     default_retry_delay=60 * 5  # 5 daqiqadan keyin
 )
-def task_generate_monthly_report_celery(year: int, month: int, triggered_by_user_id: Optional[int] = None):
+def task_generate_monthly_report_celery(year: int, month: int, triggered_by_user_id: Optional[int] = None,
+                                       force: bool = False):
     """
     Celery task: Belgilangan yil va oy uchun oylik hisobotni generatsiya qiladi.
     Agar hisobot shubhali bo'lsa, DBga bildirishnoma yozadi va Redis orqali
     WebSocket uchun "suspicious_report_alert" xabarini yuboradi.
     `triggered_by_user_id` agar qo'lda ishga tushirilgan bo'lsa, kim tomonidanligini bildiradi.
+    Final (yopilgan oy) hisobot `force` berilmasa qayta hisoblanmaydi va ogohlantirish qayta yuborilmaydi.
     """
     db = None
     try:
@@ -29,7 +32,16 @@ def task_generate_monthly_report_celery(year: int, month: int, triggered_by_user
             f"CELERY_TASK: [{task_generate_monthly_report_celery.name}] - Starting monthly report generation for {year}-{month:02d}...")
 
         # Bu funksiya DBga yozadi va MonthlyReport obyektini qaytaradi
-        db_report = crud.generate_monthly_report_db_only(db, year, month, triggered_by_user_id)
+        existing_report_id = db.query(models.MonthlyReport.id).filter(
+            models.MonthlyReport.report_month == datetime(year, month, 1).date(),
+            models.MonthlyReport.is_final == True
+        ).scalar()
+        db_report = crud.generate_monthly_report_db_only(db, year, month, triggered_by_user_id, force=force)
+
+        if db_report and not force and db_report.id == existing_report_id:
+            print(
+                f"CELERY_TASK: [{task_generate_monthly_report_celery.name}] - Report for {year}-{month:02d} is final (ID: {db_report.id}), not regenerated.")
+            return {"status": "cached", "report_id": db_report.id, "is_suspicious": db_report.is_overall_suspicious}
 
         if db_report:
             is_suspicious = db_report.is_overall_suspicious
@@ -43,7 +55,7 @@ def task_generate_monthly_report_celery(year: int, month: int, triggered_by_user
                 # create_suspicious_report_db_notifications o'zi commit qiladi (agar kerak bo'lsa)
                 # yoki bu yerda commit
 
-                # 2. Redis Pub/Sub orqali WebSocket uchun xabar yuborish
+                # 2. Redis Stream orqali WebSocket uchun xabar yuborish
                 message_text_for_ws = f"DIQQAT! {db_report.report_month.strftime('%B %Y')} oyi uchun hisobotda katta farq ({db_report.difference_percentage:.2f}%) aniqlandi. Iltimos, tekshiring."
                 ws_payload = schemas.SuspiciousReportAlertPayload(
                     report_id=db_report.id,
@@ -52,8 +64,8 @@ def task_generate_monthly_report_celery(year: int, month: int, triggered_by_user
                     message=message_text_for_ws
                     # notification_ids=[n.id for n in created_db_notifications] # Agar kerak bo'lsa
                 )
-                ws_message_obj = WebSocketMessage(type="suspicious_report_alert", payload=ws_payload)
-                redis_client.publish(WS_MESSAGE_CHANNEL, ws_message_obj.model_dump_json())
+                # DB bildirishnomalari kabi faqat adminlarga
+                publish_ws_message("suspicious_report_alert", ws_payload, topics=staff_topics(settings.ADMIN_ROLE_NAME))
                 print(
                     f"CELERY_TASK: [{task_generate_monthly_report_celery.name}] - Suspicious report alert for {db_report.report_month.strftime('%Y-%m')} sent to Redis.")
 
@@ -0,0 +1,108 @@
+# app/unit_conversion.py
+# O'lchov birliklari konvertatsiyasi ma'lumotlar asosida: har bir birlik o'lchami (dimension) va shu o'lcham asosiy
+# birligidagi koeffitsiyentini (base_factor) saqlaydi (mass - gramm, volume - millilitr, count - dona).
+# Barcha (unit_id, unit_id) juftliklari uchun koeffitsiyentlar bir marta hisoblanib processda keshlanadi - servis va
+# porsiya hisobidagi har bir konvertatsiya butun sonli kalit bo'yicha O(1) lookup.
+# Hajm <-> og'irlik konvertatsiyasi (masalan, retseptda "qoshiq", omborda "kg") faqat mahsulot zichligi
+# (Product.density, g/ml) berilgan bo'lsa bajariladi.
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app import models
+
+DIMENSION_MASS = "mass"  # Asosiy birlik: gramm
+DIMENSION_VOLUME = "volume"  # Asosiy birlik: millilitr
+DIMENSION_COUNT = "count"  # Asosiy birlik: dona
+DIMENSIONS = (DIMENSION_MASS, DIMENSION_VOLUME, DIMENSION_COUNT)
+
+# Ma'lum birliklar (nomi yoki qisqa nomi, kichik harflarda) -> (o'lcham, koeffitsiyent).
+# Birlik yaratishda o'lcham/koeffitsiyent ko'rsatilmasa shu yerdan olinadi.
+KNOWN_UNITS: Dict[str, Tuple[str, float]] = {
+    **{alias: (DIMENSION_MASS, 1.0) for alias in ("gr", "gramm", "g", "грамм", "гр")},
+    **{alias: (DIMENSION_MASS, 1000.0) for alias in ("kg", "kilogramm", "килограмм", "кг")},
+    **{alias: (DIMENSION_VOLUME, 1.0) for alias in ("ml", "millilitr", "мл", "миллилитр")},
+    **{alias: (DIMENSION_VOLUME, 1000.0) for alias in ("l", "litr", "литр", "л")},
+    **{alias: (DIMENSION_VOLUME, 15.0) for alias in ("qoshiq", "osh qoshiq")},
+    **{alias: (DIMENSION_VOLUME, 250.0) for alias in ("stakan",)},
+    **{alias: (DIMENSION_COUNT, 1.0) for alias in ("dona", "шт")},
+}
+
+
+def infer_unit_dimension(name: str, short_name: str) -> Tuple[Optional[str], Optional[float]]:
+    """Ma'lum birlik bo'lsa (o'lcham, koeffitsiyent), aks holda (None, None)."""
+    for key in (short_name, name):
+        known = KNOWN_UNITS.get((key or "").lower().strip())
+        if known:
+            return known
+    return None, None
+
+
+class UnitConversionTable:
+    """
+    Birliklar konvertatsiya jadvali (o'zgarmas). `factors[(a, b)]` - a birligidagi miqdorni b birligiga o'tkazish
+    koeffitsiyenti (faqat bir xil o'lchamdagi birliklar uchun).
+    """
+
+    def __init__(self, units: Iterable[Tuple[int, Optional[str], Optional[float]]]):
+        units = list(units)
+        self.unit_ids = frozenset(unit_id for unit_id, _, _ in units)
+        self.units: Dict[int, Tuple[str, float]] = {
+            unit_id: (dimension, base_factor) for unit_id, dimension, base_factor in units
+            if dimension in DIMENSIONS and base_factor and base_factor > 0
+        }
+        self.factors: Dict[Tuple[int, int], float] = {
+            (from_id, to_id): from_factor / to_factor
+            for from_id, (from_dimension, from_factor) in self.units.items()
+            for to_id, (to_dimension, to_factor) in self.units.items()
+            if from_dimension == to_dimension
+        }
+
+    def convert(self, quantity: float, from_unit_id: int, to_unit_id: int,
+                density: Optional[float] = None) -> Optional[float]:
+        """
+        `from_unit_id` dagi miqdorni `to_unit_id` ga o'tkazadi. Konvertatsiya qilib bo'lmasa (masalan, "dona" va
+        "kg", yoki zichliksiz "qoshiq" va "kg") None.
+        """
+        if from_unit_id == to_unit_id:
+            return quantity
+        factor = self.factors.get((from_unit_id, to_unit_id))
+        if factor is not None:
+            return quantity * factor
+        if not density or density <= 0:
+            return None
+        from_unit, to_unit = self.units.get(from_unit_id), self.units.get(to_unit_id)
+        if from_unit is None or to_unit is None:
+            return None
+        (from_dimension, from_factor), (to_dimension, to_factor) = from_unit, to_unit
+        if from_dimension == DIMENSION_VOLUME and to_dimension == DIMENSION_MASS:
+            return quantity * from_factor * density / to_factor  # ml * g/ml = g
+        if from_dimension == DIMENSION_MASS and to_dimension == DIMENSION_VOLUME:
+            return quantity * from_factor / density / to_factor  # g / (g/ml) = ml
+        return None
+
+
+_cached_table: Optional[UnitConversionTable] = None
+_cache_lock = threading.Lock()
+
+
+def get_conversion_table(db: Session, unit_ids: Iterable[int] = ()) -> UnitConversionTable:
+    """
+    Keshdagi jadval. Jadvalda yo'q birlik so'ralsa (boshqa processda yaratilgan), jadval bazadan qayta yuklanadi.
+    """
+    global _cached_table
+    table = _cached_table
+    if table is not None and table.unit_ids.issuperset(unit_ids):
+        return table
+    with _cache_lock:
+        if _cached_table is None or _cached_table is table:  # Boshqa thread hali qayta yuklamagan bo'lsa
+            _cached_table = UnitConversionTable(
+                db.query(models.Unit.id, models.Unit.dimension, models.Unit.base_factor).all())
+        return _cached_table
+
+
+def invalidate_cache() -> None:
+    global _cached_table
+    with _cache_lock:
+        _cached_table = None
@@ -57,13 +57,14 @@ def create_initial_data(db: Session):
 
     # 3. Asosiy o'lchov birliklarini yaratish
     units_to_create = [
-        schemas.UnitCreate(name="gramm", short_name="gr"),
-        schemas.UnitCreate(name="kilogramm", short_name="kg"),
-        schemas.UnitCreate(name="litr", short_name="l"),
-        schemas.UnitCreate(name="millilitr", short_name="ml"),
-        schemas.UnitCreate(name="dona", short_name="dona"),
-        schemas.UnitCreate(name="qoshiq", short_name="qoshiq"),
-        schemas.UnitCreate(name="stakan", short_name="stakan"),
+        # base_factor - o'lcham asosiy birligida: gramm, millilitr yoki dona
+        schemas.UnitCreate(name="gramm", short_name="gr", dimension="mass", base_factor=1.0),
+        schemas.UnitCreate(name="kilogramm", short_name="kg", dimension="mass", base_factor=1000.0),
+        schemas.UnitCreate(name="litr", short_name="l", dimension="volume", base_factor=1000.0),
+        schemas.UnitCreate(name="millilitr", short_name="ml", dimension="volume", base_factor=1.0),
+        schemas.UnitCreate(name="dona", short_name="dona", dimension="count", base_factor=1.0),
+        schemas.UnitCreate(name="qoshiq", short_name="qoshiq", dimension="volume", base_factor=15.0),
+        schemas.UnitCreate(name="stakan", short_name="stakan", dimension="volume", base_factor=250.0),
     ]
     for unit_data in units_to_create:
         unit = crud.get_unit_by_name(db, name=unit_data.name)
@@ -1,6 +1,11 @@
 # app/websockets/connection_manager.py
-from typing import List, Dict, Optional, Union
-from fastapi import WebSocket, WebSocketException # status ni ws_status deb nomladim
+import asyncio
+import json
+import time
+from typing import List, Dict, Optional, Union, Any, Set, Iterable
+from fastapi import WebSocket, status as ws_status
+
+from app.config import settings
 
 
 # schemas.py dan WebSocketMessage sxemasini import qilishimiz kerak
@@ -13,81 +18,324 @@ from fastapi import WebSocket, WebSocketException # status ni ws_status deb noml
 # Keling, bu yerda WebSocketMessage ga bog'liqlikni kamaytiramiz va
 # xabarlarni dict ko'rinishida qabul qilamiz. Xabarni formatlash main.py yoki tasklarda bo'ladi.
 
+# Topic nomlari: "role:<rol nomi>" (ulanishda avtomatik), "product:<id>" (klient o'zi obuna bo'ladi)
+ROLE_TOPIC_PREFIX = "role:"
+PRODUCT_TOPIC_PREFIX = "product:"
+
+
+def role_topic(role_name: str) -> str:
+    return f"{ROLE_TOPIC_PREFIX}{role_name}"
+
+
+def product_topic(product_id: int) -> str:
+    return f"{PRODUCT_TOPIC_PREFIX}{product_id}"
+
+
+def is_client_subscribable_topic(topic: str) -> bool:
+    # Klient faqat mahsulot topiclariga obuna bo'la oladi; rol topiclari serverda belgilanadi
+    return topic.startswith(PRODUCT_TOPIC_PREFIX) and topic[len(PRODUCT_TOPIC_PREFIX):].isdigit()
+
+
+def _parse_stream_id(stream_id: str):
+    # event_stream.parse_stream_id bilan bir xil ("<ms>-<seq>"); bu modul Redisga bog'liq bo'lmasligi uchun nusxa
+    milliseconds, _, sequence = stream_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def _serialize(message_data: Union[str, dict, list]) -> str:
+    # Starlette send_json bilan bir xil format; broadcastda faqat bir marta bajariladi
+    if isinstance(message_data, str):
+        return message_data
+    return json.dumps(message_data, ensure_ascii=False, separators=(",", ":"))
+
+
+class ClientConnection:
+    """
+    Bitta WebSocket ulanishi: chegaralangan chiquvchi navbat va uni yozuvchi alohida task.
+    Sekin klient faqat o'z navbatini to'ldiradi, boshqa klientlarga yuborishni kechiktirmaydi.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, max_queue_size: int, send_timeout: float):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.closed = False
+        self.topics: Set[str] = set()
+        # Qayta ulanishda replay tugaguncha jonli xabarlar shu yerda ushlab turiladi (None - to'g'ridan-to'g'ri navbatga)
+        self.held: Optional[List[str]] = None
+        # Metrikalar (lag = navbatga qo'yilgandan yuborilguncha o'tgan vaqt)
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def start(self, on_failure):
+        self.writer_task = asyncio.create_task(self._writer(on_failure))
+
+    def enqueue(self, text: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait((text, time.perf_counter()))
+            return True
+        except asyncio.QueueFull:
+            self.messages_dropped += 1
+            return False
+
+    async def enqueue_wait(self, text: str) -> bool:
+        """Navbatda joy bo'lguncha kutadi (ko'pi bilan `send_timeout`): replay kabi ketma-ket ko'p xabarlar uchun."""
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self.queue.put((text, time.perf_counter())), timeout=self.send_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.messages_dropped += 1
+            return False
+
+    async def _writer(self, on_failure):
+        while True:
+            text, enqueued_at = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=self.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                print(f"WARN:     WS send to user {self.user_id} timed out after {self.send_timeout}s. Disconnecting.")
+                on_failure(self, ws_status.WS_1013_TRY_AGAIN_LATER, "Send timeout")
+                return
+            except Exception as e:
+                print(f"WARN:     Could not send WS message to user {self.user_id}: {e}. Disconnecting.")
+                on_failure(self, None, None)
+                return
+            lag_ms = (time.perf_counter() - enqueued_at) * 1000
+            self.messages_sent += 1
+            self.last_lag_ms = lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def matches(self, topics: Optional[List[str]], user_ids: Optional[List[int]]) -> bool:
+        """Xabar shu ulanishga tegishlimi (ConnectionManager.route bilan bir xil qoida)."""
+        if topics is None and user_ids is None:
+            return True
+        return bool(user_ids and self.user_id in user_ids) or bool(topics and self.topics.intersection(topics))
+
+    async def close(self, code: Optional[int] = None, reason: Optional[str] = None):
+        self.closed = True
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code, reason=reason)
+            except Exception:
+                pass  # Ulanish allaqachon yopilgan bo'lishi mumkin
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "topics": sorted(self.topics),
+            "client": f"{self.websocket.client.host}:{self.websocket.client.port}" if self.websocket.client else None,
+            "connected_seconds": round(time.time() - self.connected_at, 1),
+            "queue_depth": self.queue.qsize(),
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "last_lag_ms": round(self.last_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+        }
+
+
 class ConnectionManager:
-    def __init__(self):
-        # Har bir user_id uchun WebSocket ulanishini saqlaymiz
-        # Bir foydalanuvchi bir nechta qurilmadan yoki tabdan ulanishi mumkin,
-        # shuning uchun List[WebSocket] ishlatish yaxshiroq bo'lishi mumkin.
-        # Hozircha, har bir user_id uchun bitta oxirgi ulanishni saqlaymiz.
-        self.active_connections: Dict[int, WebSocket] = {} # user_id: WebSocket
-
-    async def connect(self, websocket: WebSocket, user_id: int):
+    """
+    WebSocket ulanishlari reyestri. Bitta foydalanuvchi bir nechta ulanishga (tab/qurilma) ega bo'lishi mumkin.
+    Ulanishlar foydalanuvchi va topic (rol, mahsulot kuzatuvchilari) bo'yicha indekslanadi, shuning uchun
+    xabarni yo'naltirish barcha ulanishlar soniga emas, faqat obunachilar soniga bog'liq.
+    """
+
+    def __init__(self, max_queue_size: int = 100, send_timeout: float = 5.0, max_connections_per_user: int = 5):
+        self.active_connections: Dict[int, Set[ClientConnection]] = {}  # user_id: {ClientConnection, ...}
+        self.topic_subscribers: Dict[str, Set[ClientConnection]] = {}  # topic: {ClientConnection, ...}
+        self.max_queue_size = max_queue_size
+        self.send_timeout = send_timeout
+        self.max_connections_per_user = max_connections_per_user
+        self.slow_clients_disconnected = 0
+
+    async def connect(self, websocket: WebSocket, user_id: int, role_name: Optional[str] = None,
+                      hold_live: bool = False) -> ClientConnection:
+        """
+        `hold_live=True` - qayta ulanish (replay): jonli xabarlar `release_held` chaqirilguncha ushlab turiladi,
+        shunda klient o'tkazib yuborgan xabarlarni jonli (yangiroq) xabarlardan oldin oladi.
+        """
         await websocket.accept()
-        # Agar shu user_id bilan eski ulanish bo'lsa, uni yopish mumkin (ixtiyoriy)
-        # if user_id in self.active_connections:
-        #     old_ws = self.active_connections[user_id]
-        #     try:
-        #         await old_ws.close(code=ws_status.WS_1001_GOING_AWAY, reason="Yangi ulanish o'rnatildi")
-        #     except Exception:
-        #         pass # Yopishda xatolik bo'lsa e'tibor bermaslik
-        self.active_connections[user_id] = websocket
-        print(f"INFO:     User {user_id} connected via WebSocket from: {websocket.client.host}:{websocket.client.port}")
-
-    def disconnect(self, user_id: int, websocket: Optional[WebSocket] = None):
-        # Agar websocket parametri berilsa va u saqlangan ulanish bilan bir xil bo'lsa, o'chirish
-        # Bu bir foydalanuvchining bir nechta ulanishini boshqarish uchun foydali bo'lishi mumkin
-        if websocket and user_id in self.active_connections and self.active_connections[user_id] == websocket:
-            del self.active_connections[user_id]
-            print(f"INFO:     User {user_id} (specific websocket) disconnected from WebSocket.")
-        elif not websocket and user_id in self.active_connections: # Agar faqat user_id berilsa
-            del self.active_connections[user_id]
-            print(f"INFO:     User {user_id} (any websocket) disconnected from WebSocket.")
-        # Agar ulanish topilmasa, hech narsa qilmaymiz
+        connection = ClientConnection(websocket, user_id, self.max_queue_size, self.send_timeout)
+        if hold_live:
+            connection.held = []
+        user_connections = self.active_connections.setdefault(user_id, set())
+        if len(user_connections) >= self.max_connections_per_user:
+            # Limitdan oshsa eng eski ulanish yopiladi
+            oldest = min(user_connections, key=lambda c: c.connected_at)
+            self.disconnect(oldest)
+            await oldest.close(ws_status.WS_1008_POLICY_VIOLATION, "Too many connections")
+        self.active_connections.setdefault(user_id, set()).add(connection)
+        if role_name:
+            self.subscribe(connection, [role_topic(role_name)])
+        connection.start(self._on_connection_failure)
+        print(f"INFO:     User {user_id} connected via WebSocket from: {websocket.client.host}:{websocket.client.port} "
+              f"({len(self.active_connections[user_id])} connection(s))")
+        return connection
 
-    async def send_personal_message(self, message_data: Union[str, dict, list], user_id: int):
+    def disconnect(self, connection: ClientConnection):
+        user_connections = self.active_connections.get(connection.user_id)
+        if not user_connections or connection not in user_connections:
+            return  # Allaqachon o'chirilgan
+        user_connections.discard(connection)
+        if not user_connections:
+            del self.active_connections[connection.user_id]
+        for topic in list(connection.topics):
+            self._remove_from_topic(connection, topic)
+        connection.closed = True
+        if connection.writer_task and connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+        print(f"INFO:     User {connection.user_id} disconnected from WebSocket.")
+
+    def subscribe(self, connection: ClientConnection, topics: Iterable[str]):
+        for topic in topics:
+            connection.topics.add(topic)
+            self.topic_subscribers.setdefault(topic, set()).add(connection)
+
+    def unsubscribe(self, connection: ClientConnection, topics: Iterable[str]):
+        for topic in topics:
+            connection.topics.discard(topic)
+            self._remove_from_topic(connection, topic)
+
+    def _remove_from_topic(self, connection: ClientConnection, topic: str):
+        subscribers = self.topic_subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.topic_subscribers[topic]
+
+    def _on_connection_failure(self, connection: ClientConnection, code: Optional[int], reason: Optional[str]):
+        self.disconnect(connection)
+        asyncio.create_task(connection.close(code or ws_status.WS_1011_INTERNAL_ERROR, reason))
+
+    def _enqueue(self, connection: ClientConnection, text: str):
+        if not connection.enqueue(text):
+            self._enqueue_overflow(connection)
+
+    async def _enqueue_wait(self, connection: ClientConnection, text: str):
+        if not await connection.enqueue_wait(text):
+            self._enqueue_overflow(connection)
+
+    def _enqueue_overflow(self, connection: ClientConnection):
+        # Navbat to'lgan: klient xabarlarni o'qishga ulgurmayapti - uzamiz (qayta ulanadi)
+        if connection.closed:
+            return  # Allaqachon uzilgan - keyingi xabarlar uchun qayta loglanmaydi va yopilmaydi
+        print(f"WARN:     WS outbound queue for user {connection.user_id} is full ({self.max_queue_size}). Disconnecting slow client.")
+        self.slow_clients_disconnected += 1
+        self.disconnect(connection)
+        asyncio.create_task(connection.close(ws_status.WS_1013_TRY_AGAIN_LATER, "Client too slow"))
+
+    def _deliver_live(self, connection: ClientConnection, text: str):
+        if connection.held is None:
+            self._enqueue(connection, text)
+        elif len(connection.held) < self.max_queue_size:
+            connection.held.append(text)
+        else:
+            connection.held = None  # Replay paytida navbat chegarasidan oshdi - sekin klient kabi uziladi
+            self._enqueue_overflow(connection)
+
+    async def release_held(self, connection: ClientConnection, replayed_until: Optional[str] = None):
         """
-        Xabarni JSON formatida (agar dict yoki list bo'lsa) yoki matn sifatida yuboradi.
+        Replay tugagach ushlab turilgan jonli xabarlarni navbatga qo'yadi (joy bo'lishini kutib; shu orada kelganlari
+        ham tartib bilan qo'shiladi). `stream_id` si `replayed_until` dan katta bo'lmaganlari (replay allaqachon
+        yuborgan) tashlanadi.
         """
-        if user_id in self.active_connections:
-            websocket = self.active_connections[user_id]
-            try:
-                if isinstance(message_data, str):
-                    await websocket.send_text(message_data)
-                else: # dict, list, Pydantic model (model_dump qilingan)
-                    await websocket.send_json(message_data)
-                # print(f"DEBUG:    Sent personal WS message to user {user_id}: {str(message_data)[:100]}...")
-            except WebSocketException as e:
-                print(f"WARN:     Could not send personal WS message to user {user_id} (WebSocketException: {e.reason}). Disconnecting.")
-                self.disconnect(user_id, websocket)
-            except RuntimeError as e: # Masalan, "Unexpected ASGI message..."
-                print(f"WARN:     Runtime error sending WS message to user {user_id}: {e}. Disconnecting.")
-                self.disconnect(user_id, websocket)
-            except Exception as e:
-                print(f"ERROR:    Unexpected error sending WS message to user {user_id}: {e}. Disconnecting.")
-                self.disconnect(user_id, websocket)
+        while connection.held and not connection.closed:
+            text = connection.held.pop(0)
+            if replayed_until is not None:
+                stream_id = json.loads(text).get("stream_id") if text.startswith("{") else None
+                if stream_id and _parse_stream_id(stream_id) <= _parse_stream_id(replayed_until):
+                    continue
+            await self._enqueue_wait(connection, text)
+        connection.held = None
+
+    async def _send_to_connections(self, message_data: Union[str, dict, list], connections: Iterable[ClientConnection]):
+        text = _serialize(message_data)  # Bir marta serializatsiya
+        for connection in list(connections):
+            self._deliver_live(connection, text)
+        # Yozuvchi tasklarga navbat beramiz: ketma-ket kelgan xabarlar to'plami navbatlarni to'ldirib yubormasin
+        await asyncio.sleep(0)
 
+    async def send_to_connection(self, message_data: Union[str, dict, list], connection: ClientConnection,
+                                 wait_for_space: bool = False):
+        """
+        Xabarni faqat bitta ulanishga (masalan, ping yuborgan tabga) yuboradi.
+        `wait_for_space=True` - navbat to'lgan bo'lsa yozuvchi bo'shatishini kutadi (replay); klient `send_timeout`
+        ichida o'qimasa, sekin klient sifatida uziladi.
+        """
+        if wait_for_space:
+            await self._enqueue_wait(connection, _serialize(message_data))
+        else:
+            self._enqueue(connection, _serialize(message_data))
+
+    async def send_personal_message(self, message_data: Union[str, dict, list], user_id: int):
+        """
+        Xabarni foydalanuvchining barcha ulanishlariga JSON (dict/list) yoki matn sifatida yuboradi.
+        """
+        await self._send_to_connections(message_data, self.active_connections.get(user_id, ()))
 
     async def broadcast_to_specific_users(self, message_data: Union[str, dict, list], user_ids: List[int]):
         """
         Xabarni berilgan user_id ro'yxatidagi foydalanuvchilarga yuboradi.
         """
-        for user_id in user_ids:
-            # send_personal_message o'zi xatoliklarni qayta ishlaydi va disconnect qiladi
-            await self.send_personal_message(message_data, user_id)
+        await self.route(message_data, user_ids=user_ids)
+
+    async def broadcast_to_topics(self, message_data: Union[str, dict, list], topics: List[str]):
+        """
+        Xabarni topic(lar) obunachilariga yuboradi (bir nechta topicga obuna ulanish bir marta oladi).
+        """
+        await self.route(message_data, topics=topics)
 
     async def broadcast_to_all_active(self, message_data: Union[str, dict, list]):
         """
-        Xabarni barcha aktiv ulangan foydalanuvchilarga yuboradi.
+        Xabarni barcha aktiv ulanishlarga yuboradi. Yuborishni kutmaydi:
+        har bir ulanishning o'z navbatiga qo'yadi, yozuvchi tasklar parallel yuboradi.
         """
-        # active_connections dict ni iterate qilganda o'zgartirmaslik uchun .copy() yoki list() ishlatish
-        # print(f"DEBUG:    Broadcasting WS message to all {len(self.active_connections)} active clients: {str(message_data)[:100]}...")
-        if not self.active_connections: # Agar hech kim ulanmagan bo'lsa
+        if not self.active_connections:  # Agar hech kim ulanmagan bo'lsa
             return
+        await self._send_to_connections(
+            message_data, [c for connections in self.active_connections.values() for c in connections])
+
+    async def route(self, message_data: Union[str, dict, list], topics: Optional[List[str]] = None,
+                    user_ids: Optional[List[int]] = None):
+        """
+        Xabarni topiclar va/yoki foydalanuvchilar bo'yicha yo'naltiradi; ikkalasi ham berilmasa - hammaga.
+        """
+        if topics is None and user_ids is None:
+            await self.broadcast_to_all_active(message_data)
+            return
+        recipients: Set[ClientConnection] = set()
+        for topic in topics or ():
+            recipients.update(self.topic_subscribers.get(topic, ()))
+        for user_id in user_ids or ():
+            recipients.update(self.active_connections.get(user_id, ()))
+        if recipients:
+            await self._send_to_connections(message_data, recipients)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        connections = [c for user_connections in self.active_connections.values() for c in user_connections]
+        return {
+            "active_users": len(self.active_connections),
+            "active_connections": len(connections),
+            "max_queue_size": self.max_queue_size,
+            "slow_clients_disconnected": self.slow_clients_disconnected,
+            "topics": {topic: len(subscribers) for topic, subscribers in self.topic_subscribers.items()},
+            "connections": [connection.metrics() for connection in connections],
+        }
 
-        user_ids_to_broadcast = list(self.active_connections.keys()) # Joriy ulanganlar ro'yxati
-        for user_id in user_ids_to_broadcast:
-            # send_personal_message o'zi xatoliklarni qayta ishlaydi
-            await self.send_personal_message(message_data, user_id)
 
 # Global ConnectionManager obyektini yaratamiz
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager(max_queue_size=settings.WS_SEND_QUEUE_MAXSIZE, send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+                            max_connections_per_user=settings.WS_MAX_CONNECTIONS_PER_USER)
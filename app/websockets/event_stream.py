@@ -0,0 +1,67 @@
+# app/websockets/event_stream.py
+# WebSocket xabarlari Redis Stream (settings.WS_EVENT_STREAM) orqali uzatiladi.
+# Pub/Sub dan farqli, xabar listener ulanmagan paytda ham yo'qolmaydi: har bir worker o'z consumer groupiga ega
+# va qayta ulanganda to'xtagan joyidan davom etadi; klientlar esa `since` cursor bilan o'tkazib yuborganlarini oladi.
+import re
+from typing import List, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+
+from app.config import settings
+from app.websockets import presence
+
+STREAM_ID_RE = re.compile(r"^\d+(-\d+)?$")
+
+
+def parse_stream_id(stream_id: str) -> Tuple[int, int]:
+    milliseconds, _, sequence = stream_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def is_valid_stream_id(stream_id: Optional[str]) -> bool:
+    return bool(stream_id) and bool(STREAM_ID_RE.match(stream_id))
+
+
+async def ensure_consumer_group(client: aioredis.Redis, group: str):
+    """Worker consumer groupini yaratadi (mavjud bo'lsa - to'xtagan joyidan davom etadi)."""
+    try:
+        await client.xgroup_create(settings.WS_EVENT_STREAM, group, id="$", mkstream=True)
+        print(f"INFO:     Created consumer group '{group}' on stream '{settings.WS_EVENT_STREAM}'.")
+    except redis.exceptions.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def cleanup_dead_worker_groups(client: aioredis.Redis, own_group: str):
+    """To'xtagan (heartbeati yo'q) workerlarning consumer grouplarini o'chiradi."""
+    groups = await client.xinfo_groups(settings.WS_EVENT_STREAM)
+    for group_info in groups:
+        group = group_info["name"]
+        if group == own_group:
+            continue
+        if not await client.exists(f"{presence.WORKER_ALIVE_KEY_PREFIX}{group}"):
+            await client.xgroup_destroy(settings.WS_EVENT_STREAM, group)
+            print(f"INFO:     Removed consumer group of stopped worker '{group}'.")
+
+
+async def read_events_since(client: aioredis.Redis, since: str, limit: int) -> Tuple[List[Tuple[str, dict]], bool]:
+    """
+    `since` dan keyingi (eksklyuziv) xabarlarni qaytaradi: (entries, truncated).
+    truncated=True - `since` streamdan allaqachon kesib tashlangan yoki xabarlar `limit` dan ko'p;
+    bunday holatda klient ma'lumotlarni REST orqali qayta yuklashi kerak.
+    """
+    try:
+        stream_info = await client.xinfo_stream(settings.WS_EVENT_STREAM)
+    except redis.exceptions.ResponseError:
+        return [], False  # Stream hali yaratilmagan - o'tkazib yuborilgan xabar yo'q
+
+    entries = await client.xrange(settings.WS_EVENT_STREAM, min=f"({since}", max="+", count=limit + 1)
+    truncated = len(entries) > limit
+    # Redis 7+: entries-added == length bo'lsa, streamdan hech narsa kesilmagan
+    nothing_trimmed = stream_info.get("entries-added") == stream_info.get("length")
+    first_entry = stream_info.get("first-entry")
+    if not nothing_trimmed and first_entry and parse_stream_id(first_entry[0]) > parse_stream_id(since):
+        # Streamning eng eski xabari ham `since` dan keyin - orada MAXLEN bilan kesilgan xabarlar bo'lishi mumkin
+        truncated = True
+    return entries[:limit], truncated
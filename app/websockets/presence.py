@@ -0,0 +1,57 @@
+# app/websockets/presence.py
+# Ko'p workerli rejim (uvicorn --workers N): har bir worker o'z IDsi bilan Redisda "tirik" deb belgilanadi.
+# Heartbeati to'xtagan workerning Redis Stream consumer groupi boshqa workerlar tomonidan tozalanadi.
+import asyncio
+import os
+import socket
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+# Worker identifikatori: WS_WORKER_ID (masalan, pod nomi) yoki hostname + process id
+WORKER_ID = f"{settings.WS_WORKER_ID or socket.gethostname()}-{os.getpid()}"
+
+WORKER_ALIVE_KEY_PREFIX = "ws:worker:alive:"  # TTL li kalit: worker tirikligi (heartbeat)
+WORKER_HEARTBEAT_SECONDS = 10
+WORKER_ALIVE_TTL_SECONDS = 30
+
+_async_client: Optional[aioredis.Redis] = None
+
+
+def get_async_redis() -> aioredis.Redis:
+    """Worker ichidagi umumiy asinxron Redis klienti (heartbeat, replay va h.k. uchun)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
+    return _async_client
+
+
+async def refresh_heartbeat():
+    await get_async_redis().set(f"{WORKER_ALIVE_KEY_PREFIX}{WORKER_ID}", 1, ex=WORKER_ALIVE_TTL_SECONDS)
+
+
+async def worker_heartbeat_loop():
+    """Worker tirikligini Redisda yangilab turadi; lifespan ichida task sifatida ishlaydi."""
+    while True:
+        try:
+            await refresh_heartbeat()
+        except asyncio.CancelledError:
+            raise
+        except (redis.exceptions.RedisError, OSError) as e:
+            print(f"WARN:     WebSocket worker heartbeat failed: {e}")
+        await asyncio.sleep(WORKER_HEARTBEAT_SECONDS)
+
+
+async def unregister_worker():
+    global _async_client
+    if _async_client is None:
+        return
+    try:
+        await _async_client.delete(f"{WORKER_ALIVE_KEY_PREFIX}{WORKER_ID}")
+        await _async_client.aclose()
+    except (redis.exceptions.RedisError, OSError):
+        pass
+    _async_client = None
@@ -0,0 +1,39 @@
+# app/websockets/publisher.py
+# Routerlar va Celery tasklari WebSocket xabarlarini shu yerdan Redis Streamga (XADD) yozadi.
+# Redis listener (redis_listener.py) xabarni o'qib, `topics`/`user_ids` bo'yicha kerakli ulanishlarga yo'naltiradi.
+from typing import Any, List, Optional
+
+import redis
+
+from app.celery_config import redis_client_for_celery_config as redis_client, WS_EVENT_STREAM
+from app.config import settings
+from app.schemas import WebSocketMessage
+from app.websockets.connection_manager import role_topic, product_topic
+
+
+def publish_ws_message(message_type: str, payload: Any, topics: Optional[List[str]] = None,
+                       user_ids: Optional[List[int]] = None) -> bool:
+    """
+    WebSocket xabarini Redis Streamga qo'shadi (MAXLEN bilan cheklangan).
+    `topics` va `user_ids` berilmasa, xabar barcha ulangan klientlarga tarqatiladi.
+    Ma'lumotlar bazasi allaqachon commit qilingan bo'ladi, shuning uchun xatolik ko'tarilmaydi - False qaytadi.
+    """
+    if redis_client is None:
+        print(f"WARN:     Redis client is not available, WebSocket message '{message_type}' not published.")
+        return False
+    try:
+        ws_message_obj = WebSocketMessage(type=message_type, payload=payload, topics=topics, user_ids=user_ids)
+        redis_client.xadd(WS_EVENT_STREAM, {"data": ws_message_obj.model_dump_json()},
+                          maxlen=settings.WS_EVENT_STREAM_MAXLEN, approximate=True)
+        return True
+    except redis.exceptions.RedisError as e:
+        print(f"ERROR:    Could not publish WebSocket message '{message_type}' to Redis: {e}")
+        return False
+
+
+def staff_topics(*role_names: str) -> List[str]:
+    return [role_topic(role_name) for role_name in role_names]
+
+
+def product_watcher_topics(product_ids: List[int]) -> List[str]:
+    return [product_topic(product_id) for product_id in product_ids]
@@ -0,0 +1,146 @@
+# app/websockets/redis_listener.py
+# Redis Streamdagi xabarlarni WebSocket klientlariga uzatuvchi asinxron listener.
+# redis.asyncio ishlatiladi: xabar kutish (XREADGROUP BLOCK) event loopni bloklamaydi.
+import asyncio
+import random
+from collections import OrderedDict
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+from pydantic import ValidationError
+
+from app import schemas
+from app.config import settings
+from app.celery_config import WS_EVENT_STREAM
+from app.websockets.connection_manager import manager as ws_manager, ClientConnection
+from app.websockets import presence, event_stream
+
+RECONNECT_BACKOFF_MIN_SECONDS = 0.5
+RECONNECT_BACKOFF_MAX_SECONDS = 30.0
+HEALTH_CHECK_INTERVAL_SECONDS = 30  # Jim turgan ulanish uzilib qolganini aniqlash uchun PING
+READ_BLOCK_MILLISECONDS = 5000
+READ_BATCH_SIZE = 100
+DEDUPE_CACHE_SIZE = 10000  # Oxirgi yetkazilgan xabar IDlari (bir xabar ikki marta kelsa, qayta yuborilmaydi)
+
+_recent_message_ids: "OrderedDict[str, None]" = OrderedDict()
+
+
+def _is_duplicate(message_id: str) -> bool:
+    if message_id in _recent_message_ids:
+        return True
+    _recent_message_ids[message_id] = None
+    if len(_recent_message_ids) > DEDUPE_CACHE_SIZE:
+        _recent_message_ids.popitem(last=False)
+    return False
+
+
+def _parse_stream_entry(entry_id: str, fields: dict) -> Optional[schemas.WebSocketMessage]:
+    try:
+        # Xabarni WebSocketMessage sxemasiga validatsiya qilish
+        message_obj = schemas.WebSocketMessage.model_validate_json(fields.get("data") or "")
+    except ValidationError as ve:
+        print(f"ERROR:    WebSocketMessage validation error from Redis stream entry {entry_id}: {ve.errors()}")
+        return None
+    message_obj.stream_id = entry_id
+    return message_obj
+
+
+def _client_message(message_obj: schemas.WebSocketMessage) -> dict:
+    # Yo'naltirish maydonlari klientga yuborilmaydi
+    return message_obj.model_dump(mode='json', exclude={"topics", "user_ids"})
+
+
+async def _dispatch_stream_entry(entry_id: str, fields: dict):
+    message_obj = _parse_stream_entry(entry_id, fields)
+    if message_obj is None or _is_duplicate(message_obj.id):
+        return
+    try:
+        await ws_manager.route(_client_message(message_obj), topics=message_obj.topics, user_ids=message_obj.user_ids)
+    except Exception as e:
+        print(f"ERROR:    Error broadcasting message from Redis via WebSocket: {e}")
+
+
+async def replay_missed_events(connection: ClientConnection, since: str) -> Optional[str]:
+    """
+    Qayta ulangan klientga `since` dan keyin o'tkazib yuborgan (unga tegishli) xabarlarni yuboradi.
+    Qaytaradi: replay qamrab olgan oxirgi `stream_id` (`since` noto'g'ri bo'lsa None). Ulanish `hold_live` bilan
+    ochilgan bo'lsa, shu paytdagi jonli xabarlar ushlab turiladi va keyin `ws_manager.release_held` bilan
+    (replay yuborganlari tashlanib) tartib bilan yuboriladi.
+    """
+    if not event_stream.is_valid_stream_id(since):
+        await ws_manager.send_to_connection(
+            {"type": "error_message", "payload": {"detail": "`since` formati noto'g'ri."}}, connection)
+        return None
+    try:
+        entries, truncated = await event_stream.read_events_since(presence.get_async_redis(), since,
+                                                                  settings.WS_REPLAY_MAX_EVENTS)
+    except (redis.exceptions.RedisError, OSError) as e:
+        print(f"ERROR:    Could not replay WebSocket events for user {connection.user_id}: {e}")
+        truncated, entries = True, []
+
+    if truncated:
+        # Hammasini qayta yuborib bo'lmaydi - klient ma'lumotlarni REST orqali yangilashi kerak
+        await ws_manager.send_to_connection(
+            {"type": "replay_truncated", "payload": {"since": since, "detail": "Ma'lumotlarni qayta yuklang."}},
+            connection, wait_for_space=True)
+    for entry_id, fields in entries:
+        if connection.closed:
+            return None
+        message_obj = _parse_stream_entry(entry_id, fields)
+        if message_obj is not None and connection.matches(message_obj.topics, message_obj.user_ids):
+            # Replay navbat hajmidan (WS_SEND_QUEUE_MAXSIZE) ko'p bo'lishi mumkin - yozuvchini kutamiz
+            await ws_manager.send_to_connection(_client_message(message_obj), connection, wait_for_space=True)
+    return entries[-1][0] if entries else since
+
+
+async def redis_message_listener():
+    """
+    Redis Streamni workerning o'z consumer groupi orqali o'qiydi va xabarlarni WebSocket klientlariga yuboradi.
+    Har bir worker alohida groupga ega, shuning uchun hamma worker barcha xabarlarni oladi va faqat o'z soketlariga
+    yetkazadi. Redis bilan aloqa uzilsa, eksponensial backoff (jitter bilan) bilan qayta ulanadi va group
+    to'xtagan joyidan davom etadi (shu orada qo'shilgan xabarlar yo'qolmaydi).
+    FastAPI lifespan ichida `asyncio.create_task` orqali ishga tushiriladi va bekor qilish (cancel) bilan to'xtatiladi.
+    """
+    backoff = RECONNECT_BACKOFF_MIN_SECONDS
+    group = consumer = presence.WORKER_ID
+    while True:
+        client = aioredis.Redis.from_url(settings.CELERY_BROKER_URL, decode_responses=True,
+                                         health_check_interval=HEALTH_CHECK_INTERVAL_SECONDS)
+        try:
+            # Group yaratilishidan oldin heartbeat - boshqa workerlar uni "o'lik" deb o'chirmasligi uchun
+            await presence.refresh_heartbeat()
+            await event_stream.ensure_consumer_group(client, group)
+            await event_stream.cleanup_dead_worker_groups(client, group)
+            print(f"INFO:     Reading Redis stream '{WS_EVENT_STREAM}' as consumer group '{group}'")
+            backoff = RECONNECT_BACKOFF_MIN_SECONDS  # Muvaffaqiyatli ulanishdan keyin backoff qayta boshlanadi
+
+            read_id = "0"  # Avval tasdiqlanmagan (pending) xabarlar, keyin yangilari
+            while True:
+                response = await client.xreadgroup(group, consumer, {WS_EVENT_STREAM: read_id},
+                                                   count=READ_BATCH_SIZE, block=READ_BLOCK_MILLISECONDS)
+                entries = response[0][1] if response else []
+                if read_id == "0" and not entries:
+                    read_id = ">"
+                    continue
+                for entry_id, fields in entries:
+                    await _dispatch_stream_entry(entry_id, fields)
+                if entries:
+                    await client.xack(WS_EVENT_STREAM, group, *[entry_id for entry_id, _ in entries])
+        except asyncio.CancelledError:
+            raise
+        except redis.exceptions.ResponseError as e:
+            # Masalan, NOGROUP: group boshqa worker tomonidan o'chirilgan - qayta yaratamiz
+            print(f"ERROR:    Redis stream error in listener: {e}. Retrying in {backoff:.1f}s...")
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError) as e:
+            print(f"ERROR:    Redis connection error in listener: {e}. Reconnecting in {backoff:.1f}s...")
+        except Exception as e:
+            print(f"ERROR:    Redis stream listener failed: {e}. Restarting in {backoff:.1f}s...")
+        finally:
+            try:
+                await client.aclose()
+            except Exception:
+                pass
+
+        await asyncio.sleep(backoff * (1 + random.random() * 0.2))
+        backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX_SECONDS)
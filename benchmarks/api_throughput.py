@@ -0,0 +1,76 @@
+# benchmarks/api_throughput.py
+"""
+API o'tkazuvchanligi (throughput) yuklama testi (ishlayotgan serverga qarshi).
+
+Tanlangan endpointlarga har xil parallellik darajasida (`--concurrency 1,2,4,8,16,32`) so'rovlar yuboriladi
+va har bir daraja uchun req/s hamda p50/p95/p99 chiqariladi. Sinxron DB ishlari event loopda bajarilganda
+(async def + sinxron Session) throughput parallellik oshishi bilan o'smasdi - so'rovlar bittadan bajarilardi,
+yuqori parallellikda esa worker DB pool ulanishini kutib qotib qolardi. Endi bu ishlar threadpoolda
+(THREADPOOL_MAX_WORKERS) bajariladi.
+
+Ishga tushirish (server va Redis ishlayotgan bo'lishi kerak; httpx kerak: pip install httpx):
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.api_throughput --base-url http://localhost:8000 --requests 400
+    python -m benchmarks.api_throughput --path /api/products/ --path "/api/notifications/?limit=50"
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.ws_latency import _print_stats
+
+# Ilgari `async def` bo'lib, sinxron DB so'rovlarini event loopda bajargan endpointlar
+DEFAULT_PATHS = [
+    "/api/notifications/?limit=50",
+    "/api/reports/monthly/",
+    "/api/reports/visualization/ingredient-consumption?start_date=2000-01-01&end_date=2100-01-01",
+    "/api/reports/visualization/product-delivery-trends?start_date=2000-01-01&end_date=2100-01-01",
+]
+
+
+async def run_level(client, paths, requests_total, concurrency):
+    latencies_ms = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(paths[i % len(paths)])
+            if response.status_code >= 400:
+                errors += 1
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests_total)))
+    return latencies_ms, errors, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="adminpassword")
+    parser.add_argument("--path", action="append", dest="paths", help=f"Standart: {', '.join(DEFAULT_PATHS)}")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="Vergul bilan ajratilgan darajalar")
+    parser.add_argument("--requests", type=int, default=400, help="Har bir daraja uchun so'rovlar soni")
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        response = await client.post("/api/auth/token", data={"username": args.username, "password": args.password})
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        await run_level(client, paths, min(args.requests, 20), 1)  # Isitish (auth keshi, DB ulanishlari)
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            latencies_ms, errors, elapsed = await run_level(client, paths, args.requests, concurrency)
+            _print_stats(f"concurrency={concurrency:<3} req/s={len(latencies_ms) / elapsed:8.1f} errors={errors}",
+                         latencies_ms)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+# benchmarks/explain_queries.py
+"""
+Hisobot va vizualizatsiya so'rovlarining EXPLAIN QUERY PLAN regressiya tekshiruvi (SQLite).
+
+Vaqtinchalik bazada (modellardagi indekslar bilan) namunaviy ma'lumot yaratiladi, so'ng hisobot
+generatsiyasi, grafik ma'lumotlari, qoldiq jurnali va bildirishnomalar funksiyalari chaqiriladi.
+Ular yuborgan har bir SELECT uchun EXPLAIN QUERY PLAN olinadi: katta (jurnal) jadvallardan birini
+indekssiz to'liq o'qish ("SCAN meal_servings", "SCAN serving_details", ...) topilsa, skript 1 kodi bilan
+tugaydi - yangi so'rov yoki o'chirilgan indeks CI da darhol ko'rinadi.
+
+Ishga tushirish (loyiha ildizidan):
+    python -m benchmarks.explain_queries
+    python -m benchmarks.explain_queries --verbose   # Barcha so'rovlar rejasi bilan
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+# app.config majburiy sozlamalarsiz ham import bo'lishi uchun (skript o'z engineini yaratadi)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("CELERY_BROKER_URL", "redis://localhost:6379/0")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import create_db_engine
+from benchmarks.serving_stress import _setup
+
+# Vaqt o'tishi bilan o'sadigan jadvallar - ularni to'liq o'qish (SCAN) regressiya hisoblanadi.
+# Kichik ma'lumotnoma jadvallari (products, units, meals, ...) to'liq o'qilishi mumkin.
+HOT_TABLES = {"meal_servings", "serving_details", "product_deliveries", "notifications", "meal_ingredients",
+              "product_monthly_balances", "report_ingredient_details", "report_meal_performance",
+              "meal_recipe_versions", "meal_recipe_version_items"}
+
+# SQLite >= 3.36: "SCAN meal_servings", eski versiyalar: "SCAN TABLE meal_servings"
+FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def _seed(session_factory, months: int, servings_per_month: int):
+    user_id, product_id, meal_id = _setup(session_factory, stock_quantity=1_000_000.0, portion_grams=10.0)
+    db = session_factory()
+    try:
+        recipe_version_id = db.get(models.Meal, meal_id).current_recipe_version_id
+        first_day = date.today().replace(day=1)
+        for month_offset in range(months):
+            month_start = datetime.combine((first_day - timedelta(days=31 * month_offset)).replace(day=1),
+                                           datetime.min.time())
+            for i in range(servings_per_month):
+                served_at = month_start + timedelta(hours=i)
+                serving = models.MealServing(meal_id=meal_id, portions_served=1, served_by=user_id,
+                                             served_at=served_at, recipe_version_id=recipe_version_id)
+                db.add(serving)
+                db.flush()
+                db.add(models.ServingDetail(serving_id=serving.id, product_id=product_id, quantity_used=0.01))
+                db.add(models.ProductDelivery(product_id=product_id, quantity=1.0, received_by=user_id,
+                                              delivery_date=served_at))
+        notification_type = crud.create_notification_type(db, schemas.NotificationTypeCreate(name="explain_test"))
+        for i in range(50):
+            db.add(models.Notification(user_id=user_id if i % 2 else None, notification_type_id=notification_type.id,
+                                       message=f"Test {i}", is_read=bool(i % 3)))
+        db.commit()
+        return user_id, product_id, meal_id
+    finally:
+        db.close()
+
+
+def _run_queries(session_factory, user_id: int, product_id: int, months: int, capture):
+    today = date.today()
+    period_start = (today.replace(day=1) - timedelta(days=31 * months)).replace(day=1)
+    db = session_factory()
+    try:
+        capture("visualization: ingredient consumption",
+                lambda: crud.get_ingredient_consumption_data(db, period_start, today))
+        capture("visualization: ingredient consumption (product)",
+                lambda: crud.get_ingredient_consumption_data(db, period_start, today, product_id))
+        capture("visualization: delivery trends", lambda: crud.get_product_delivery_trends(db, period_start, today))
+        capture("visualization: delivery trends (product)",
+                lambda: crud.get_product_delivery_trends(db, period_start, today, product_id))
+
+        # Eng eski oydan boshlab: keyingi oylar oldingi hisobot snapshotidan foydalanadi
+        for month_offset in reversed(range(1, months)):
+            month_day = (today.replace(day=1) - timedelta(days=31 * month_offset)).replace(day=1)
+            capture(f"report: generate {month_day:%Y-%m}",
+                    lambda: crud.generate_monthly_report_db_only(db, month_day.year, month_day.month, user_id))
+            db.commit()
+        if months > 1:  # Yopilgan oy hisoboti final - qayta so'rov saqlangan hisobotni qaytaradi
+            capture("report: final (cached)",
+                    lambda: crud.generate_monthly_report_db_only(db, month_day.year, month_day.month, user_id))
+        capture("report: list", lambda: crud.get_monthly_reports_list(db))
+        for report in crud.get_monthly_reports_list(db, limit=1):
+            capture("report: details", lambda: crud.get_monthly_report_with_all_details(db, report.id))
+
+        capture("stock: at date", lambda: crud._get_product_stock_at_date(db, product_id, today))
+        capture("stock: ledger", lambda: crud._get_product_quantity_from_ledger(db, product_id))
+        capture("servings: date range",
+                lambda: crud.get_meal_servings(db, start_date=period_start, end_date=today))
+        capture("notifications: all", lambda: crud.get_notifications_for_user(db, user_id))
+        capture("notifications: unread", lambda: crud.get_notifications_for_user(db, user_id, unread_only=True))
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=3, help="Namunaviy ma'lumot necha oy uchun")
+    parser.add_argument("--servings-per-month", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true", help="Barcha so'rovlar rejasini chiqarish")
+    args = parser.parse_args()
+
+    engine = create_db_engine(f"sqlite:///{tempfile.mkdtemp()}/explain.db")
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    user_id, product_id, _ = _seed(session_factory, args.months, args.servings_per_month)
+
+    current_label = [None]
+    statements = []  # (label, sql, parameters), takrorlanmasdan
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _collect(conn, cursor, statement, parameters, context, executemany):
+        if current_label[0] and statement.lstrip().upper().startswith("SELECT") and not executemany:
+            if all(statement != seen_sql for _, seen_sql, _ in statements):
+                statements.append((current_label[0], statement, parameters))
+
+    def capture(label, fn):
+        current_label[0] = label
+        try:
+            fn()
+        finally:
+            current_label[0] = None
+
+    _run_queries(session_factory, user_id, product_id, args.months, capture)
+
+    failures = 0
+    with engine.connect() as connection:
+        for label, sql, parameters in statements:
+            plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+            full_scans = [m.group(1) for m in map(FULL_SCAN_RE.match, plan) if m and m.group(1) in HOT_TABLES]
+            if full_scans:
+                failures += 1
+            if full_scans or args.verbose:
+                status = f"FULL SCAN: {', '.join(full_scans)}" if full_scans else "ok"
+                print(f"[{label}] {status}\n  {' '.join(sql.split())}")
+                for step in plan:
+                    print(f"    {step}")
+    engine.dispose()
+
+    print(f"{len(statements)} ta so'rov tekshirildi, {failures} tasida katta jadval indekssiz o'qilmoqda.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
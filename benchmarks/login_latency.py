@@ -0,0 +1,94 @@
+# benchmarks/login_latency.py
+"""
+Parallel loginlar paytida API javob vaqti benchmarki (ishlayotgan serverga qarshi).
+
+1. Bo'sh serverda GET /api/auth/me kechikishi o'lchanadi (bazaviy qiymat).
+2. Keyin N ta login (POST /api/auth/token) parallel yuboriladi va shu vaqtda har `--probe-interval`
+   soniyada /api/auth/me so'raladi. bcrypt event loopda bajarilganda har bir login (~250 ms) workerdagi
+   barcha so'rovlarni to'xtatib qo'yardi - probe kechikishi loginlar soniga proporsional o'sardi.
+   Endi bcrypt PASSWORD_HASH_WORKERS ta threadli poolda, probe kechikishi bazaviy qiymatga yaqin qolishi kerak.
+
+Ishga tushirish (server va Redis ishlayotgan bo'lishi kerak; httpx kerak: pip install httpx):
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.login_latency --base-url http://localhost:8000 --logins 40 --login-concurrency 8
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.ws_latency import _print_stats
+
+
+async def login(client, username, password):
+    response = await client.post("/api/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def probe_until(client, stop_event, interval):
+    latencies_ms = []
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/auth/me")
+        response.raise_for_status()
+        latencies_ms.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies_ms
+
+
+async def run_logins(client, username, password, logins, concurrency):
+    latencies_ms = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await login(client, username, password)
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(logins)))
+    return latencies_ms
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="adminpassword")
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    parser.add_argument("--probes", type=int, default=100, help="Bazaviy o'lchov uchun so'rovlar soni")
+    parser.add_argument("--probe-interval", type=float, default=0.02, help="Probe so'rovlari orasidagi pauza (s)")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        token = await login(client, args.username, args.password)
+        probe_client = httpx.AsyncClient(base_url=args.base_url, timeout=60,
+                                         headers={"Authorization": f"Bearer {token}"})
+        try:
+            baseline_ms = []
+            for _ in range(args.probes):
+                started = time.perf_counter()
+                (await probe_client.get("/api/auth/me")).raise_for_status()
+                baseline_ms.append((time.perf_counter() - started) * 1000)
+            _print_stats("GET /api/auth/me (idle)", baseline_ms)
+
+            stop_event = asyncio.Event()
+            prober = asyncio.create_task(probe_until(probe_client, stop_event, args.probe_interval))
+            started = time.perf_counter()
+            login_ms = await run_logins(client, args.username, args.password, args.logins, args.login_concurrency)
+            elapsed = time.perf_counter() - started
+            stop_event.set()
+            probe_ms = await prober
+        finally:
+            await probe_client.aclose()
+
+    _print_stats(f"POST /api/auth/token (concurrency={args.login_concurrency})", login_ms)
+    print(f"logins/s: {len(login_ms) / elapsed:.2f}")
+    _print_stats("GET /api/auth/me (during logins)", probe_ms)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+# benchmarks/portion_matrix.py
+"""
+Mumkin bo'lgan porsiyalarni hisoblash: ovqatma-ovqat Python hisobi va numpy talab matritsasi solishtiriladi.
+
+Vaqtinchalik SQLite bazada `--meals` ta ovqat (har birida `--ingredients` ta ingredient, turli birliklarda)
+va `--products` ta mahsulot (qoldiqlari bilan) yaratiladi. O'lchanadi:
+  - python: retseptlarni yuklash + har bir ovqat uchun min (avvalgi yo'l);
+  - matrix build: matritsani qurish (faqat retseptlar o'zgarganda);
+  - matrix compute: qoldiqlar vektori bo'yicha barcha ovqatlar uchun bitta vektorlashgan floor-min;
+  - update_all_possible_meal_portions: to'liq yo'l (fingerprint + qoldiqlar + hisob + upsert), kesh issiq holda.
+Ikkala yo'l natijalari (porsiyalar) bir xil ekani tekshiriladi.
+
+Ishga tushirish (loyiha ildizidan; numpy kerak):
+    python -m benchmarks.portion_matrix --meals 500 --products 2000 --ingredients 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+# app.config majburiy sozlamalarsiz ham import bo'lishi uchun (benchmark o'z engineini yaratadi)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("CELERY_BROKER_URL", "redis://localhost:6379/0")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, portion_matrix, unit_conversion
+from app.database import create_db_engine
+
+# Retseptdagi birlik mahsulotning asosiy birligiga konvertatsiya qilinadigan juftliklar
+RECIPE_UNITS = {"kg": ["gr", "kg"], "gr": ["gr", "kg"], "l": ["ml", "l"], "ml": ["ml", "l"], "dona": ["dona"]}
+
+
+def _seed(session_factory, meals: int, products: int, ingredients: int, seed: int):
+    rng = random.Random(seed)
+    db = session_factory()
+    try:
+        unit_ids = {}
+        for short_name in RECIPE_UNITS:
+            dimension, base_factor = unit_conversion.infer_unit_dimension(short_name, short_name)
+            unit = models.Unit(name=f"unit_{short_name}", short_name=short_name, dimension=dimension,
+                               base_factor=base_factor)
+            db.add(unit)
+            db.flush()
+            unit_ids[short_name] = unit.id
+
+        now = datetime.now()
+        product_units = [rng.choice(list(RECIPE_UNITS)) for _ in range(products)]
+        db.execute(insert(models.Product), [
+            {"id": i + 1, "name": f"Mahsulot {i + 1}", "unit_id": unit_ids[u], "min_quantity": 1.0,
+             "created_at": now, "updated_at": now} for i, u in enumerate(product_units)
+        ])
+        db.execute(insert(models.ProductStock), [
+            # Taxminan 5% mahsulot omborda yo'q (0 porsiya holatlari ham tekshirilsin)
+            {"product_id": i + 1, "quantity": 0.0 if rng.random() < 0.05 else rng.uniform(0.5, 500.0),
+             "updated_at": now} for i in range(products)
+        ])
+        db.execute(insert(models.Meal), [
+            {"id": m + 1, "name": f"Ovqat {m + 1}", "is_active": True, "created_at": now, "updated_at": now}
+            for m in range(meals)
+        ])
+        ingredient_rows = []
+        for m in range(meals):
+            for product_id in rng.sample(range(1, products + 1), ingredients):
+                recipe_unit = rng.choice(RECIPE_UNITS[product_units[product_id - 1]])
+                quantity = rng.uniform(1.0, 300.0) if recipe_unit in ("gr", "ml") else rng.uniform(0.01, 2.0)
+                # Asosiy birlikdagi miqdor - create_meal kabi, bir xil o'lchamdagi birliklar koeffitsiyenti bo'yicha
+                base_quantity = quantity * unit_conversion.KNOWN_UNITS[recipe_unit][1] / \
+                    unit_conversion.KNOWN_UNITS[product_units[product_id - 1]][1]
+                ingredient_rows.append({"meal_id": m + 1, "product_id": product_id, "quantity_per_portion": quantity,
+                                        "unit_id": unit_ids[recipe_unit], "quantity_per_portion_base": base_quantity,
+                                        "created_at": now, "updated_at": now})
+        db.execute(insert(models.MealIngredient), ingredient_rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _timed(fn, repeat: int):
+    timings_ms = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings_ms.append((time.perf_counter() - started) * 1000)
+    return result, sorted(timings_ms)[len(timings_ms) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meals", type=int, default=500)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--ingredients", type=int, default=10, help="Har bir ovqatdagi ingredientlar soni")
+    parser.add_argument("--repeat", type=int, default=5, help="Har bir o'lchov necha marta (mediana)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if portion_matrix.np is None:
+        parser.error("numpy o'rnatilmagan (pip install numpy)")
+
+    engine = create_db_engine(f"sqlite:///{tempfile.mkdtemp()}/portion_matrix.db")
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    _seed(session_factory, args.meals, args.products, args.ingredients, args.seed)
+
+    db = session_factory()
+    try:
+        def python_path():
+            db.expunge_all()
+            meals = crud._load_active_meals_with_recipes(db)
+            stock_map = crud._get_stock_map(db, (mi.product_id for m in meals for mi in m.ingredients))
+            return {meal.id: crud._calculate_possible_portions(meal, stock_map) for meal in meals}
+
+        def matrix_build():
+            db.expunge_all()
+            portion_matrix.invalidate_cache()
+            return crud.get_portion_matrix(db)
+
+        python_result, python_ms = _timed(python_path, args.repeat)
+        matrix, build_ms = _timed(matrix_build, args.repeat)
+        stock = matrix.stock_vector(crud._get_stock_map(db, matrix.product_ids_for_meals()))
+        _, compute_ms = _timed(lambda: matrix.compute(stock), args.repeat * 20)
+        matrix_result, warm_ms = _timed(
+            lambda: crud.get_portion_matrix(db).possible_portions(
+                crud._get_stock_map(db, matrix.product_ids_for_meals())), args.repeat)
+        _, update_all_ms = _timed(lambda: crud.update_all_possible_meal_portions(db), args.repeat)
+    finally:
+        db.close()
+        engine.dispose()
+
+    portion_mismatches = sum(python_result[m][0] != matrix_result[m][0] for m in python_result)
+    limiting_mismatches = sum(python_result[m][1] != matrix_result[m][1] for m in python_result)
+    print(f"meals={args.meals} products={args.products} ingredients/meal={args.ingredients} "
+          f"(nnz={len(matrix.requirements)})")
+    print(f"python (load + per-meal min):                  {python_ms:8.2f} ms")
+    print(f"matrix build (load, on recipe change):          {build_ms:8.2f} ms")
+    print(f"matrix compute (vectorized floor-min):          {compute_ms:8.3f} ms")
+    print(f"matrix warm (fingerprint + stock + compute):    {warm_ms:8.2f} ms")
+    print(f"update_all_possible_meal_portions (warm):       {update_all_ms:8.2f} ms")
+    print(f"portion mismatches: {portion_mismatches}, limiting product mismatches: {limiting_mismatches}")
+    assert portion_mismatches == 0, "Matritsa natijasi Python hisobidan farq qilmoqda"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# benchmarks/sqlite_write_throughput.py
+"""
+SQLite yozish o'tkazuvchanligi: PRAGMAsiz engine va settings dagi profil (WAL, synchronous=NORMAL,
+busy_timeout, cache_size, mmap_size, temp_store) solishtiriladi.
+
+Har bir profil uchun vaqtinchalik faylda baza yaratiladi. `--writers` ta thread mahsulot kirimini yozadi
+(product_deliveries + product_stock, har biri alohida commit - API va Celery yozuvchilari kabi),
+`--readers` ta thread esa shu vaqtda mahsulotlar ro'yxatini o'qiydi (dashboard polling).
+Natija: yozish/s, o'qish/s va "database is locked" xatolari soni.
+
+Ishga tushirish (loyiha ildizidan):
+    python -m benchmarks.sqlite_write_throughput --writes 2000 --writers 8 --readers 4
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# app.config majburiy sozlamalarsiz ham import bo'lishi uchun (benchmark o'z engineini yaratadi)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("CELERY_BROKER_URL", "redis://localhost:6379/0")
+os.environ.setdefault("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.database import create_db_engine, get_sqlite_pragmas
+from benchmarks.serving_stress import _setup
+
+
+def _write_once(session_factory, product_id: int, user_id: int) -> str:
+    db = session_factory()
+    try:
+        crud.create_product_delivery(db, schemas.ProductDeliveryCreate(product_id=product_id, quantity=1.0), user_id)
+        db.commit()
+        return "ok"
+    except OperationalError as e:
+        db.rollback()
+        return "locked" if "locked" in str(e) else "error"
+    finally:
+        db.close()
+
+
+def _read_until(session_factory, stop_event: threading.Event) -> int:
+    reads = 0
+    while not stop_event.is_set():
+        db = session_factory()
+        try:
+            crud.get_all_products_with_current_quantity(db, limit=100)
+            reads += 1
+        except OperationalError:
+            pass
+        finally:
+            db.close()
+    return reads
+
+
+def run_profile(name: str, pragmas: dict, args) -> None:
+    database_url = f"sqlite:///{tempfile.mkdtemp()}/write_throughput.db"
+    engine = create_db_engine(database_url, sqlite_pragmas=pragmas,
+                              pool_size=args.writers + args.readers, max_overflow=0)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    user_id, product_id, _ = _setup(session_factory, stock_quantity=1.0, portion_grams=100.0)
+
+    stop_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=args.readers or 1) as readers_pool:
+        readers = [readers_pool.submit(_read_until, session_factory, stop_event) for _ in range(args.readers)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.writers) as writers_pool:
+            outcomes = list(writers_pool.map(lambda _: _write_once(session_factory, product_id, user_id),
+                                             range(args.writes)))
+        elapsed = time.perf_counter() - started
+        stop_event.set()
+        reads = sum(reader.result() for reader in readers)
+
+    db = session_factory()
+    try:
+        stored_quantity = crud.get_product_current_quantity(db, product_id)
+    finally:
+        db.close()
+    engine.dispose()
+
+    ok = outcomes.count("ok")
+    print(f"[{name}] pragmas={pragmas or '-'}")
+    print(f"[{name}] writes: {ok}/{args.writes} in {elapsed:.2f}s ({ok / elapsed:.1f}/s), "
+          f"locked={outcomes.count('locked')} errors={outcomes.count('error')}; reads: {reads} ({reads / elapsed:.1f}/s)")
+    assert abs(stored_quantity - (1.0 + ok)) < 1e-6, "Qoldiq muvaffaqiyatli yozuvlar soniga mos emas"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writes", type=int, default=2000, help="Har bir profil uchun jami yozuvlar")
+    parser.add_argument("--writers", type=int, default=8, help="Parallel yozuvchi threadlar")
+    parser.add_argument("--readers", type=int, default=4, help="Parallel o'quvchi threadlar")
+    args = parser.parse_args()
+
+    run_profile("default", {}, args)
+    run_profile("tuned", get_sqlite_pragmas(), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/ws_latency.py
+"""
+WebSocket yetkazish kechikishi va API javob vaqti benchmarki (ishlayotgan serverga qarshi).
+
+1. Redis Streamga (WS_EVENT_STREAM) N ta "latency_probe" xabari yoziladi va ular
+   /api/ws orqali qancha vaqtda yetib kelgani o'lchanadi (XADD -> WebSocket).
+2. Listener bo'sh turgan paytda GET /api/auth/me ga parallel so'rovlar yuborilib, p50/p95/p99 o'lchanadi.
+   Sinxron get_message(timeout=0.5) ishlatilgan eski listener bu yerda yuzlab ms ga kechiktirardi.
+
+Ishga tushirish (server va Redis ishlayotgan bo'lishi kerak; httpx kerak: pip install httpx):
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.ws_latency --base-url http://localhost:8000 --username admin --password adminpassword
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+import redis.asyncio as aioredis
+import websockets
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "max": ordered[-1],
+            "mean": statistics.fmean(ordered)}
+
+
+def _print_stats(title, samples_ms):
+    if not samples_ms:
+        print(f"{title}: no samples")
+        return
+    stats = _percentiles(samples_ms)
+    print(f"{title}: n={len(samples_ms)} " + " ".join(f"{k}={v:.2f}ms" for k, v in stats.items()))
+
+
+async def measure_ws_delivery(ws_url, redis_url, stream, messages, interval):
+    latencies_ms = []
+    sent_at = {}
+    async with websockets.connect(ws_url) as ws:
+        json.loads(await ws.recv())  # connection_ack
+        publisher = aioredis.Redis.from_url(redis_url, decode_responses=True)
+
+        async def receive():
+            while len(latencies_ms) < messages:
+                data = json.loads(await ws.recv())
+                if data.get("type") != "latency_probe":
+                    continue
+                seq = data["payload"]["seq"]
+                if seq in sent_at:
+                    latencies_ms.append((time.perf_counter() - sent_at.pop(seq)) * 1000)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            for seq in range(messages):
+                sent_at[seq] = time.perf_counter()
+                await publisher.xadd(stream, {"data": json.dumps({"type": "latency_probe", "payload": {"seq": seq}})})
+                await asyncio.sleep(interval)
+            await asyncio.wait_for(receiver, timeout=10)
+        except asyncio.TimeoutError:
+            print(f"WARN: {len(sent_at)} probe(s) not delivered within 10s")
+            receiver.cancel()
+        finally:
+            await publisher.aclose()
+    return latencies_ms
+
+
+async def measure_api(base_url, headers, requests_total, concurrency):
+    latencies_ms = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=30) as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/api/auth/me")
+                response.raise_for_status()
+                latencies_ms.append((time.perf_counter() - started) * 1000)
+
+        await asyncio.gather(*(one() for _ in range(requests_total)))
+    return latencies_ms
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="adminpassword")
+    parser.add_argument("--redis-url", default=None, help="Standart: settings.CELERY_BROKER_URL")
+    parser.add_argument("--stream", default=None, help="Standart: settings.WS_EVENT_STREAM")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="Xabarlar orasidagi pauza (s)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.redis_url is None or args.stream is None:
+        from app.config import settings
+        args.redis_url = args.redis_url or settings.CELERY_BROKER_URL
+        args.stream = args.stream or settings.WS_EVENT_STREAM
+
+    async with httpx.AsyncClient(base_url=args.base_url) as client:
+        response = await client.post("/api/auth/token", data={"username": args.username, "password": args.password})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+
+    ws_url = args.base_url.replace("http", "ws", 1) + f"/api/ws?token={token}"
+    ws_latencies = await measure_ws_delivery(ws_url, args.redis_url, args.stream, args.messages, args.interval)
+    _print_stats("xadd -> websocket", ws_latencies)
+
+    api_latencies = await measure_api(args.base_url, {"Authorization": f"Bearer {token}"}, args.requests,
+                                      args.concurrency)
+    _print_stats("GET /api/auth/me (listener idle)", api_latencies)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
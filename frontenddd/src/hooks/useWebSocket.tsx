@@ -1,18 +1,33 @@
 
 import { useEffect, useRef, useState } from 'react';
+import { useQueryClient } from '@tanstack/react-query';
 import { useAuth } from '@/hooks/useAuth';
 
 interface WebSocketMessage {
   type: string;
   data: any;
+  stream_id?: string;
 }
 
+// Redis Stream ID: "<ms>-<seq>"
+const compareStreamIds = (a: string, b: string) => {
+  const [aMs, aSeq = '0'] = a.split('-');
+  const [bMs, bSeq = '0'] = b.split('-');
+  return Number(aMs) - Number(bMs) || Number(aSeq) - Number(bSeq);
+};
+
+// replay_truncated: o'tkazib yuborilgan xabarlarning hammasini qayta yuborib bo'lmadi - shu ma'lumotlar REST dan qayta olinadi
+const REFETCH_ON_REPLAY_TRUNCATED = [['products'], ['available-meals'], ['meals'], ['servings'], ['notifications']];
+
 export const useWebSocket = () => {
   const [isConnected, setIsConnected] = useState(false);
   const [messages, setMessages] = useState<WebSocketMessage[]>([]);
   const ws = useRef<WebSocket | null>(null);
   const { isAuthenticated, user } = useAuth();
+  const queryClient = useQueryClient();
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
+  // Oxirgi olingan xabar: qayta ulanishda o'tkazib yuborilganlarni olish uchun (since)
+  const lastStreamIdRef = useRef<string | null>(null);
 
   useEffect(() => {
     if (!isAuthenticated || !user) return;
@@ -26,7 +41,8 @@ export const useWebSocket = () => {
           return;
         }
 
-        ws.current = new WebSocket(`ws://127.0.0.1:8000/ws?token=${token}`);
+        const since = lastStreamIdRef.current ? `&since=${encodeURIComponent(lastStreamIdRef.current)}` : '';
+        ws.current = new WebSocket(`ws://127.0.0.1:8000/ws?token=${token}${since}`);
         
         ws.current.onopen = () => {
           console.log('WebSocket connected');
@@ -41,6 +57,19 @@ export const useWebSocket = () => {
         ws.current.onmessage = (event) => {
           try {
             const message: WebSocketMessage = JSON.parse(event.data);
+            if (message.type === 'replay_truncated') {
+              // Eski holat ishonchsiz: cursor va xabarlar tashlanadi, ma'lumotlar qayta yuklanadi
+              console.warn('WebSocket replay truncated, refetching data');
+              lastStreamIdRef.current = null;
+              setMessages([]);
+              REFETCH_ON_REPLAY_TRUNCATED.forEach(queryKey => queryClient.invalidateQueries({ queryKey }));
+              return;
+            }
+            if (message.stream_id) {
+              // Server qayta ulanishda avval replayni, keyin jonli xabarlarni stream_id tartibida yuboradi - bu faqat takrorlarni tashlaydi
+              if (lastStreamIdRef.current && compareStreamIds(message.stream_id, lastStreamIdRef.current) <= 0) return;
+              lastStreamIdRef.current = message.stream_id;
+            }
             setMessages(prev => [...prev.slice(-9), message]); // Faqat oxirgi 10 ta xabarni saqlash
             console.log('WebSocket message received:', message);
           } catch (error) {
@@ -81,7 +110,7 @@ export const useWebSocket = () => {
         ws.current.close(1000, 'Component unmounting');
       }
     };
-  }, [isAuthenticated, user]);
+  }, [isAuthenticated, user, queryClient]);
 
   const sendMessage = (message: any) => {
     if (ws.current && ws.current.readyState === WebSocket.OPEN) {